@@ -0,0 +1,131 @@
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables from .env in the project root
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+ALERT_STATE_REDIS_DB = int(os.getenv("ALERT_STATE_REDIS_DB", "1"))
+# 'edge' notifies a symbol only when it starts matching a scanner; 'level' notifies on every tick it matches
+SCANNER_ALERT_MODE = os.getenv("SCANNER_ALERT_MODE", "edge").lower()
+# Consecutive non-matching ticks before a symbol can alert again (1 = re-arm as soon as it stops matching)
+SCANNER_ALERT_REARM_TICKS = int(os.getenv("SCANNER_ALERT_REARM_TICKS", "1"))
+
+# Assigns every symbol a stable position in the per-filter state arrays, atomically across processes
+_SYMBOL_INDEX_LUA = """
+local indices = {}
+for i, symbol in ipairs(ARGV) do
+    local index = redis.call('HGET', KEYS[1], symbol)
+    if not index then
+        index = redis.call('HLEN', KEYS[1])
+        redis.call('HSET', KEYS[1], symbol, index)
+    end
+    indices[i] = tonumber(index)
+end
+return indices
+"""
+
+# --- Alert State ---
+class AlertStateStore:
+    """
+    Remembers per (filter, symbol) whether a scanner alert is armed, so notifications go out only
+    when a symbol starts matching (false -> true) instead of on every tick it keeps matching.
+    Each filter's state is one byte per symbol, indexed by a global symbol position:
+    0 = armed, n > 0 = fired and re-armed after n more non-matching ticks (hysteresis).
+    Stored as one Redis string per filter when REDIS_HOST is set (shared by the bot and the
+    Celery workers), otherwise in memory.
+    """
+
+    def __init__(self, rearm_ticks: int = SCANNER_ALERT_REARM_TICKS, redis_host: str = REDIS_HOST):
+        self.rearm_ticks = max(1, min(rearm_ticks, 255))
+        self._redis_host = redis_host
+        self._redis = None
+        self._symbol_index_script = None
+        self._symbol_indices = {} # symbol -> position
+        self._states = {} # filter_id -> np.ndarray[uint8] (in-memory fallback)
+        self.stats = {'matches': 0, 'notified': 0, 'suppressed': 0}
+
+    def _get_redis(self):
+        if self._redis is None and self._redis_host:
+            try:
+                import redis.asyncio as aioredis
+                self._redis = aioredis.Redis(host=self._redis_host, port=REDIS_PORT, db=ALERT_STATE_REDIS_DB)
+                self._symbol_index_script = self._redis.register_script(_SYMBOL_INDEX_LUA)
+            except ImportError:
+                print("هشدار: کتابخانه redis نصب نیست. وضعیت هشدارهای اسکنر فقط در حافظه نگهداری می‌شود.")
+                self._redis_host = None
+        return self._redis
+
+    def warn_if_process_local(self, process_name: str):
+        """Warns when state falls back to memory in a process (e.g. a Celery worker) that must share it."""
+        if not self._get_redis():
+            print(f"هشدار: REDIS_HOST برای {process_name} تنظیم نشده است. وضعیت هشدارهای اسکنر فقط در حافظه همین پردازش "
+                  f"نگهداری می‌شود و بین پردازش‌ها و با ربات به اشتراک گذاشته نمی‌شود.")
+
+    async def _symbol_positions(self, symbols: list) -> np.ndarray:
+        unknown = [symbol for symbol in dict.fromkeys(symbols) if symbol not in self._symbol_indices]
+        if unknown:
+            redis_client = self._get_redis()
+            if redis_client:
+                indices = await self._symbol_index_script(keys=['alert:symbol_index'], args=unknown)
+                self._symbol_indices.update(zip(unknown, (int(index) for index in indices)))
+            else:
+                for symbol in unknown:
+                    self._symbol_indices[symbol] = len(self._symbol_indices)
+        return np.fromiter((self._symbol_indices[symbol] for symbol in symbols), dtype=np.int64, count=len(symbols))
+
+    async def _load(self, filter_id: int, size: int) -> np.ndarray:
+        redis_client = self._get_redis()
+        if redis_client:
+            raw_state = await redis_client.get(f"alert:state:{filter_id}")
+            state = np.frombuffer(raw_state, dtype=np.uint8).copy() if raw_state else np.zeros(0, dtype=np.uint8)
+        else:
+            state = self._states.get(filter_id, np.zeros(0, dtype=np.uint8))
+        if len(state) < size:
+            state = np.concatenate([state, np.zeros(size - len(state), dtype=np.uint8)])
+        return state
+
+    async def _save(self, filter_id: int, state: np.ndarray):
+        redis_client = self._get_redis()
+        if redis_client:
+            await redis_client.set(f"alert:state:{filter_id}", state.tobytes())
+        else:
+            self._states[filter_id] = state
+
+    async def filter_new_matches(self, filter_id: int, symbols: list, matched: np.ndarray, evaluated: np.ndarray) -> np.ndarray:
+        """
+        Updates the filter's state with this tick's result and returns the mask of symbols to notify:
+        those matching now whose alert was armed. Symbols that were not `evaluated` (no data this tick)
+        keep their state. Falls back to notifying every match if the state cannot be read or written.
+        """
+        self.stats['matches'] += int(matched.sum())
+        try:
+            positions = await self._symbol_positions(symbols)
+            state = await self._load(filter_id, int(positions.max()) + 1 if len(positions) else 0)
+            current = state[positions]
+            armed = current == 0
+            notify = matched & evaluated & armed
+            updated = np.where(matched, self.rearm_ticks, np.where(armed, 0, current - 1)).astype(np.uint8)
+            state[positions] = np.where(evaluated, updated, current)
+            await self._save(filter_id, state)
+        except Exception as e:
+            print(f"خطا در وضعیت هشدار اسکنر {filter_id}، همه نتایج ارسال می‌شوند: {e}")
+            notify = matched
+        self.stats['notified'] += int(notify.sum())
+        self.stats['suppressed'] += int(matched.sum() - notify.sum())
+        return notify
+
+    async def reset(self, filter_id: int):
+        """Re-arms every symbol of a filter, e.g. after its conditions were edited."""
+        self._states.pop(filter_id, None)
+        redis_client = self._get_redis()
+        if redis_client:
+            try:
+                await redis_client.delete(f"alert:state:{filter_id}")
+            except Exception as e:
+                print(f"خطا در پاک کردن وضعیت هشدار اسکنر {filter_id}: {e}")
+
+
+alert_state_store = AlertStateStore()
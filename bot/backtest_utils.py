@@ -0,0 +1,271 @@
+import os
+import asyncio
+import ccxt.async_support as ccxt
+import numpy as np
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+try:
+    from web.models import Filter as DBFilter
+    from bot.cache_utils import timeframe_to_seconds, current_candle_open
+    from bot.chart_utils import get_ccxt_exchange_client, EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY
+    from bot.history_utils import ohlcv_history, HISTORY_COLUMNS, OHLCV_HISTORY_ENABLED
+    from bot.panel_utils import compute_indicator_panel
+    from bot.rate_limiter import get_rate_limiter, PRIORITY_BACKGROUND
+    from bot.scanner_utils import (get_symbols_to_scan, compile_indicator_plan, evaluate_plan, plan_columns,
+                                   SCANNER_SYMBOL_CONCURRENCY, SCANNER_OHLCV_LIMIT)
+except ImportError:
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from web.models import Filter as DBFilter
+    from bot.cache_utils import timeframe_to_seconds, current_candle_open
+    from bot.chart_utils import get_ccxt_exchange_client, EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY
+    from bot.history_utils import ohlcv_history, HISTORY_COLUMNS, OHLCV_HISTORY_ENABLED
+    from bot.panel_utils import compute_indicator_panel
+    from bot.rate_limiter import get_rate_limiter, PRIORITY_BACKGROUND
+    from bot.scanner_utils import (get_symbols_to_scan, compile_indicator_plan, evaluate_plan, plan_columns,
+                                   SCANNER_SYMBOL_CONCURRENCY, SCANNER_OHLCV_LIMIT)
+
+# Load environment variables from .env in the project root
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+DEFAULT_EXCHANGE_NAME = os.getenv("DEFAULT_EXCHANGE_NAME", "binance").lower()
+# Bars after each signal at which the forward return is measured
+BACKTEST_FORWARD_BARS = tuple(int(bars) for bars in os.getenv("BACKTEST_FORWARD_BARS", "1,4,24").split(',') if bars.strip())
+BACKTEST_MAX_DAYS = int(os.getenv("BACKTEST_MAX_DAYS", "1095"))
+BACKTEST_MAX_HITS = int(os.getenv("BACKTEST_MAX_HITS", "500")) # Newest hits kept in the result
+BACKTEST_FETCH_PAGE_SIZE = 1000
+
+# --- Historical Range Fetching ---
+async def _fetch_ohlcv_pages(exchange, exchange_name: str, symbol: str, timeframe: str, since_ms: int, until_ms: int) -> list:
+    """Pages through fetch_ohlcv from since_ms (inclusive) to until_ms (exclusive) at background priority."""
+    timeframe_ms = timeframe_to_seconds(timeframe) * 1000
+    rows = []
+    cursor = since_ms
+    while cursor < until_ms:
+        await get_rate_limiter(exchange_name).acquire('fetch_ohlcv', PRIORITY_BACKGROUND)
+        page = await exchange.fetch_ohlcv(symbol, timeframe, since=cursor, limit=BACKTEST_FETCH_PAGE_SIZE)
+        if not page:
+            break
+        rows.extend(row for row in page if row[0] < until_ms and None not in row[:6])
+        next_cursor = page[-1][0] + timeframe_ms
+        if next_cursor <= cursor:
+            break
+        cursor = next_cursor
+    return rows
+
+async def fetch_ohlcv_range(symbol: str, timeframe: str, since_ms: int, until_ms: int,
+                            exchange_name: str = DEFAULT_EXCHANGE_NAME) -> tuple[dict | None, str | None]:
+    """
+    Returns ({column: np.ndarray}, error) with the candles of [since_ms, until_ms).
+    Candles already in the local history store are read from it; only the missing older part
+    and the missing tail are fetched, and new closed candles are appended to the store,
+    so repeated backtests over the same range barely touch the exchange.
+    """
+    exchange = await get_ccxt_exchange_client(exchange_name, EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY)
+    if not exchange:
+        return None, f"خطا در اتصال به صرافی {exchange_name}."
+    timeframe_ms = timeframe_to_seconds(timeframe) * 1000
+
+    try:
+        stored = ohlcv_history.read(exchange_name, symbol, timeframe) if OHLCV_HISTORY_ENABLED else None
+        pieces = []
+        if stored is None:
+            rows = await _fetch_ohlcv_pages(exchange, exchange_name, symbol, timeframe, since_ms, until_ms)
+            if OHLCV_HISTORY_ENABLED:
+                ohlcv_history.append(exchange_name, symbol, timeframe, rows)
+            pieces.append(np.array(rows, dtype=np.float64).reshape(-1, 6))
+        else:
+            first_stored, last_stored = int(stored['timestamp'][0]), int(stored['timestamp'][-1])
+            if since_ms < first_stored:
+                # The store is append-only, so candles older than its first row are fetched but not stored
+                rows = await _fetch_ohlcv_pages(exchange, exchange_name, symbol, timeframe, since_ms, min(first_stored, until_ms))
+                pieces.append(np.array(rows, dtype=np.float64).reshape(-1, 6))
+            in_range = (stored['timestamp'] >= since_ms) & (stored['timestamp'] < until_ms)
+            pieces.append(np.column_stack([stored[column][in_range] for column in HISTORY_COLUMNS]).astype(np.float64))
+            if last_stored + timeframe_ms < until_ms:
+                rows = await _fetch_ohlcv_pages(exchange, exchange_name, symbol, timeframe, last_stored + timeframe_ms, until_ms)
+                ohlcv_history.append(exchange_name, symbol, timeframe, rows)
+                pieces.append(np.array(rows, dtype=np.float64).reshape(-1, 6))
+    except ccxt.BadSymbol:
+        return None, f"نماد '{symbol}' در صرافی {exchange_name} یافت نشد."
+    except ccxt.NetworkError as e:
+        return None, f"خطای شبکه هنگام دریافت اطلاعات: {e}"
+    except ccxt.ExchangeError as e:
+        return None, f"خطای صرافی هنگام دریافت اطلاعات: {e}"
+    except OSError as e:
+        return None, f"خطا در خواندن تاریخچه محلی {symbol}: {e}"
+
+    candles = np.concatenate(pieces) if pieces else np.empty((0, 6))
+    if len(candles) == 0:
+        return None, f"اطلاعاتی برای نماد {symbol} در این بازه یافت نشد."
+    _, first_rows = np.unique(candles[:, 0], return_index=True) # Sorted by timestamp, duplicates dropped
+    candles = candles[first_rows]
+    return {column: np.ascontiguousarray(candles[:, index]) for index, column in enumerate(HISTORY_COLUMNS)}, None
+
+
+# --- Vectorized Replay ---
+BACKTEST_WINDOW_CHUNK = 2048 # Scanner windows computed per indicator panel, bounding the replay's memory
+
+def evaluate_plan_over_history(plan: dict, close: np.ndarray, lookback: int) -> np.ndarray:
+    """
+    Evaluates a compiled plan at every bar of one symbol the way a scan tick would have seen it:
+    each bar is checked on its own trailing `lookback` candles, so indicators are seeded from the
+    same window the live scanner fetches. Sliding-window views turn those windows into the rows of
+    an indicator panel, and their last bars into the (rows x columns x bars) tensor that
+    scanner_utils.evaluate_plan expects.
+    Returns a boolean mask with one entry per candle (False until the first full window).
+    """
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    candles = len(close)
+    tail = plan['tail']
+    matched = np.zeros(candles, dtype=bool)
+    if candles < lookback or lookback < tail:
+        return matched
+
+    columns = list(dict.fromkeys(['close'] + plan_columns(plan)))
+    column_index = {column: col for col, column in enumerate(columns)}
+    windows = np.lib.stride_tricks.sliding_window_view(close, lookback) # Zero-copy, one row per bar
+    for first in range(0, len(windows), BACKTEST_WINDOW_CHUNK):
+        chunk = windows[first:first + BACKTEST_WINDOW_CHUNK]
+        values = compute_indicator_panel(chunk, plan['specs'], tail)
+        values['close'] = chunk[:, -tail:]
+        matrix = np.stack([values.get(column, np.full((len(chunk), tail), np.nan)) for column in columns], axis=1)
+        mask, _ = evaluate_plan(plan, matrix, column_index)
+        matched[lookback - 1 + first:lookback - 1 + first + len(chunk)] = mask
+    return matched
+
+def forward_returns(close: np.ndarray, bars: int) -> np.ndarray:
+    """Percent return from each candle's close to the close `bars` candles later (NaN where unknown)."""
+    returns = np.full(len(close), np.nan)
+    if bars < len(close):
+        returns[:-bars] = (close[bars:] / close[:-bars] - 1.0) * 100.0
+    return returns
+
+def _to_json_number(value: float, digits: int = 4):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+async def run_filter_backtest(filter_obj: DBFilter, start: datetime, end: datetime, exchange_name: str = DEFAULT_EXCHANGE_NAME,
+                              forward_bars: tuple = BACKTEST_FORWARD_BARS) -> tuple[dict | None, str | None]:
+    """
+    Replays a stored filter over its symbols' candles between start and end (UTC datetimes).
+    Like the live scanner in edge mode, a signal is a bar where the filter starts matching.
+    Returns (result, error_message); result holds the signal count and rate, forward-return stats
+    (count, mean, median, hit_rate = share of positive returns) per horizon and the newest hits.
+    """
+    if end <= start:
+        return None, "تاریخ پایان باید بعد از تاریخ شروع باشد."
+    if (end - start).days > BACKTEST_MAX_DAYS:
+        return None, f"بازه بک‌تست حداکثر {BACKTEST_MAX_DAYS} روز است."
+
+    symbols, error_msg = await get_symbols_to_scan(filter_obj, exchange_name)
+    if error_msg:
+        return None, error_msg
+    plan = compile_indicator_plan(filter_obj.params or {})
+    if not plan['conditions']:
+        return None, "این اسکنر هیچ شرطی ندارد."
+
+    timeframe_ms = timeframe_to_seconds(filter_obj.timeframe) * 1000
+    start_ms, end_ms = int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+    # Each bar is evaluated on the window a scan tick fetches, so the range needs that many candles
+    # of warm-up before it; forward returns need candles after it, up to the newest closed candle
+    lookback = max(SCANNER_OHLCV_LIMIT, plan['min_candles'])
+    forming_ms = int(current_candle_open(filter_obj.timeframe) * 1000)
+    since_ms = start_ms - lookback * timeframe_ms
+    until_ms = min(end_ms + max(forward_bars, default=0) * timeframe_ms, forming_ms)
+
+    semaphore = asyncio.Semaphore(SCANNER_SYMBOL_CONCURRENCY)
+
+    async def fetch_with_limit(symbol: str):
+        async with semaphore:
+            return await fetch_ohlcv_range(symbol, filter_obj.timeframe, since_ms, until_ms, exchange_name)
+
+    fetched = await asyncio.gather(*(fetch_with_limit(symbol) for symbol in symbols))
+
+    def replay() -> dict:
+        evaluated_bars = 0
+        hits = []
+        returns_at_signals = {bars: [] for bars in forward_bars}
+        errors = {}
+        for symbol, (arrays, fetch_error) in zip(symbols, fetched):
+            if fetch_error:
+                errors[symbol] = fetch_error
+                continue
+            closed = arrays['timestamp'] < forming_ms # The candle still forming has no final close yet
+            close, timestamps = arrays['close'][closed], arrays['timestamp'][closed]
+            matched = evaluate_plan_over_history(plan, close, lookback)
+            in_range = (timestamps >= start_ms) & (timestamps < end_ms)
+            signals = matched & ~np.concatenate(([False], matched[:-1])) & in_range
+            evaluated_bars += int(in_range.sum())
+            symbol_returns = {bars: forward_returns(close, bars) for bars in forward_bars}
+            for bars in forward_bars:
+                returns_at_signals[bars].append(symbol_returns[bars][signals])
+            for index in np.flatnonzero(signals):
+                hits.append({
+                    'symbol': symbol,
+                    'timestamp': int(timestamps[index]),
+                    'close': float(close[index]),
+                    'returns': {str(bars): _to_json_number(symbol_returns[bars][index]) for bars in forward_bars},
+                })
+
+        forward_stats = {}
+        for bars, chunks in returns_at_signals.items():
+            values = np.concatenate(chunks) if chunks else np.empty(0)
+            values = values[~np.isnan(values)]
+            forward_stats[str(bars)] = {
+                'count': int(len(values)),
+                'mean': _to_json_number(values.mean()) if len(values) else None,
+                'median': _to_json_number(np.median(values)) if len(values) else None,
+                'hit_rate': _to_json_number((values > 0).mean()) if len(values) else None,
+            }
+        hits.sort(key=lambda hit: hit['timestamp'], reverse=True)
+        for hit in hits:
+            hit['timestamp'] = datetime.fromtimestamp(hit['timestamp'] / 1000, tz=timezone.utc).isoformat()
+        return {
+            'filter_id': filter_obj.id,
+            'filter_name': filter_obj.name,
+            'timeframe': filter_obj.timeframe,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'symbols': len(symbols) - len(errors),
+            'bars': evaluated_bars,
+            'signals': len(hits),
+            'signal_rate': _to_json_number(len(hits) / evaluated_bars, 6) if evaluated_bars else 0.0,
+            'forward_returns': forward_stats,
+            'hits': hits[:BACKTEST_MAX_HITS],
+            'errors': errors,
+        }
+
+    # NumPy/TA-Lib work runs in a thread so the caller's event loop keeps serving
+    result = await asyncio.to_thread(replay)
+    if result['symbols'] == 0:
+        return None, next(iter(result['errors'].values()), "اطلاعاتی برای بک‌تست یافت نشد.")
+    return result, None
+
+def format_backtest_message(result: dict, max_hits: int = 10) -> str:
+    """Formats a backtest result for Telegram."""
+    lines = [
+        f"📊 **بک‌تست اسکنر: {result['filter_name']}** (تایم فریم: {result['timeframe']})",
+        f"بازه: {result['start'][:10]} تا {result['end'][:10]} | نمادها: {result['symbols']}",
+        f"تعداد سیگنال: {result['signals']} از {result['bars']} کندل ({result['signal_rate'] * 100:.2f}٪)",
+        "",
+        "بازده پس از سیگنال:",
+    ]
+    for bars, stats in result['forward_returns'].items():
+        if stats['count']:
+            lines.append(f"  {bars} کندل: میانگین {stats['mean']:.2f}٪ | میانه {stats['median']:.2f}٪ | "
+                         f"نرخ موفقیت {stats['hit_rate'] * 100:.1f}٪ ({stats['count']} سیگنال)")
+        else:
+            lines.append(f"  {bars} کندل: داده‌ای موجود نیست")
+    if result['hits']:
+        lines.append("")
+        lines.append("آخرین سیگنال‌ها:")
+        for hit in result['hits'][:max_hits]:
+            first_return = next(iter(hit['returns'].values()), None)
+            shown_return = f" → {first_return:+.2f}٪" if first_return is not None else ""
+            lines.append(f"  {hit['timestamp'][:16].replace('T', ' ')} {hit['symbol']} @ {hit['close']:.4g}{shown_return}")
+    if result['errors']:
+        lines.append("")
+        lines.append(f"⚠️ {len(result['errors'])} نماد به دلیل خطا در دریافت اطلاعات بررسی نشد.")
+    return "\n".join(lines)
@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import asyncio
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+# Load environment variables from .env in the project root
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+# The Redis tier is optional: without REDIS_HOST the cache stays process-local.
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+OHLCV_CACHE_REDIS_DB = int(os.getenv("OHLCV_CACHE_REDIS_DB", "1"))
+OHLCV_CACHE_MAX_ENTRIES = int(os.getenv("OHLCV_CACHE_MAX_ENTRIES", "2000"))
+
+# --- Timeframe Helpers ---
+_TIMEFRAME_UNIT_SECONDS = {
+    's': 1,
+    'm': 60,
+    'h': 60 * 60,
+    'd': 24 * 60 * 60,
+    'w': 7 * 24 * 60 * 60,
+    'M': 30 * 24 * 60 * 60, # Approximate, exchanges align monthly candles to calendar months
+}
+
+def timeframe_to_seconds(timeframe: str) -> int:
+    """
+    Converts a CCXT timeframe string (e.g., '5m', '1h', '1d') to seconds.
+    """
+    unit = timeframe[-1]
+    if unit not in _TIMEFRAME_UNIT_SECONDS:
+        unit = unit.lower()
+    if unit not in _TIMEFRAME_UNIT_SECONDS:
+        raise ValueError(f"تایم فریم نامعتبر: {timeframe}")
+    return int(timeframe[:-1]) * _TIMEFRAME_UNIT_SECONDS[unit]
+
+_WEEK_ALIGNMENT_SECONDS = 4 * 24 * 60 * 60 # The epoch is a Thursday; weekly candles open on Monday 00:00 UTC
+
+def _month_start(months_since_epoch: int) -> int:
+    return int(datetime(1970 + months_since_epoch // 12, months_since_epoch % 12 + 1, 1, tzinfo=timezone.utc).timestamp())
+
+def _candle_bounds(timeframe: str, now: float) -> tuple[int, int]:
+    # (open, close) UNIX seconds of the candle containing `now`
+    if timeframe.endswith('M'):
+        months = int(timeframe[:-1])
+        moment = datetime.fromtimestamp(int(now), timezone.utc)
+        first_month = ((moment.year - 1970) * 12 + moment.month - 1) // months * months
+        return _month_start(first_month), _month_start(first_month + months)
+    period = timeframe_to_seconds(timeframe)
+    offset = _WEEK_ALIGNMENT_SECONDS if timeframe.endswith('w') else 0
+    candle_open = (int(now) - offset) // period * period + offset
+    return candle_open, candle_open + period
+
+def current_candle_open(timeframe: str, now: float = None) -> int:
+    """
+    Returns the UNIX time (seconds) at which the currently forming candle opened.
+    Intraday and daily candles are aligned to the epoch, weekly candles to Monday 00:00 UTC and
+    monthly candles to calendar months, which matches how exchanges bucket them.
+    """
+    return _candle_bounds(timeframe, time.time() if now is None else now)[0]
+
+def next_candle_close(timeframe: str, now: float = None) -> float:
+    """
+    Returns the UNIX time (seconds) at which the currently forming candle closes
+    (aligned like current_candle_open).
+    """
+    return _candle_bounds(timeframe, time.time() if now is None else now)[1]
+
+
+# --- OHLCV Cache ---
+class OHLCVCache:
+    """
+    Process-wide cache for raw OHLCV rows keyed by (exchange, symbol, timeframe, limit).
+    Entries expire when the next candle of their timeframe closes, so repeated calls
+    inside one candle period are served without touching the exchange.
+    If REDIS_HOST is set, entries are also written to Redis so the bot, the Celery
+    workers and the web app share one copy.
+    """
+
+    def __init__(self, max_entries: int = OHLCV_CACHE_MAX_ENTRIES, redis_host: str = REDIS_HOST,
+                 redis_port: int = REDIS_PORT, redis_db: int = OHLCV_CACHE_REDIS_DB):
+        self.max_entries = max_entries
+        self._entries = {} # key -> (expires_at, ohlcv_rows)
+        self._redis_settings = (redis_host, redis_port, redis_db) if redis_host else None
+        self._redis = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(exchange_name: str, symbol: str, timeframe: str, limit: int) -> str:
+        return f"ohlcv:{exchange_name}:{symbol}:{timeframe}:{limit}"
+
+    def _get_redis(self):
+        if self._redis is None and self._redis_settings:
+            try:
+                import redis.asyncio as aioredis
+                host, port, db = self._redis_settings
+                self._redis = aioredis.Redis(host=host, port=port, db=db)
+            except ImportError:
+                print("هشدار: کتابخانه redis نصب نیست. کش OHLCV فقط در حافظه نگهداری می‌شود.")
+                self._redis_settings = None
+        return self._redis
+
+    def _evict(self, now: float):
+        expired_keys = [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for key in expired_keys:
+            del self._entries[key]
+        while len(self._entries) >= self.max_entries:
+            # Dicts keep insertion order, so the first key is the oldest entry
+            del self._entries[next(iter(self._entries))]
+
+    async def get(self, exchange_name: str, symbol: str, timeframe: str, limit: int):
+        """
+        Returns the cached OHLCV rows, or None if there is no fresh entry.
+        """
+        key = self.make_key(exchange_name, symbol, timeframe, limit)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry:
+            expires_at, ohlcv = entry
+            if expires_at > now:
+                self.hits += 1
+                return ohlcv
+            del self._entries[key]
+
+        redis_client = self._get_redis()
+        if redis_client:
+            try:
+                raw_value = await redis_client.get(key)
+                if raw_value:
+                    ohlcv = json.loads(raw_value)
+                    self._evict(now)
+                    self._entries[key] = (next_candle_close(timeframe, now), ohlcv)
+                    self.hits += 1
+                    return ohlcv
+            except Exception as e:
+                print(f"خطا در خواندن کش OHLCV از Redis: {e}")
+
+        self.misses += 1
+        return None
+
+    async def set(self, exchange_name: str, symbol: str, timeframe: str, limit: int, ohlcv: list):
+        """
+        Stores OHLCV rows until the close of the currently forming candle.
+        """
+        key = self.make_key(exchange_name, symbol, timeframe, limit)
+        now = time.time()
+        expires_at = next_candle_close(timeframe, now)
+
+        self._evict(now)
+        self._entries[key] = (expires_at, ohlcv)
+
+        redis_client = self._get_redis()
+        if redis_client:
+            try:
+                await redis_client.set(key, json.dumps(ohlcv), exat=int(expires_at))
+            except Exception as e:
+                print(f"خطا در نوشتن کش OHLCV در Redis: {e}")
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'max_entries': self.max_entries}
+
+
+ohlcv_cache = OHLCVCache()
+
+
+# --- Single-Flight Request Coalescing ---
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for `key` is in flight, later callers
+    await the same task and share its result (or exception) instead of issuing their own request.
+    Shared results must be treated as read-only by callers.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight = {}
+        self.calls = 0 # Calls that actually ran
+        self.coalesced = 0 # Calls that joined an in-flight call
+
+    async def do(self, key, coroutine_factory):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coroutine_factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done_task: self._forget(key, done_task))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        # Shield so one cancelled caller does not cancel the request for everyone else
+        return await asyncio.shield(task)
+
+    def _forget(self, key, done_task):
+        if self._inflight.get(key) is done_task:
+            del self._inflight[key]
+        if not done_task.cancelled():
+            done_task.exception() # Mark as retrieved even if every caller was cancelled
+
+    def stats(self) -> dict:
+        return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._inflight)}
+
+
+_singleflights = {}
+
+def get_singleflight(name: str) -> SingleFlight:
+    """Returns the process-wide SingleFlight group with this name."""
+    if name not in _singleflights:
+        _singleflights[name] = SingleFlight(name)
+    return _singleflights[name]
+
+def get_singleflight_stats() -> dict:
+    """Returns {group_name: {'calls', 'coalesced', 'in_flight'}} for every coalescing group."""
+    return {name: group.stats() for name, group in _singleflights.items()}
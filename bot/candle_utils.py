@@ -0,0 +1,101 @@
+import time
+import numpy as np
+
+OHLCV_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+# --- Rolling Candle Buffer ---
+class CandleBuffer:
+    """
+    Fixed-capacity rolling buffer of OHLCV rows for one (exchange, symbol, timeframe).
+    Candles are kept oldest-first in a column-major float64 array, so every column is a contiguous
+    array that TA-Lib can read without copying; appending drops the oldest candles.
+    The newest row may be the still-forming candle, so a row with the same timestamp replaces it.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data = np.empty((len(OHLCV_COLUMNS), capacity), dtype=np.float64)
+        self.size = 0
+        self.refreshed_at = 0.0
+
+    @property
+    def last_timestamp(self) -> int | None:
+        if self.size == 0:
+            return None
+        return int(self._data[0, self.size - 1])
+
+    def extend(self, ohlcv: list) -> int:
+        """
+        Merges CCXT OHLCV rows into the buffer and returns how many new candles were appended.
+        Rows older than the last stored candle are ignored.
+        """
+        appended = 0
+        for row in ohlcv:
+            if len(row) < len(OHLCV_COLUMNS) or any(value is None for value in row[:len(OHLCV_COLUMNS)]):
+                continue
+            timestamp = row[0]
+            last_timestamp = self.last_timestamp
+            if last_timestamp is not None and timestamp < last_timestamp:
+                continue
+            if last_timestamp is not None and timestamp == last_timestamp:
+                self._data[:, self.size - 1] = row[:len(OHLCV_COLUMNS)] # Update the forming candle
+                continue
+            if self.size == self.capacity:
+                self._data[:, :-1] = self._data[:, 1:] # Drop the oldest candle
+                self.size -= 1
+            self._data[:, self.size] = row[:len(OHLCV_COLUMNS)]
+            self.size += 1
+            appended += 1
+        self.refreshed_at = time.time()
+        return appended
+
+    def clear(self):
+        """Drops every stored candle, e.g. when the buffer fell too far behind to catch up."""
+        self.size = 0
+        self.refreshed_at = 0.0
+
+    def rows(self) -> np.ndarray:
+        """Returns a read-only (size, 6) view of the stored candles, oldest first."""
+        view = self._data[:, :self.size].T
+        view.flags.writeable = False
+        return view
+
+    def column(self, name: str, limit: int = None) -> np.ndarray:
+        """Returns a read-only contiguous view of one column for the newest `limit` stored candles."""
+        start = 0 if limit is None else max(0, self.size - limit)
+        view = self._data[OHLCV_COLUMNS.index(name), start:self.size]
+        view.flags.writeable = False
+        return view
+
+    def columns(self, limit: int = None) -> dict:
+        """
+        Returns {column: read-only contiguous view} for the newest `limit` candles, without copying.
+        Views reflect later appends, so read them before the buffer is extended again.
+        """
+        return {name: self.column(name, limit) for name in OHLCV_COLUMNS}
+
+
+_candle_buffers = {}
+
+def get_candle_buffer(exchange_name: str, symbol: str, timeframe: str, capacity: int) -> CandleBuffer:
+    """
+    Returns the process-wide buffer for (exchange, symbol, timeframe).
+    A buffer is recreated empty when a caller needs more history than it can hold.
+    """
+    key = (exchange_name, symbol, timeframe)
+    buffer = _candle_buffers.get(key)
+    if buffer is None or buffer.capacity < capacity:
+        buffer = CandleBuffer(capacity)
+        _candle_buffers[key] = buffer
+    return buffer
+
+def expire_candle_buffers(drop: bool = False):
+    """
+    Marks every buffer stale so its next read re-fetches from the last stored candle,
+    or with drop=True forgets all buffers so they are seeded again.
+    """
+    if drop:
+        _candle_buffers.clear()
+        return
+    for buffer in _candle_buffers.values():
+        buffer.refreshed_at = 0.0
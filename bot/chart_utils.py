@@ -1,78 +1,190 @@
 import os
 import ccxt.async_support as ccxt
+import numpy as np
 import pandas as pd
 import talib
 import io
+from collections import OrderedDict
 from matplotlib.backends.backend_svg import FigureCanvasSVG
 from matplotlib.figure import Figure
 import matplotlib.pyplot as plt # For style and some date functionalities
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 
+try:
+    from bot.cache_utils import ohlcv_cache, next_candle_close, current_candle_open, timeframe_to_seconds, get_singleflight
+    from bot.exchange_utils import (get_shared_exchange_client, get_market_data_exchanges, resolve_market_symbol,
+                                    hedged_call, MARKET_DATA_TIMEOUT_SECONDS)
+    from bot.candle_utils import get_candle_buffer
+    from bot.history_utils import ohlcv_history, next_fetch_since, merge_tail, OHLCV_HISTORY_ENABLED
+    from bot.rate_limiter import get_rate_limiter, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+except ImportError:
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from bot.cache_utils import ohlcv_cache, next_candle_close, current_candle_open, timeframe_to_seconds, get_singleflight
+    from bot.exchange_utils import (get_shared_exchange_client, get_market_data_exchanges, resolve_market_symbol,
+                                    hedged_call, MARKET_DATA_TIMEOUT_SECONDS)
+    from bot.candle_utils import get_candle_buffer
+    from bot.history_utils import ohlcv_history, next_fetch_since, merge_tail, OHLCV_HISTORY_ENABLED
+    from bot.rate_limiter import get_rate_limiter, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
 # Load environment variables from .env in the project root
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
 EXCHANGE_API_KEY = os.getenv("EXCHANGE_API_KEY")
 EXCHANGE_SECRET_KEY = os.getenv("EXCHANGE_SECRET_KEY")
 DEFAULT_EXCHANGE_NAME = os.getenv("DEFAULT_EXCHANGE_NAME", "binance").lower()
+INDICATOR_CACHE_MAX_ENTRIES = int(os.getenv("INDICATOR_CACHE_MAX_ENTRIES", "20000"))
+CANDLE_BUFFER_MAX_CATCHUP_PAGES = 5 # fetch_ohlcv pages a buffer may page through to reach the current candle
 
 # --- Exchange Client ---
 async def get_ccxt_exchange_client(exchange_name: str = DEFAULT_EXCHANGE_NAME, api_key: str = None, secret_key: str = None):
     """
-    Initializes and returns a CCXT exchange object.
+    Returns the shared, long-lived CCXT exchange object for these credentials.
     Uses provided API keys or global ones if available and exchange requires them for OHLCV.
     Many exchanges provide OHLCV data without API keys.
+    The client is owned by bot.exchange_utils and must not be closed by the caller.
     """
-    try:
-        exchange_class = getattr(ccxt, exchange_name)
-        params = {'enableRateLimit': True}
-        if api_key and secret_key: # Use keys if provided (and exchange supports/requires them for endpoint)
-            params['apiKey'] = api_key
-            params['secret'] = secret_key
-        
-        exchange = exchange_class(params)
-        return exchange
-    except AttributeError:
-        print(f"Error: Exchange '{exchange_name}' is not supported by CCXT or name is incorrect.")
-        return None
-    except Exception as e:
-        print(f"Error initializing exchange {exchange_name}: {e}")
-        return None
+    return await get_shared_exchange_client(exchange_name, api_key, secret_key)
 
 # --- Historical Data Fetching ---
-async def fetch_historical_data(symbol: str, timeframe: str = '1d', limit: int = 100, exchange_name: str = DEFAULT_EXCHANGE_NAME):
+def _ohlcv_to_dataframe(ohlcv: list) -> pd.DataFrame:
+    """
+    Converts raw CCXT OHLCV rows to a DataFrame indexed by UTC timestamp.
+    """
+    # CCXT returns: [timestamp, open, high, low, close, volume]
+    df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms', utc=True) # Convert to datetime
+    df.set_index('timestamp', inplace=True) # Set timestamp as index for easier plotting
+
+    # Ensure data types are correct for TA-Lib
+    for col in ['open', 'high', 'low', 'close', 'volume']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df.dropna(inplace=True) # Drop rows with NaN values that might result from coercion
+    return df
+
+def _arrays_to_dataframe(arrays: dict) -> pd.DataFrame:
+    """
+    Wraps OHLCV column arrays (e.g. memory-mapped history) in a DataFrame without copying them.
+    """
+    df = pd.DataFrame({col: arrays[col] for col in ['open', 'high', 'low', 'close', 'volume']}, copy=False)
+    df.index = pd.to_datetime(arrays['timestamp'], unit='ms', utc=True)
+    df.index.name = 'timestamp'
+    return df
+
+def _arrays_to_rows(arrays: dict) -> list:
+    """
+    Converts OHLCV column arrays back to CCXT-style rows (for the cache and candle buffers).
+    """
+    timestamps = arrays['timestamp'].tolist()
+    values = [arrays[col].tolist() for col in ['open', 'high', 'low', 'close', 'volume']]
+    return [[int(ts)] + [column[i] for column in values] for i, ts in enumerate(timestamps)]
+
+async def _fetch_ohlcv_with_history(exchange, exchange_name: str, symbol: str, timeframe: str, limit: int,
+                                    priority: int = PRIORITY_INTERACTIVE) -> dict | None:
+    """
+    Reads stored closed candles from the local history store and fetches only the missing tail
+    (including the forming candle) from the exchange. Returns {column: np.ndarray} or None.
+    """
+    stored = ohlcv_history.read(exchange_name, symbol, timeframe, limit) if OHLCV_HISTORY_ENABLED else None
+    since = next_fetch_since(stored, timeframe, limit)
+    await get_rate_limiter(exchange_name).acquire('fetch_ohlcv', priority)
+    if since is None:
+        ohlcv = await exchange.fetch_ohlcv(symbol, timeframe, limit=limit)
+    else:
+        ohlcv = await exchange.fetch_ohlcv(symbol, timeframe, since=since)
+
+    if OHLCV_HISTORY_ENABLED and ohlcv:
+        try:
+            ohlcv_history.append(exchange_name, symbol, timeframe, ohlcv)
+        except OSError as e:
+            print(f"خطا در ذخیره تاریخچه OHLCV برای {symbol} ({timeframe}): {e}")
+
+    # A plain `limit` fetch does not continue the stored candles; merging them would leave a hole
+    merged = merge_tail(stored if since is not None else None, ohlcv or [], limit)
+    if len(merged['timestamp']) == 0:
+        return None
+    return merged
+
+async def _fetch_with_failover(fetch_function, group_name: str, symbol: str, timeframe: str, limit: int,
+                               exchange_name: str, exchange_names: list | None, priority: int):
+    """
+    Runs a per-venue OHLCV fetch against the ordered market-data venues. Interactive calls are
+    hedged to the next venue when the current one is slower than usual and bounded by
+    MARKET_DATA_TIMEOUT_SECONDS; background calls only fail over on errors.
+    Returns (result, error_message, venue_that_answered).
+    """
+    venues = exchange_names or get_market_data_exchanges(exchange_name)
+
+    async def fetch_from(venue: str):
+        venue_symbol = symbol
+        if venue != venues[0]:
+            # Symbols are given for the primary venue; map them for fallbacks (e.g. BTC/USDT -> BTC/USD)
+            exchange = await get_ccxt_exchange_client(venue, EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY)
+            if not exchange:
+                return None, f"خطا در اتصال به صرافی {venue}."
+            try:
+                venue_symbol = await resolve_market_symbol(exchange, symbol, priority)
+            except Exception as e:
+                return None, f"خطا در دریافت لیست بازارهای صرافی {venue}: {e}"
+        return await get_singleflight(group_name).do(
+            (venue, venue_symbol, timeframe, limit),
+            lambda: fetch_function(venue_symbol, timeframe, limit, venue, priority)
+        )
+
+    interactive = priority <= PRIORITY_INTERACTIVE
+    result, error_msg, venue = await hedged_call(
+        venues, fetch_from,
+        hedge=interactive, timeout=MARKET_DATA_TIMEOUT_SECONDS if interactive else None
+    )
+    if result is None:
+        return None, error_msg, None
+    return result, None, venue
+
+async def fetch_historical_data(symbol: str, timeframe: str = '1d', limit: int = 100, exchange_name: str = DEFAULT_EXCHANGE_NAME,
+                                priority: int = PRIORITY_INTERACTIVE, exchange_names: list = None):
     """
     Fetches OHLCV data and converts it to a Pandas DataFrame.
+    Results are served from the shared OHLCV cache until the next candle closes.
+    Closed candles are read from the local history store; only the missing tail is fetched.
+    Concurrent identical calls share one request; treat the returned DataFrame as read-only.
+    Exchange calls draw from the shared rate-limit budget at the given priority.
+    Venues are tried in order (`exchange_names`, default: exchange_name then MARKET_DATA_EXCHANGES);
+    the venue that answered is recorded in df.attrs['exchange'].
     """
+    df, error_msg, venue = await _fetch_with_failover(_fetch_historical_data, 'fetch_historical_data', symbol, timeframe,
+                                                      limit, exchange_name, exchange_names, priority)
+    if df is not None:
+        df.attrs['exchange'] = venue
+    return df, error_msg
+
+async def _fetch_historical_data(symbol: str, timeframe: str, limit: int, exchange_name: str, priority: int):
+    cached_ohlcv = await ohlcv_cache.get(exchange_name, symbol, timeframe, limit)
+    if cached_ohlcv:
+        df = _ohlcv_to_dataframe(cached_ohlcv)
+        if not df.empty:
+            return df, None
+
     exchange = await get_ccxt_exchange_client(exchange_name, EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY) # Pass global keys
     if not exchange:
         return None, f"خطا در اتصال به صرافی {exchange_name}."
 
     try:
         if not exchange.has['fetchOHLCV']:
-            await exchange.close()
             return None, f"صرافی {exchange_name} از دریافت اطلاعات OHLCV پشتیبانی نمی‌کند."
 
-        # Fetch OHLCV data
-        # CCXT returns: [timestamp, open, high, low, close, volume]
-        ohlcv = await exchange.fetch_ohlcv(symbol, timeframe, limit=limit)
+        # Fetch OHLCV data (stored history + missing tail)
+        ohlcv_arrays = await _fetch_ohlcv_with_history(exchange, exchange_name, symbol, timeframe, limit, priority)
         
-        if not ohlcv:
-            await exchange.close()
+        if ohlcv_arrays is None:
             return None, f"اطلاعاتی برای نماد {symbol} با تایم‌فریم {timeframe} یافت نشد."
 
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms', utc=True) # Convert to datetime
-        df.set_index('timestamp', inplace=True) # Set timestamp as index for easier plotting
-        
-        # Ensure data types are correct for TA-Lib
-        for col in ['open', 'high', 'low', 'close', 'volume']:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-        df.dropna(inplace=True) # Drop rows with NaN values that might result from coercion
+        df = _arrays_to_dataframe(ohlcv_arrays)
         
         if df.empty:
              return None, f"پس از پردازش، اطلاعات معتبری برای نماد {symbol} یافت نشد."
 
+        await ohlcv_cache.set(exchange_name, symbol, timeframe, limit, _arrays_to_rows(ohlcv_arrays))
         return df, None # Return DataFrame and no error message
 
     except ccxt.BadSymbol:
@@ -83,18 +195,150 @@ async def fetch_historical_data(symbol: str, timeframe: str = '1d', limit: int =
         return None, f"خطای صرافی هنگام دریافت اطلاعات: {e}"
     except Exception as e:
         return None, f"خطای ناشناخته: {e}"
-    finally:
-        if exchange:
-            await exchange.close()
+
+async def fetch_buffered_arrays(symbol: str, timeframe: str = '1d', limit: int = 100, exchange_name: str = DEFAULT_EXCHANGE_NAME,
+                                priority: int = PRIORITY_BACKGROUND, exchange_names: list = None) -> tuple[dict | None, str | None]:
+    """
+    Like fetch_historical_data, but backed by a rolling per-(symbol, timeframe) candle buffer and
+    without building a DataFrame: returns
+    {'exchange': venue, 'timestamp'|'open'|...|'volume': read-only contiguous float64 view}
+    of the newest `limit` buffered candles.
+    The buffer is seeded once with `limit` candles; later calls only fetch candles newer than
+    the last stored timestamp (using `since`) and append them, dropping the oldest.
+    Within one candle period the buffer is served without calling the exchange, and concurrent
+    refreshes of the same buffer share one request. Each venue keeps its own buffer; a failing
+    venue falls over to the next one.
+    The views follow later appends to the buffer, so use them before the next await that may refresh it.
+    """
+    buffer, error_msg, venue = await _fetch_with_failover(_refresh_candle_buffer, 'refresh_candle_buffer', symbol, timeframe,
+                                                          limit, exchange_name, exchange_names, priority)
+    if buffer is None:
+        return None, error_msg
+    arrays = buffer.columns(limit)
+    arrays['exchange'] = venue
+    return arrays, None
+
+async def _refresh_candle_buffer(symbol: str, timeframe: str, limit: int, exchange_name: str, priority: int):
+    """Brings the (exchange, symbol, timeframe) candle buffer up to date; returns (buffer, error_message)."""
+    buffer = get_candle_buffer(exchange_name, symbol, timeframe, limit)
+    if buffer.size >= limit and next_candle_close(timeframe, buffer.refreshed_at) > datetime.now(timezone.utc).timestamp():
+        return buffer, None
+
+    exchange = await get_ccxt_exchange_client(exchange_name, EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY) # Pass global keys
+    if not exchange:
+        return None, f"خطا در اتصال به صرافی {exchange_name}."
+
+    try:
+        if not exchange.has['fetchOHLCV']:
+            return None, f"صرافی {exchange_name} از دریافت اطلاعات OHLCV پشتیبانی نمی‌کند."
+
+        timeframe_ms = timeframe_to_seconds(timeframe) * 1000
+        current_candle_timestamp = current_candle_open(timeframe, exchange.milliseconds() / 1000) * 1000
+        if buffer.size > 0 and (current_candle_timestamp - buffer.last_timestamp) // timeframe_ms >= buffer.capacity:
+            buffer.clear() # Too far behind (e.g. after downtime) for the missing candles to fit; seed it again
+        elif 0 < buffer.size < limit:
+            buffer.clear() # Filled by a stream without a seed; indicators need the full history
+
+        if buffer.size == 0:
+            # Seed the buffer once, from the local history store where possible
+            seed_arrays = await _fetch_ohlcv_with_history(exchange, exchange_name, symbol, timeframe, limit, priority)
+            buffer.extend([] if seed_arrays is None else _arrays_to_rows(seed_arrays))
+        else:
+            # Re-fetch from the last stored candle so the previously forming candle gets its final values;
+            # one page may end before the current candle, so keep paging until it is reached
+            for _ in range(CANDLE_BUFFER_MAX_CATCHUP_PAGES):
+                await get_rate_limiter(exchange_name).acquire('fetch_ohlcv', priority)
+                ohlcv = await exchange.fetch_ohlcv(symbol, timeframe, since=buffer.last_timestamp)
+                appended = buffer.extend(ohlcv or [])
+                if buffer.last_timestamp >= current_candle_timestamp or appended == 0:
+                    break
+
+        if buffer.size == 0:
+            return None, f"اطلاعاتی برای نماد {symbol} با تایم‌فریم {timeframe} یافت نشد."
+
+        if buffer.last_timestamp < current_candle_timestamp:
+            buffer.refreshed_at = 0.0 # Not current yet; the next read fetches again
+            if buffer.last_timestamp < current_candle_open(timeframe, current_candle_timestamp / 1000 - 1) * 1000:
+                return None, f"اطلاعات نماد {symbol} با تایم‌فریم {timeframe} به کندل جاری نرسید."
+
+        return buffer, None
+
+    except ccxt.BadSymbol:
+        return None, f"نماد '{symbol}' در صرافی {exchange_name} یافت نشد."
+    except ccxt.NetworkError as e:
+        return None, f"خطای شبکه هنگام دریافت اطلاعات: {e}"
+    except ccxt.ExchangeError as e:
+        return None, f"خطای صرافی هنگام دریافت اطلاعات: {e}"
+    except Exception as e:
+        return None, f"خطای ناشناخته: {e}"
+
+# --- Indicator Result Cache ---
+class IndicatorCache:
+    """
+    Process-wide LRU memo of indicator results keyed by
+    (exchange, symbol, timeframe, last candle timestamp, last close, candle count, indicator spec).
+    Within one candle every filter and /chart request on the same series shares one computation;
+    the last close is part of the key so an updated forming candle is never served stale.
+    Cached results are shared and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries: int = INDICATOR_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(exchange_name: str, symbol: str, timeframe: str, timestamps, closes, spec) -> tuple:
+        return (exchange_name, symbol, timeframe, int(timestamps[-1]), float(closes[-1]), len(closes), spec)
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False) # Least recently used
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'max_entries': self.max_entries}
+
+
+indicator_cache = IndicatorCache()
+
+def get_indicator_cache_stats() -> dict:
+    """Returns {'hits', 'misses', 'size', 'max_entries'} of the indicator result cache."""
+    return indicator_cache.stats()
 
 # --- Indicator Calculation ---
-def add_indicators(df: pd.DataFrame, indicators_requested: list = None):
+def add_indicators(df: pd.DataFrame, indicators_requested: list = None, symbol: str = None, timeframe: str = None):
     """
     Calculates requested technical indicators and adds them to the DataFrame.
+    When symbol and timeframe are given, the result is memoized in the indicator cache
+    (treat it as read-only).
     """
     if indicators_requested is None:
         indicators_requested = ['RSI', 'EMA'] # Default indicators
 
+    cache_key = None
+    if symbol and timeframe and not df.empty:
+        cache_key = IndicatorCache.make_key(df.attrs.get('exchange', DEFAULT_EXCHANGE_NAME), symbol, timeframe,
+                                            [df.index[-1].value // 10**6], df['close'].to_numpy(),
+                                            ('CHART', tuple(sorted(indicators_requested))))
+        cached = indicator_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     df_with_indicators = df.copy()
 
     if 'RSI' in indicators_requested:
@@ -119,8 +363,79 @@ def add_indicators(df: pd.DataFrame, indicators_requested: list = None):
         df_with_indicators['bb_lower'] = lower
         
     df_with_indicators.dropna(inplace=True) # Indicators might create NaNs at the beginning
+    if cache_key:
+        indicator_cache.set(cache_key, df_with_indicators)
     return df_with_indicators
 
+# Default parameters per indicator, used when a filter condition gives no period
+INDICATOR_DEFAULT_PARAMS = {
+    'RSI': (14,),
+    'EMA': (20,),
+    'MACD': (12, 26, 9),
+}
+
+def indicator_column(indicator: str, params: tuple) -> str:
+    """
+    Returns the DataFrame column holding an indicator's value, e.g. ('RSI', (7,)) -> 'rsi7',
+    ('EMA', (50,)) -> 'ema50', ('MACD', (12, 26, 9)) -> 'macd'.
+    """
+    indicator = indicator.upper()
+    if indicator == 'MACD':
+        return 'macd'
+    return f"{indicator.lower()}{params[0]}"
+
+def indicator_min_candles(indicator: str, params: tuple) -> int:
+    """Returns how many candles TA-Lib needs before the indicator has its first value."""
+    indicator = indicator.upper()
+    if indicator == 'RSI':
+        return params[0] + 1
+    if indicator == 'MACD':
+        return max(params[0], params[1]) + params[2] - 1
+    return params[0]
+
+def compute_indicator_tail(close: np.ndarray, specs: tuple, tail: int = 1) -> dict:
+    """
+    Zero-copy fast path for scans: runs TA-Lib directly on a contiguous float64 close array
+    (e.g. a candle buffer column) and returns {column: last `tail` values} per spec, named by
+    indicator_column(). No DataFrame is built and the input is never copied; the only
+    allocations are TA-Lib's output arrays, of which views of the tail are returned.
+    """
+    close = np.ascontiguousarray(close, dtype=np.float64) # No-op for buffer columns
+    values = {}
+    for indicator, params in specs:
+        column = indicator_column(indicator, params)
+        if indicator == 'RSI':
+            values[column] = talib.RSI(close, timeperiod=params[0])[-tail:]
+        elif indicator == 'EMA':
+            values[column] = talib.EMA(close, timeperiod=params[0])[-tail:]
+        elif indicator == 'MACD':
+            macd, macdsignal, _ = talib.MACD(close, fastperiod=params[0], slowperiod=params[1], signalperiod=params[2])
+            values[column] = macd[-tail:]
+            values['macdsignal'] = macdsignal[-tail:]
+    return values
+
+def cached_indicator_tail(exchange_name: str, symbol: str, timeframe: str, arrays: dict, specs: tuple, tail: int = 1) -> dict:
+    """
+    compute_indicator_tail through the indicator cache: each (indicator, params) spec is computed
+    at most once per candle for a series, however many filters ask for it.
+    `arrays` holds at least 'timestamp' and 'close' (e.g. from fetch_buffered_arrays).
+    """
+    values = {}
+    missing_specs = []
+    for spec in specs:
+        cached = indicator_cache.get(IndicatorCache.make_key(exchange_name, symbol, timeframe, arrays['timestamp'],
+                                                             arrays['close'], (spec, tail)))
+        if cached is None:
+            missing_specs.append(spec)
+        else:
+            values.update(cached)
+    for spec in missing_specs:
+        spec_values = compute_indicator_tail(arrays['close'], (spec,), tail)
+        indicator_cache.set(IndicatorCache.make_key(exchange_name, symbol, timeframe, arrays['timestamp'],
+                                                    arrays['close'], (spec, tail)), spec_values)
+        values.update(spec_values)
+    return values
+
 # --- SVG Chart Generation ---
 def generate_price_chart_svg(df: pd.DataFrame, symbol: str, indicators_to_plot: list = None):
     """
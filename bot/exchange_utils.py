@@ -0,0 +1,215 @@
+import os
+import asyncio
+import hashlib
+from collections import deque
+import ccxt.async_support as ccxt
+from dotenv import load_dotenv
+
+try:
+    from bot.rate_limiter import get_rate_limiter, PRIORITY_INTERACTIVE
+except ImportError:
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from bot.rate_limiter import get_rate_limiter, PRIORITY_INTERACTIVE
+
+# Load environment variables from .env in the project root
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+DEFAULT_EXCHANGE_NAME = os.getenv("DEFAULT_EXCHANGE_NAME", "binance").lower()
+# Ordered venues for market data (OHLCV, tickers); the first one is the primary
+MARKET_DATA_EXCHANGES = [name.strip().lower() for name in os.getenv("MARKET_DATA_EXCHANGES", DEFAULT_EXCHANGE_NAME).split(',') if name.strip()]
+# A hedged request goes to the next venue once the current one is slower than this percentile of its recent latencies
+HEDGE_LATENCY_PERCENTILE = float(os.getenv("HEDGE_LATENCY_PERCENTILE", "95"))
+HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("HEDGE_DEFAULT_DELAY_SECONDS", "1.5")) # Until enough latencies are recorded
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "0.2"))
+# Upper bound for an interactive market-data call across all venues
+MARKET_DATA_TIMEOUT_SECONDS = float(os.getenv("MARKET_DATA_TIMEOUT_SECONDS", "10"))
+LATENCY_WINDOW_SIZE = 200
+LATENCY_MIN_SAMPLES = 20
+
+# Equivalent quotes tried, in order, when a venue does not list the requested pair (e.g. BTC/USDT -> BTC/USD)
+QUOTE_EQUIVALENTS = {
+    'USDT': ['USD', 'USDC'],
+    'USDC': ['USD', 'USDT'],
+    'BUSD': ['USDT', 'USD', 'USDC'],
+    'USD': ['USDT', 'USDC'],
+}
+
+# --- Shared Exchange Client Registry ---
+# One long-lived client per (exchange, credentials). Each client keeps its own
+# aiohttp session (connection pool) and its own CCXT rate limiter, so reusing it
+# avoids a new TLS handshake and a cold throttle on every call.
+_exchange_clients = {}
+_exchange_clients_lock = asyncio.Lock()
+
+def _client_key(exchange_name: str, api_key: str = None, secret_key: str = None) -> tuple:
+    # Never keep raw secrets in the registry key
+    credentials_hash = None
+    if api_key and secret_key:
+        credentials_hash = hashlib.sha256(f"{api_key}:{secret_key}".encode()).hexdigest()
+    return (exchange_name.lower(), credentials_hash)
+
+async def get_shared_exchange_client(exchange_name: str = DEFAULT_EXCHANGE_NAME, api_key: str = None, secret_key: str = None):
+    """
+    Returns the shared CCXT exchange client for (exchange, credentials), creating it on first use.
+    Callers must NOT close the returned client; use close_all_exchange_clients() on shutdown.
+    """
+    key = _client_key(exchange_name, api_key, secret_key)
+    exchange = _exchange_clients.get(key)
+    if exchange:
+        return exchange
+
+    async with _exchange_clients_lock:
+        exchange = _exchange_clients.get(key) # Another coroutine may have created it meanwhile
+        if exchange:
+            return exchange
+        try:
+            exchange_class = getattr(ccxt, exchange_name.lower())
+            params = {'enableRateLimit': True}
+            if api_key and secret_key:
+                params['apiKey'] = api_key
+                params['secret'] = secret_key
+            exchange = exchange_class(params)
+        except AttributeError:
+            print(f"خطا: صرافی '{exchange_name}' توسط CCXT پشتیبانی نمی‌شود یا نام آن اشتباه است.")
+            return None
+        except Exception as e:
+            print(f"خطا در هنگام مقداردهی اولیه صرافی {exchange_name}: {e}")
+            return None
+        _exchange_clients[key] = exchange
+        return exchange
+
+def register_exchange_client(exchange_name: str, exchange, api_key: str = None, secret_key: str = None):
+    """
+    Installs a pre-built client as the shared client for (exchange, credentials), e.g. the synthetic
+    exchange of bot.scanner_benchmark. It is closed by close_all_exchange_clients() like any other.
+    """
+    _exchange_clients[_client_key(exchange_name, api_key, secret_key)] = exchange
+
+async def close_all_exchange_clients():
+    """
+    Closes every shared exchange client. Called once on bot shutdown.
+    """
+    async with _exchange_clients_lock:
+        clients = list(_exchange_clients.values())
+        _exchange_clients.clear()
+    for exchange in clients:
+        try:
+            await exchange.close()
+        except Exception as e:
+            print(f"خطا در بستن اتصال صرافی {exchange.id}: {e}")
+    if clients:
+        print(f"{len(clients)} اتصال صرافی بسته شد.")
+
+
+# --- Multi-Exchange Failover & Hedged Requests ---
+class LatencyTracker:
+    """
+    Keeps the most recent successful call latencies per exchange to derive hedge delays.
+    """
+
+    def __init__(self, window_size: int = LATENCY_WINDOW_SIZE):
+        self.window_size = window_size
+        self._samples = {} # exchange_name -> deque of seconds
+
+    def record(self, exchange_name: str, seconds: float):
+        self._samples.setdefault(exchange_name, deque(maxlen=self.window_size)).append(seconds)
+
+    def percentile(self, exchange_name: str, percentile: float = HEDGE_LATENCY_PERCENTILE) -> float | None:
+        samples = self._samples.get(exchange_name)
+        if not samples or len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+    def hedge_delay(self, exchange_name: str) -> float:
+        latency = self.percentile(exchange_name)
+        if latency is None:
+            return HEDGE_DEFAULT_DELAY_SECONDS
+        return max(HEDGE_MIN_DELAY_SECONDS, latency)
+
+    def stats(self) -> dict:
+        return {name: {'samples': len(samples), 'p50': self.percentile(name, 50), 'p95': self.percentile(name, 95)}
+                for name, samples in self._samples.items()}
+
+
+latency_tracker = LatencyTracker()
+
+def get_market_data_exchanges(primary: str = DEFAULT_EXCHANGE_NAME) -> list[str]:
+    """Returns the ordered venues for market data: `primary` first, then the configured fallbacks."""
+    primary = primary.lower()
+    return [primary] + [name for name in MARKET_DATA_EXCHANGES if name != primary]
+
+async def resolve_market_symbol(exchange, symbol: str, priority: int = PRIORITY_INTERACTIVE) -> str:
+    """
+    Maps a unified symbol to the pair a venue actually lists, using QUOTE_EQUIVALENTS
+    (e.g. BTC/USDT on a venue that only has BTC/USD). Unknown symbols are returned unchanged.
+    """
+    if not exchange.markets:
+        await get_rate_limiter(exchange.id).acquire('load_markets', priority)
+        await exchange.load_markets()
+    if symbol in exchange.markets:
+        return symbol
+    base, _, quote = symbol.partition('/')
+    for equivalent_quote in QUOTE_EQUIVALENTS.get(quote.upper(), []):
+        candidate = f"{base}/{equivalent_quote}"
+        if candidate in exchange.markets:
+            return candidate
+    return symbol
+
+async def hedged_call(exchange_names: list[str], call, hedge: bool = True, timeout: float | None = MARKET_DATA_TIMEOUT_SECONDS):
+    """
+    Runs `call(exchange_name) -> (result, error_message)` against an ordered list of venues.
+    The next venue is started as soon as the current one fails, and with hedge=True also when the
+    current one is slower than its usual latency percentile (the slow call keeps running).
+    The first successful result wins; remaining calls are cancelled.
+    Returns (result, error_message, exchange_name); exchange_name is None if every venue failed.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    remaining = list(exchange_names)
+    pending = {} # task -> (exchange_name, started_at)
+    errors = []
+    last_result = None
+    last_started_name, last_started_at = None, 0.0
+
+    def start_next():
+        nonlocal last_started_name, last_started_at
+        exchange_name = remaining.pop(0)
+        last_started_name, last_started_at = exchange_name, loop.time()
+        pending[asyncio.ensure_future(call(exchange_name))] = (exchange_name, last_started_at)
+
+    start_next()
+    try:
+        while pending:
+            wait_timeout = None if deadline is None else deadline - loop.time()
+            if wait_timeout is not None and wait_timeout <= 0:
+                break
+            if hedge and remaining:
+                hedge_in = max(0.0, last_started_at + latency_tracker.hedge_delay(last_started_name) - loop.time())
+                wait_timeout = hedge_in if wait_timeout is None else min(wait_timeout, hedge_in)
+
+            done, _ = await asyncio.wait(pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                exchange_name, started_at = pending.pop(task)
+                try:
+                    result, error_msg = task.result()
+                except Exception as e:
+                    result, error_msg = None, f"{e}"
+                if error_msg is None:
+                    latency_tracker.record(exchange_name, loop.time() - started_at)
+                    return result, None, exchange_name
+                last_result = result
+                errors.append(error_msg if len(exchange_names) == 1 else f"{exchange_name}: {error_msg}")
+
+            if remaining and (done or hedge) and (deadline is None or loop.time() < deadline):
+                # Failover after an error, or hedge a call that is slower than usual
+                start_next()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if not errors or pending:
+        errors.append(f"پاسخی از صرافی‌ها ({', '.join(exchange_names)}) در {timeout} ثانیه دریافت نشد.")
+    return last_result, " | ".join(errors), None
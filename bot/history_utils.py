@@ -0,0 +1,170 @@
+import os
+import time
+import fcntl
+import numpy as np
+from dotenv import load_dotenv
+
+try:
+    from bot.cache_utils import timeframe_to_seconds, current_candle_open
+except ImportError:
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from bot.cache_utils import timeframe_to_seconds, current_candle_open
+
+# Load environment variables from .env in the project root
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+OHLCV_HISTORY_DIR = os.getenv("OHLCV_HISTORY_DIR", os.path.join(os.path.dirname(__file__), '..', 'data', 'ohlcv'))
+OHLCV_HISTORY_ENABLED = os.getenv("OHLCV_HISTORY_ENABLED", "true").lower() in ('1', 'true', 'yes')
+
+# One append-only file per column; timestamps are int64 milliseconds, prices/volume float64
+HISTORY_COLUMNS = {
+    'timestamp': np.int64,
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'volume': np.float64,
+}
+
+# --- Columnar OHLCV History Store ---
+class OHLCVHistoryStore:
+    """
+    Local columnar store of closed candles, one directory per (exchange, symbol, timeframe)
+    holding one append-only binary file per column. Reads memory-map the files, so the
+    returned NumPy arrays are zero-copy views of the page cache.
+    Only closed candles are stored; the still-forming candle always comes from the exchange.
+    A stored series is always contiguous: candles that would leave a hole after the last stored
+    one start the series over.
+    """
+
+    def __init__(self, root_dir: str = OHLCV_HISTORY_DIR):
+        self.root_dir = root_dir
+
+    def _series_dir(self, exchange_name: str, symbol: str, timeframe: str) -> str:
+        safe_symbol = symbol.replace('/', '_').replace(':', '_')
+        return os.path.join(self.root_dir, exchange_name, safe_symbol, timeframe)
+
+    @staticmethod
+    def _column_path(series_dir: str, column: str) -> str:
+        return os.path.join(series_dir, f"{column}.bin")
+
+    def _row_count(self, series_dir: str) -> int:
+        # Columns are written value-first, timestamp-last; the shortest column is the committed length
+        counts = []
+        for column, dtype in HISTORY_COLUMNS.items():
+            path = self._column_path(series_dir, column)
+            if not os.path.exists(path):
+                return 0
+            counts.append(os.path.getsize(path) // np.dtype(dtype).itemsize)
+        return min(counts)
+
+    def _truncate(self, series_dir: str, rows: int):
+        # Cuts every existing column file to `rows` candles (callers hold the series lock)
+        for column, dtype in HISTORY_COLUMNS.items():
+            path = self._column_path(series_dir, column)
+            if os.path.exists(path):
+                os.truncate(path, rows * np.dtype(dtype).itemsize)
+
+    def _reset(self, series_dir: str):
+        # Unlinks rather than truncates, so memmaps other readers still hold stay valid
+        for column in HISTORY_COLUMNS:
+            path = self._column_path(series_dir, column)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def read(self, exchange_name: str, symbol: str, timeframe: str, limit: int = None) -> dict | None:
+        """
+        Returns {column: read-only np.memmap view} for the newest `limit` stored candles,
+        or None if nothing is stored yet.
+        """
+        series_dir = self._series_dir(exchange_name, symbol, timeframe)
+        rows = self._row_count(series_dir)
+        if rows == 0:
+            return None
+        start = 0 if limit is None else max(0, rows - limit)
+        arrays = {}
+        try:
+            for column, dtype in HISTORY_COLUMNS.items():
+                itemsize = np.dtype(dtype).itemsize
+                arrays[column] = np.memmap(self._column_path(series_dir, column), dtype=dtype, mode='r',
+                                           offset=start * itemsize, shape=(rows - start,))
+        except (FileNotFoundError, ValueError):
+            return None # The series was started over while it was being read
+        return arrays
+
+    def append(self, exchange_name: str, symbol: str, timeframe: str, ohlcv: list, now_ms: int = None) -> int:
+        """
+        Appends the closed candles from CCXT OHLCV rows that are newer than the last stored one.
+        If they do not continue right after it (e.g. the store fell behind), the stored candles
+        are dropped first so the series stays contiguous. Returns the number of candles written.
+        """
+        if not ohlcv:
+            return 0
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        timeframe_ms = timeframe_to_seconds(timeframe) * 1000
+        forming_timestamp = current_candle_open(timeframe, now_ms / 1000) * 1000 # Weekly/monthly candles are calendar-aligned
+        series_dir = self._series_dir(exchange_name, symbol, timeframe)
+        os.makedirs(series_dir, exist_ok=True)
+
+        with open(os.path.join(series_dir, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX) # Bot, workers and web may append concurrently
+            # Drop the tail of an append that was interrupted between its column writes
+            self._truncate(series_dir, self._row_count(series_dir))
+            stored = self.read(exchange_name, symbol, timeframe, limit=1)
+            last_timestamp = int(stored['timestamp'][-1]) if stored else None
+            new_rows = [
+                row for row in ohlcv
+                if row[0] < forming_timestamp and (last_timestamp is None or row[0] > last_timestamp)
+                and None not in row[:6]
+            ]
+            if not new_rows:
+                return 0
+            new_rows.sort(key=lambda row: row[0])
+            # Calendar months vary in length, so allow up to 1.5 periods between neighbouring candles
+            if last_timestamp is not None and new_rows[0][0] - last_timestamp > timeframe_ms * 3 // 2:
+                self._reset(series_dir)
+            columns = np.array([row[:6] for row in new_rows], dtype=np.float64)
+            for index, (column, dtype) in reversed(list(enumerate(HISTORY_COLUMNS.items()))):
+                with open(self._column_path(series_dir, column), 'ab') as f:
+                    f.write(columns[:, index].astype(dtype).tobytes())
+            return len(new_rows)
+
+
+def next_fetch_since(stored: dict | None, timeframe: str, limit: int, now_ms: int = None) -> int | None:
+    """
+    Returns the `since` (ms) to fetch only the missing tail after the stored candles,
+    or None when a plain `limit` fetch is needed (empty store, too far behind, or too little history).
+    Candles of a plain fetch do not continue the stored series, so OHLCVHistoryStore.append starts it over.
+    """
+    if not stored or len(stored['timestamp']) == 0:
+        return None
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    timeframe_ms = timeframe_to_seconds(timeframe) * 1000
+    next_timestamp = int(stored['timestamp'][-1]) + timeframe_ms
+    missing_candles = max(0, (now_ms - next_timestamp) // timeframe_ms + 1)
+    if missing_candles > limit or len(stored['timestamp']) + missing_candles < limit:
+        return None # Too far behind, or not enough older history stored for `limit` candles
+    return next_timestamp
+
+def merge_tail(stored: dict | None, ohlcv: list, limit: int) -> dict:
+    """
+    Combines stored columns with freshly fetched OHLCV rows and returns the newest `limit`
+    candles as {column: np.ndarray}. When nothing was fetched, the stored views are returned as-is.
+    """
+    fetched = np.array([row[:6] for row in ohlcv if None not in row[:6]], dtype=np.float64).reshape(-1, 6)
+    if stored is None:
+        stored = {column: np.empty(0, dtype=dtype) for column, dtype in HISTORY_COLUMNS.items()}
+    if len(fetched) == 0:
+        return {column: values[-limit:] for column, values in stored.items()}
+
+    keep = stored['timestamp'] < fetched[0, 0] # Fetched rows win where they overlap
+    merged = {}
+    for index, column in enumerate(HISTORY_COLUMNS):
+        merged[column] = np.concatenate([stored[column][keep], fetched[:, index].astype(HISTORY_COLUMNS[column])])[-limit:]
+    return merged
+
+
+ohlcv_history = OHLCVHistoryStore()
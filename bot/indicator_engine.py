@@ -0,0 +1,251 @@
+import math
+from collections import deque
+
+# Indicators tracked for every streamed series, mirroring chart_utils.add_indicators defaults
+DEFAULT_INDICATOR_SPECS = (
+    ('RSI', (14,)),
+    ('EMA', (20,)),
+    ('MACD', (12, 26, 9)),
+    ('BBANDS', (20, 2.0)),
+)
+
+# --- Incremental Indicator States ---
+# Each state consumes one closed-candle close at a time in O(1) and reproduces TA-Lib's
+# seeding (SMA seed for EMA, Wilder seed for RSI), so once warmed up its values match
+# talib on the same series to floating-point tolerance.
+
+class EMAState:
+    """Exponential moving average, seeded with the SMA of the first `period` values like talib.EMA."""
+
+    def __init__(self, period: int):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.count = 0
+        self._seed_sum = 0.0
+        self.value = None
+
+    def update(self, close: float) -> float | None:
+        self.count += 1
+        if self.value is None:
+            self._seed_sum += close
+            if self.count == self.period:
+                self.value = self._seed_sum / self.period
+        else:
+            self.value += self.k * (close - self.value)
+        return self.value
+
+    def outputs(self, prefix: str) -> dict:
+        return {f"{prefix}{self.period}": self.value}
+
+
+class RSIState:
+    """Wilder's RSI, matching talib.RSI (first value after `period` price changes)."""
+
+    def __init__(self, period: int):
+        self.period = period
+        self.count = 0
+        self._previous_close = None
+        self._gain = 0.0
+        self._loss = 0.0
+        self.value = None
+
+    def update(self, close: float) -> float | None:
+        if self._previous_close is None:
+            self._previous_close = close
+            return None
+        change = close - self._previous_close
+        self._previous_close = close
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        self.count += 1
+        if self.count <= self.period:
+            self._gain += gain
+            self._loss += loss
+            if self.count < self.period:
+                return None
+            self._gain /= self.period
+            self._loss /= self.period
+        else:
+            self._gain = (self._gain * (self.period - 1) + gain) / self.period
+            self._loss = (self._loss * (self.period - 1) + loss) / self.period
+        total = self._gain + self._loss
+        self.value = 100.0 * self._gain / total if total > 0 else 0.0
+        return self.value
+
+    def outputs(self, prefix: str) -> dict:
+        return {f"{prefix}{self.period}": self.value}
+
+
+class MACDState:
+    """
+    MACD line, signal and histogram matching talib.MACD: both EMAs start at the slow EMA's
+    first value (the fast EMA seeded with the SMA of the last `fast` closes at that point).
+    """
+
+    def __init__(self, fast: int, slow: int, signal: int):
+        if fast > slow:
+            fast, slow = slow, fast
+        self.fast, self.slow, self.signal = fast, slow, signal
+        self._k_fast = 2.0 / (fast + 1)
+        self._k_slow = 2.0 / (slow + 1)
+        self._seed_window = deque(maxlen=slow)
+        self._fast_ema = None
+        self._slow_ema = None
+        self._signal_ema = EMAState(signal)
+        self.value = None # (macd, signal, histogram)
+
+    def update(self, close: float):
+        if self._slow_ema is None:
+            self._seed_window.append(close)
+            if len(self._seed_window) < self.slow:
+                return None
+            self._slow_ema = sum(self._seed_window) / self.slow
+            self._fast_ema = sum(list(self._seed_window)[-self.fast:]) / self.fast
+            self._seed_window.clear()
+        else:
+            self._fast_ema += self._k_fast * (close - self._fast_ema)
+            self._slow_ema += self._k_slow * (close - self._slow_ema)
+        macd = self._fast_ema - self._slow_ema
+        signal = self._signal_ema.update(macd)
+        if signal is not None:
+            self.value = (macd, signal, macd - signal)
+        return self.value
+
+    def outputs(self, prefix: str) -> dict:
+        macd, signal, histogram = self.value if self.value else (None, None, None)
+        return {prefix: macd, f"{prefix}signal": signal, f"{prefix}hist": histogram}
+
+
+class BBandsState:
+    """
+    Bollinger Bands over a rolling window (SMA middle, population stdev like talib.BBANDS).
+    Running sums are rebuilt from the window every `period` updates to stop float drift,
+    which keeps the cost amortised O(1).
+    """
+
+    def __init__(self, period: int, nbdev: float = 2.0):
+        self.period = period
+        self.nbdev = float(nbdev)
+        self._window = deque(maxlen=period)
+        self._sum = 0.0
+        self._sum_squares = 0.0
+        self._updates_since_rebuild = 0
+        self.value = None # (upper, middle, lower)
+
+    def update(self, close: float):
+        if len(self._window) == self.period:
+            oldest = self._window[0]
+            self._sum -= oldest
+            self._sum_squares -= oldest * oldest
+        self._window.append(close)
+        self._sum += close
+        self._sum_squares += close * close
+        self._updates_since_rebuild += 1
+        if self._updates_since_rebuild >= self.period:
+            self._sum = math.fsum(self._window)
+            self._sum_squares = math.fsum(value * value for value in self._window)
+            self._updates_since_rebuild = 0
+        if len(self._window) < self.period:
+            return None
+        mean = self._sum / self.period
+        deviation = math.sqrt(max(0.0, self._sum_squares / self.period - mean * mean))
+        self.value = (mean + self.nbdev * deviation, mean, mean - self.nbdev * deviation)
+        return self.value
+
+    def outputs(self, prefix: str) -> dict:
+        upper, middle, lower = self.value if self.value else (None, None, None)
+        return {f"{prefix}_upper": upper, f"{prefix}_middle": middle, f"{prefix}_lower": lower}
+
+
+INDICATOR_STATE_CLASSES = {
+    'RSI': (RSIState, 'rsi'),
+    'EMA': (EMAState, 'ema'),
+    'MACD': (MACDState, 'macd'),
+    'BBANDS': (BBandsState, 'bb'),
+}
+
+def create_indicator_state(indicator: str, params: tuple):
+    """Creates an empty incremental state, e.g. create_indicator_state('RSI', (14,))."""
+    state_class, _ = INDICATOR_STATE_CLASSES[indicator.upper()]
+    return state_class(*params)
+
+
+# --- Indicator Engine ---
+class IndicatorEngine:
+    """
+    Keeps incremental indicator states per (exchange, symbol, timeframe) and (indicator, params).
+    Every closed candle updates all states of its series in constant time, so scans read the
+    latest values without re-running TA-Lib over the whole history.
+    Output names follow chart_utils.indicator_column ('rsi14', 'ema20', 'macd', 'macdsignal', 'bb_upper', ...).
+    """
+
+    def __init__(self, default_specs: tuple = DEFAULT_INDICATOR_SPECS):
+        self.default_specs = default_specs
+        self._series = {} # (exchange, symbol, timeframe) -> {'last_timestamp', 'close', 'states'}
+
+    def _get_series(self, exchange_name: str, symbol: str, timeframe: str) -> dict:
+        key = (exchange_name, symbol, timeframe)
+        series = self._series.get(key)
+        if series is None:
+            series = {'last_timestamp': None, 'close': None, 'states': {}}
+            for indicator, params in self.default_specs:
+                series['states'][(indicator, tuple(params))] = create_indicator_state(indicator, params)
+            self._series[key] = series
+        return series
+
+    def is_tracked(self, exchange_name: str, symbol: str, timeframe: str) -> bool:
+        return (exchange_name, symbol, timeframe) in self._series
+
+    def track(self, exchange_name: str, symbol: str, timeframe: str, indicator: str, params: tuple, history: list = None):
+        """
+        Adds an indicator to a series. A series that already has candles needs `history`
+        (its closed OHLCV rows, oldest first) to warm the new state up; rows newer than the
+        series' last candle are ignored.
+        """
+        series = self._get_series(exchange_name, symbol, timeframe)
+        spec = (indicator.upper(), tuple(params))
+        if spec in series['states']:
+            return series['states'][spec]
+        state = create_indicator_state(*spec)
+        for row in history or []:
+            if series['last_timestamp'] is None or row[0] <= series['last_timestamp']:
+                state.update(float(row[4]))
+        series['states'][spec] = state
+        return state
+
+    def update(self, exchange_name: str, symbol: str, timeframe: str, candle: list) -> bool:
+        """
+        Feeds one closed candle [ts, o, h, l, c, v] to every state of its series.
+        Candles at or before the last seen timestamp are ignored. Returns True if applied.
+        """
+        series = self._get_series(exchange_name, symbol, timeframe)
+        if series['last_timestamp'] is not None and candle[0] <= series['last_timestamp']:
+            return False
+        close = float(candle[4])
+        for state in series['states'].values():
+            state.update(close)
+        series['last_timestamp'] = int(candle[0])
+        series['close'] = close
+        return True
+
+    def warm_up(self, exchange_name: str, symbol: str, timeframe: str, ohlcv: list) -> int:
+        """Feeds closed OHLCV rows (oldest first) to a series; returns how many were applied."""
+        return sum(1 for row in ohlcv if self.update(exchange_name, symbol, timeframe, row))
+
+    def latest(self, exchange_name: str, symbol: str, timeframe: str) -> dict | None:
+        """
+        Returns {'timestamp', 'close', <indicator outputs>} for the last applied candle,
+        or None if the series is unknown. Outputs of states still warming up are None.
+        """
+        series = self._series.get((exchange_name, symbol, timeframe))
+        if series is None or series['last_timestamp'] is None:
+            return None
+        values = {'timestamp': series['last_timestamp'], 'close': series['close']}
+        for (indicator, _), state in series['states'].items():
+            values.update(state.outputs(INDICATOR_STATE_CLASSES[indicator][1]))
+        return values
+
+    def drop(self, exchange_name: str, symbol: str, timeframe: str):
+        self._series.pop((exchange_name, symbol, timeframe), None)
+
+
+indicator_engine = IndicatorEngine()
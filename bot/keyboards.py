@@ -61,7 +61,7 @@ def get_scanner_condition_indicator_keyboard() -> InlineKeyboardMarkup:
             InlineKeyboardButton("RSI", callback_data="scan_cond_indicator_RSI"),
             InlineKeyboardButton("EMA", callback_data="scan_cond_indicator_EMA"),
             # InlineKeyboardButton("Volume (USD)", callback_data="scan_cond_indicator_VOLUME_USD"), # Future
-            # InlineKeyboardButton("Price", callback_data="scan_cond_indicator_PRICE"), # Future
+            InlineKeyboardButton("قیمت", callback_data="scan_cond_indicator_PRICE"),
         ],
         [InlineKeyboardButton("لغو این شرط", callback_data="scan_cond_cancel_current")],
         [InlineKeyboardButton("اتمام و ذخیره اسکنر (بدون شرط جدید)", callback_data="scan_cond_finish")],
@@ -69,7 +69,7 @@ def get_scanner_condition_indicator_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(keyboard)
 
 def get_scanner_condition_operator_keyboard(indicator_type: str) -> InlineKeyboardMarkup:
-    # Operators might vary based on indicator (e.g., crossover for EMAs)
+    # Multi-bar operators (crosses, consecutive bars, percent change) are evaluated in scanner_utils
     keyboard = [
         [
             InlineKeyboardButton("کمتر از (<)", callback_data=f"scan_cond_operator_<"),
@@ -79,7 +79,18 @@ def get_scanner_condition_operator_keyboard(indicator_type: str) -> InlineKeyboa
             InlineKeyboardButton("کمتر یا مساوی (<=)", callback_data=f"scan_cond_operator_<="),
             InlineKeyboardButton("بیشتر یا مساوی (>=)", callback_data=f"scan_cond_operator_>="),
         ],
-        # Add "==" if needed, or "crosses" for more complex scenarios later
+        [
+            InlineKeyboardButton("قطع رو به بالا", callback_data="scan_cond_operator_crosses_above"),
+            InlineKeyboardButton("قطع رو به پایین", callback_data="scan_cond_operator_crosses_below"),
+        ],
+        [
+            InlineKeyboardButton("بالاتر در N کندل متوالی", callback_data="scan_cond_operator_above_for"),
+            InlineKeyboardButton("پایین‌تر در N کندل متوالی", callback_data="scan_cond_operator_below_for"),
+        ],
+        [
+            InlineKeyboardButton("رشد بیش از ٪ در K کندل", callback_data="scan_cond_operator_change_above"),
+            InlineKeyboardButton("تغییر کمتر از ٪ در K کندل", callback_data="scan_cond_operator_change_below"),
+        ],
         [InlineKeyboardButton("لغو این شرط", callback_data="scan_cond_cancel_current")]
     ]
     return InlineKeyboardMarkup(keyboard)
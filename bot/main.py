@@ -6,6 +6,7 @@ from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.sql import func
 from dotenv import load_dotenv
 import uuid
+from datetime import datetime, timedelta, timezone
 
 # Load environment variables
 load_dotenv()
@@ -46,7 +47,7 @@ def get_db_session():
 
 from pyrogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton # Added CallbackQuery
 from bot.news_utils import get_latest_news
-from web.models import News as WebNews, User as WebUser, Calculation as WebCalculation # Added User and Calculation models
+from web.models import News as WebNews, User as WebUser, Calculation as WebCalculation, Portfolio as WebPortfolio # Added User, Calculation and Portfolio models
 from web.schemas import CalculationCreate # Added CalculationCreate schema
 from bot.keyboards import get_calculator_menu_keyboard, get_currency_selection_keyboard, get_position_type_keyboard
 from bot.calculators import (
@@ -60,8 +61,7 @@ from pyrogram.errors import TimeoutError
 from bot.portfolio_utils import (
     fetch_balances_from_exchange, 
     update_user_portfolio, 
-    get_asset_price_in_usd,
-    get_exchange_client as get_portfolio_exchange_client # Renamed to avoid conflict
+    get_asset_prices_in_usd
 )
 from bot.chart_utils import (
     fetch_historical_data,
@@ -90,6 +90,12 @@ from web.models import Filter as DBFilter # Import the DB model
 from web.schemas import FilterCreate as SchemaFilterCreate # For creating filter instances
 from sqlalchemy.exc import IntegrityError
 from bot.scanner_utils import run_single_filter as run_manual_scan # For manual runs
+from bot.scanner_utils import parse_condition_value
+from bot.alert_utils import alert_state_store
+from bot.backtest_utils import run_filter_backtest, format_backtest_message
+from bot.exchange_utils import close_all_exchange_clients
+from bot.market_utils import start_market_universe_refresh, stop_market_universe_refresh
+from bot.stream_utils import stop_stream_scanner
 
 from pyrogram.types import LabeledPrice, PreCheckoutQuery # Added for payments
 
@@ -533,25 +539,22 @@ async def portfolio_command_handler(client: Client, message: Message):
     response_text = f"**پرتفوی شما در صرافی {DEFAULT_EXCHANGE_NAME.upper()}:**\n\n"
     total_portfolio_value_toman = 0.0
     
-    # Initialize a single exchange client for fetching all prices
-    # (Re-using global keys for this example)
-    price_exchange_client = await get_exchange_client(EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY, DEFAULT_EXCHANGE_NAME)
-    if not price_exchange_client:
-        await message.reply_text("خطا در اتصال به صرافی برای دریافت قیمت‌ها. نمایش پرتفوی بدون ارزش‌گذاری دلاری/تومانی.")
-        # Fallback: display amounts only
-        for item in portfolio_items:
-            if item.amount > 0: # Only display assets with positive amount
-                 response_text += f"{item.asset}: {item.amount:.6f}\n"
-        await message.reply_text(response_text)
-        db.close()
-        if price_exchange_client: await price_exchange_client.close()
-        return
-
-    for item in portfolio_items:
-        if item.amount <= 0: # Skip assets with zero or negative amount after update
-            continue
+    # Price every asset with one bulk ticker request (or the shared ticker snapshot)
+    held_items = [item for item in portfolio_items if item.amount > 0] # Skip assets with zero or negative amount after update
+    asset_usd_prices, price_error = await get_asset_prices_in_usd([item.asset for item in held_items], DEFAULT_EXCHANGE_NAME)
+    if price_error:
+        print(f"Error fetching portfolio prices: {price_error}")
+        if not any(asset_usd_prices.values()):
+            await message.reply_text("خطا در اتصال به صرافی برای دریافت قیمت‌ها. نمایش پرتفوی بدون ارزش‌گذاری دلاری/تومانی.")
+            # Fallback: display amounts only
+            for item in held_items:
+                response_text += f"{item.asset}: {item.amount:.6f}\n"
+            await message.reply_text(response_text)
+            db.close()
+            return
 
-        asset_usd_price = await get_asset_price_in_usd(price_exchange_client, item.asset)
+    for item in held_items:
+        asset_usd_price = asset_usd_prices.get(item.asset.upper(), 0.0)
         asset_value_toman = 0.0
         price_info_str = "(قیمت دلاری یافت نشد)"
 
@@ -563,9 +566,6 @@ async def portfolio_command_handler(client: Client, message: Message):
         
         response_text += f"{item.asset}: {item.amount:.6f} {price_info_str}\n"
 
-    if price_exchange_client:
-        await price_exchange_client.close()
-
     response_text += f"\n**ارزش کل تخمینی پرتفوی: {total_portfolio_value_toman:,.0f} تومان**\n"
     response_text += f"(نرخ دلار به تومان استفاده شده: {USD_TOMAN_RATE:,.0f})"
 
@@ -608,7 +608,7 @@ async def chart_command_handler(client: Client, message: Message):
 
     # 2. Add indicators
     try:
-        df_with_indicators = add_indicators(df, indicators_requested=indicators_to_use)
+        df_with_indicators = add_indicators(df, indicators_requested=indicators_to_use, symbol=symbol, timeframe='1d') # Shared per candle
         if df_with_indicators.empty:
             await message.reply_text(f"پس از افزودن اندیکاتورها، داده‌ای برای رسم نمودار {symbol} باقی نماند. ممکن است به داده‌های بیشتری نیاز باشد.")
             return
@@ -633,7 +633,7 @@ async def chart_command_handler(client: Client, message: Message):
         await client.send_document(
             chat_id=message.chat.id,
             document=svg_file_like,
-            caption=f"نمودار تکنیکال برای {symbol} با اندیکاتورهای ({', '.join(indicators_to_use)})",
+            caption=f"نمودار تکنیکال برای {symbol} با اندیکاتورهای ({', '.join(indicators_to_use)}) - منبع: {df.attrs.get('exchange', DEFAULT_EXCHANGE_NAME)}",
             file_name=svg_file_like.name # Explicitly set filename
         )
     except Exception as e:
@@ -792,8 +792,11 @@ async def scanner_creation_message_handler(client: Client, message: Message):
     elif current_step == "create_filter_condition_value":
         try:
             value_str = message.text.strip()
-            # float(value_str) # Validate if it's a number, actual type might vary
             current_condition_key = f"condition_{state['condition_count']}"
+            _, value_error = parse_condition_value(filter_data["params"][current_condition_key].get("operator"), value_str)
+            if value_error:
+                await message.reply_text(f"{value_error}\nلطفا دوباره وارد کنید.")
+                return
             filter_data["params"][current_condition_key]["value"] = value_str # Store as string, scanner_utils will parse
             state["step"] = "create_filter_add_another_condition"
             await message.reply_text(
@@ -809,6 +812,16 @@ async def scanner_creation_message_handler(client: Client, message: Message):
         pass
 
 
+# Value formats of the multi-bar operators (parsed by scanner_utils.parse_condition_value)
+SCANNER_CONDITION_VALUE_PROMPTS = {
+    'crosses_above': "سطح یا سری مورد نظر را وارد کنید (مثلا 30 یا EMA50 یا PRICE)",
+    'crosses_below': "سطح یا سری مورد نظر را وارد کنید (مثلا 70 یا EMA50 یا PRICE)",
+    'above_for': "سطح یا سری و تعداد کندل را با کاما وارد کنید (مثلا 70,3 یا EMA50,5)",
+    'below_for': "سطح یا سری و تعداد کندل را با کاما وارد کنید (مثلا 30,3 یا EMA50,5)",
+    'change_above': "درصد تغییر و تعداد کندل را با کاما وارد کنید (مثلا 5,10 برای رشد بیش از 5٪ در 10 کندل)",
+    'change_below': "درصد تغییر و تعداد کندل را با کاما وارد کنید (مثلا -5,10 برای افت بیش از 5٪ در 10 کندل)",
+}
+
 # Callbacks for scanner creation and management
 @app.on_callback_query(filters.regex("^scan_"))
 async def scanner_actions_callback_handler(client: Client, callback_query: CallbackQuery):
@@ -866,11 +879,12 @@ async def scanner_actions_callback_handler(client: Client, callback_query: Callb
     
     elif action.startswith("scan_cond_operator_"):
         if state.get("step") != "create_filter_condition_operator": return
-        operator = action.split("_")[-1]
+        operator = action[len("scan_cond_operator_"):] # Multi-bar operators contain underscores, e.g. crosses_above
         current_condition_key = f"condition_{state['condition_count']}"
         filter_data["params"][current_condition_key]["operator"] = operator
         state["step"] = "create_filter_condition_value"
-        await callback_query.message.edit_text(f"عملگر: {operator}. حالا مقدار مورد نظر برای شرط را وارد کنید (مثلا 30 برای RSI < 30):")
+        value_prompt = SCANNER_CONDITION_VALUE_PROMPTS.get(operator, "مقدار مورد نظر برای شرط را وارد کنید (مثلا 30 برای RSI < 30)")
+        await callback_query.message.edit_text(f"عملگر: {operator}. حالا {value_prompt}:")
 
     elif action == "scan_cond_add_another_yes":
         if state.get("step") != "create_filter_add_another_condition": return
@@ -994,6 +1008,7 @@ async def scanner_actions_callback_handler(client: Client, callback_query: Callb
                     await callback_query.message.edit_text(f"اسکنر '{filter_obj.name}' فعال شد و در زمان‌بند قرار گرفت.", reply_markup=get_single_filter_manage_keyboard(filter_obj))
                 else:
                     remove_filter_job(filter_obj.id)
+                    await alert_state_store.reset(filter_obj.id) # Current matches alert again once re-enabled
                     await callback_query.message.edit_text(f"اسکنر '{filter_obj.name}' غیرفعال شد و از زمان‌بند حذف گردید.", reply_markup=get_single_filter_manage_keyboard(filter_obj))
             else:
                 await callback_query.message.edit_text("اسکنر برای تغییر وضعیت یافت نشد.")
@@ -1009,6 +1024,7 @@ async def scanner_actions_callback_handler(client: Client, callback_query: Callb
             # Add user ownership check
             if filter_obj:
                 remove_filter_job(filter_obj.id) # Remove from scheduler first
+                await alert_state_store.reset(filter_obj.id)
                 db.delete(filter_obj)
                 db.commit()
                 await callback_query.message.edit_text(f"اسکنر '{filter_obj.name}' با موفقیت حذف شد.", reply_markup=get_scanner_main_menu_keyboard()) # Go back to main menu
@@ -1028,12 +1044,51 @@ async def scanner_actions_callback_handler(client: Client, callback_query: Callb
         # await callback_query.message.edit_text("دستور اسکنر نامعتبر است.")
 
 
+# --- Scanner Backtest ---
+@app.on_message(filters.command("backtest"))
+async def backtest_command_handler(client: Client, message: Message):
+    command_parts = message.text.split()
+    usage = "نحوه استفاده: `/backtest <شناسه اسکنر> [تعداد روز]` یا `/backtest <شناسه اسکنر> 2024-01-01 2024-06-30`"
+    if len(command_parts) < 2 or not command_parts[1].isdigit():
+        await message.reply_text(usage)
+        return
+
+    try:
+        if len(command_parts) >= 4:
+            start = datetime.strptime(command_parts[2], "%Y-%m-%d").replace(tzinfo=timezone.utc)
+            end = datetime.strptime(command_parts[3], "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        else:
+            end = datetime.now(timezone.utc)
+            start = end - timedelta(days=int(command_parts[2]) if len(command_parts) > 2 else 90)
+    except ValueError:
+        await message.reply_text(f"تاریخ یا تعداد روز نامعتبر است.\n{usage}")
+        return
+
+    db = get_db_session()
+    try:
+        db_user = db.query(WebUser).filter(WebUser.telegram_id == message.from_user.id).first()
+        filter_obj = db.query(DBFilter).filter(DBFilter.id == int(command_parts[1])).first()
+        if not filter_obj or not db_user or filter_obj.user_id != db_user.id:
+            await message.reply_text("اسکنر مورد نظر یافت نشد.")
+            return
+        await message.reply_text(f"در حال اجرای بک‌تست اسکنر '{filter_obj.name}' از {start:%Y-%m-%d} تا {end:%Y-%m-%d}...")
+        result, error_msg = await run_filter_backtest(filter_obj, start, end)
+    finally:
+        db.close()
+
+    if error_msg:
+        await message.reply_text(f"خطا در اجرای بک‌تست: {error_msg}")
+        return
+    await message.reply_text(format_backtest_message(result))
+
+
 # --- Main Bot Startup ---
 async def main(): # Renamed from if __name__ == "__main__": to allow calling from entrypoint
     from web.database import Base as WebAppBase # User, News, Calculation, Portfolio, Filter models use this
     WebAppBase.metadata.create_all(bind=engine)
     
     start_scheduler()
+    start_market_universe_refresh()
     await load_active_filters_on_startup(app) # Pass the Pyrogram client instance
     
     print("Bot starting with Pyrogram client...")
@@ -1046,6 +1101,9 @@ async def main(): # Renamed from if __name__ == "__main__": to allow calling fro
 
     # This part will be reached on graceful shutdown if the loop above is exited
     shutdown_scheduler()
+    await stop_stream_scanner()
+    await stop_market_universe_refresh()
+    await close_all_exchange_clients()
     await app.stop()
     print("Bot stopped.")
 
@@ -1099,10 +1157,17 @@ if __name__ == "__main__":
 
     async def bot_startup_tasks():
         start_scheduler()
+        start_market_universe_refresh() # Keep default scanner universe warm in memory
         await load_active_filters_on_startup(app) # Pass the client instance 'app'
     
+    async def bot_shutdown_tasks():
+        shutdown_scheduler()
+        await stop_stream_scanner()
+        await stop_market_universe_refresh()
+        await close_all_exchange_clients() # Close pooled exchange sessions cleanly
+    
     app.on_startup(bot_startup_tasks)
-    app.on_shutdown(shutdown_scheduler)
+    app.on_shutdown(bot_shutdown_tasks)
 
     print("Bot starting with app.run()...")
     app.run()
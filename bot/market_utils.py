@@ -0,0 +1,216 @@
+import os
+import time
+import asyncio
+import ccxt.async_support as ccxt
+from dotenv import load_dotenv
+
+try:
+    from bot.exchange_utils import get_shared_exchange_client, get_market_data_exchanges
+    from bot.cache_utils import get_singleflight
+    from bot.rate_limiter import get_rate_limiter, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+except ImportError:
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from bot.exchange_utils import get_shared_exchange_client, get_market_data_exchanges
+    from bot.cache_utils import get_singleflight
+    from bot.rate_limiter import get_rate_limiter, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
+# Load environment variables from .env in the project root
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+DEFAULT_EXCHANGE_NAME = os.getenv("DEFAULT_EXCHANGE_NAME", "binance").lower()
+EXCHANGE_API_KEY = os.getenv("EXCHANGE_API_KEY")
+EXCHANGE_SECRET_KEY = os.getenv("EXCHANGE_SECRET_KEY")
+MARKETS_REFRESH_INTERVAL_SECONDS = int(os.getenv("MARKETS_REFRESH_INTERVAL_SECONDS", "3600"))
+SCANNER_DEFAULT_UNIVERSE_SIZE = int(os.getenv("SCANNER_DEFAULT_UNIVERSE_SIZE", "20"))
+# Ticker snapshots younger than this are reused for pricing instead of calling the exchange
+TICKER_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("TICKER_SNAPSHOT_MAX_AGE_SECONDS", "30"))
+
+# USD-stable quotes in order of preference when pricing an asset
+COMMON_USD_QUOTES = ['USDT', 'USDC', 'BUSD', 'TUSD', 'DAI', 'USD']
+
+# --- Market Universe Service ---
+class MarketUniverse:
+    """
+    Keeps market metadata and a 24h ticker snapshot for one exchange in memory.
+    Both are loaded once and refreshed in the background every refresh_interval seconds,
+    so scanner runs read the ranked top-N universe without calling the exchange.
+    Symbols are ranked by the real 24h quote volume from one bulk fetch_tickers call.
+    """
+
+    def __init__(self, exchange_name: str = DEFAULT_EXCHANGE_NAME, refresh_interval: int = MARKETS_REFRESH_INTERVAL_SECONDS):
+        self.exchange_name = exchange_name
+        self.refresh_interval = refresh_interval
+        self.markets = {}
+        self.tickers = {}
+        self.loaded_at = 0.0
+        self.tickers_loaded_at = {} # symbol -> time its ticker was last fetched
+        self.usd_quote_symbols = {} # base asset -> best USD-stable market symbol, e.g. 'BTC' -> 'BTC/USDT'
+        self._ranked_by_quote = {} # quote -> [symbol, ...] sorted by 24h quote volume
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task = None
+
+    @property
+    def is_stale(self) -> bool:
+        return time.time() - self.loaded_at >= self.refresh_interval
+
+    @staticmethod
+    def _ticker_quote_volume(ticker: dict) -> float:
+        quote_volume = ticker.get('quoteVolume')
+        if quote_volume:
+            return float(quote_volume)
+        # Some exchanges only report base volume; approximate with the last price
+        base_volume, last_price = ticker.get('baseVolume'), ticker.get('last')
+        if base_volume and last_price:
+            return float(base_volume) * float(last_price)
+        return 0.0
+
+    def _rank_markets(self):
+        volumes_by_quote = {}
+        for symbol, market_data in self.markets.items():
+            if not market_data.get('active', True) or not market_data.get('spot', True):
+                continue
+            quote = (market_data.get('quote') or '').upper()
+            volume = self._ticker_quote_volume(self.tickers.get(symbol, {}))
+            volumes_by_quote.setdefault(quote, []).append((volume, symbol))
+
+        self._ranked_by_quote = {
+            quote: [symbol for _, symbol in sorted(pairs, key=lambda pair: pair[0], reverse=True)]
+            for quote, pairs in volumes_by_quote.items()
+        }
+
+    def _build_usd_quote_map(self):
+        quote_rank = {quote: rank for rank, quote in enumerate(COMMON_USD_QUOTES)}
+        best_symbols = {}
+        for symbol, market_data in self.markets.items():
+            if not market_data.get('active', True) or not market_data.get('spot', True):
+                continue
+            base = (market_data.get('base') or '').upper()
+            quote = (market_data.get('quote') or '').upper()
+            if quote not in quote_rank:
+                continue
+            current = best_symbols.get(base)
+            if current is None or quote_rank[quote] < current[0]:
+                best_symbols[base] = (quote_rank[quote], symbol)
+        self.usd_quote_symbols = {base: symbol for base, (_, symbol) in best_symbols.items()}
+
+    async def refresh(self) -> str | None:
+        """
+        Reloads market metadata and the bulk ticker snapshot from the exchange.
+        Returns an error message, or None on success. On failure the previous snapshot is kept.
+        """
+        async with self._refresh_lock:
+            exchange = await get_shared_exchange_client(self.exchange_name, EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY)
+            if not exchange:
+                return f"خطا در اتصال به صرافی {self.exchange_name} برای دریافت لیست بازارها."
+            rate_limiter = get_rate_limiter(self.exchange_name)
+            try:
+                await rate_limiter.acquire('load_markets', PRIORITY_BACKGROUND)
+                markets = await exchange.load_markets(reload=True)
+                tickers = {}
+                if exchange.has.get('fetchTickers'):
+                    await rate_limiter.acquire('fetch_tickers', PRIORITY_BACKGROUND)
+                    tickers = await exchange.fetch_tickers()
+            except Exception as e:
+                return f"خطا در دریافت اطلاعات بازارها از صرافی {self.exchange_name}: {e}"
+
+            self.markets = markets
+            self.tickers = tickers or {}
+            self.loaded_at = time.time()
+            self.tickers_loaded_at = {symbol: self.loaded_at for symbol in self.tickers}
+            self._rank_markets()
+            self._build_usd_quote_map()
+            print(f"اطلاعات {len(self.markets)} بازار و {len(self.tickers)} تیکر از صرافی {self.exchange_name} بروزرسانی شد.")
+            return None
+
+    async def ensure_loaded(self) -> str | None:
+        if not self.markets or self.is_stale:
+            return await self.refresh()
+        return None
+
+    async def get_top_symbols(self, quote: str = 'USDT', limit: int = SCANNER_DEFAULT_UNIVERSE_SIZE) -> tuple[list[str] | None, str | None]:
+        """
+        Returns the top `limit` active spot symbols quoted in `quote`, ranked by 24h volume.
+        Served from memory; the exchange is only called if nothing is loaded yet or the snapshot is stale.
+        """
+        error_msg = await self.ensure_loaded()
+        if error_msg and not self.markets:
+            return None, error_msg
+        return self._ranked_by_quote.get(quote.upper(), [])[:limit], None
+
+    async def _fetch_tickers(self, exchange, symbols: list[str], priority: int) -> dict:
+        await get_rate_limiter(self.exchange_name).acquire('fetch_tickers', priority)
+        try:
+            return await exchange.fetch_tickers(symbols)
+        except ccxt.NotSupported:
+            return await exchange.fetch_tickers() # Exchange only supports fetching all tickers
+
+    async def get_tickers(self, symbols: list[str], max_age: float = TICKER_SNAPSHOT_MAX_AGE_SECONDS,
+                          priority: int = PRIORITY_INTERACTIVE) -> tuple[dict, str | None]:
+        """
+        Returns {symbol: ticker} for the requested symbols. Tickers younger than max_age seconds
+        come from the shared snapshot; the rest are fetched with one bulk fetch_tickers call.
+        """
+        now = time.time()
+        stale_symbols = [symbol for symbol in symbols if now - self.tickers_loaded_at.get(symbol, 0) > max_age]
+        if stale_symbols:
+            exchange = await get_shared_exchange_client(self.exchange_name, EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY)
+            if not exchange:
+                return {}, f"خطا در اتصال به صرافی {self.exchange_name} برای دریافت قیمت‌ها."
+            try:
+                # Identical concurrent ticker lookups share one request
+                fetched = await get_singleflight('fetch_tickers').do(
+                    (self.exchange_name, tuple(stale_symbols)),
+                    lambda: self._fetch_tickers(exchange, stale_symbols, priority)
+                )
+            except Exception as e:
+                return {symbol: self.tickers[symbol] for symbol in symbols if symbol in self.tickers}, \
+                    f"خطا در دریافت قیمت‌ها از صرافی {self.exchange_name}: {e}"
+            fetched_at = time.time()
+            for symbol, ticker in (fetched or {}).items():
+                self.tickers[symbol] = ticker
+                self.tickers_loaded_at[symbol] = fetched_at
+        return {symbol: self.tickers[symbol] for symbol in symbols if symbol in self.tickers}, None
+
+    async def _refresh_loop(self):
+        while True:
+            error_msg = await self.refresh()
+            if error_msg:
+                print(error_msg)
+            await asyncio.sleep(self.refresh_interval)
+
+    def start_background_refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop_background_refresh(self):
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+        self._refresh_task = None
+
+
+_market_universes = {}
+
+def get_market_universe(exchange_name: str = DEFAULT_EXCHANGE_NAME) -> MarketUniverse:
+    """Returns the process-wide MarketUniverse for an exchange."""
+    exchange_name = exchange_name.lower()
+    if exchange_name not in _market_universes:
+        _market_universes[exchange_name] = MarketUniverse(exchange_name)
+    return _market_universes[exchange_name]
+
+def start_market_universe_refresh(exchange_name: str = DEFAULT_EXCHANGE_NAME):
+    """
+    Keeps the universes of `exchange_name` and its fallback market-data venues warm in memory,
+    so failing over to a fallback never has to load its markets inside a user request.
+    """
+    for venue in get_market_data_exchanges(exchange_name):
+        get_market_universe(venue).start_background_refresh()
+        print(f"بروزرسانی پس‌زمینه لیست بازارهای {venue} هر {MARKETS_REFRESH_INTERVAL_SECONDS} ثانیه شروع شد.")
+
+async def stop_market_universe_refresh():
+    for universe in _market_universes.values():
+        await universe.stop_background_refresh()
@@ -0,0 +1,138 @@
+import os
+import numpy as np
+
+try:
+    from bot.chart_utils import indicator_column
+except ImportError:
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from bot.chart_utils import indicator_column
+
+# --- Vectorized Indicators ---
+# Every function takes a (symbols x candles) float64 panel of equally long, gap-free series and works
+# across all symbols at once. Recursive indicators (EMA, Wilder's RSI) step along the time axis over a
+# time-major copy, so each step is a few in-place ufunc calls on one contiguous row of all symbols;
+# rolling ones (BBANDS) use sliding-window views. Seeding follows TA-Lib, so each row equals talib
+# on that symbol's own series (to float rounding). Leading values TA-Lib leaves empty are NaN.
+
+def _ema_steps(series: np.ndarray, out: np.ndarray, start: int, k: float):
+    # out[start - 1] holds the seed; fills out[start:] with the EMA of series[start:] (both time-major)
+    for t in range(start, len(series)):
+        np.subtract(series[t], out[t - 1], out=out[t])
+        out[t] *= k
+        out[t] += out[t - 1]
+
+def _ema_time_major(series: np.ndarray, period: int, first: int = 0) -> np.ndarray:
+    # EMA of time-major series[first:], seeded with the SMA of its first `period` values (talib.EMA)
+    out = np.full(series.shape, np.nan)
+    seed_at = first + period - 1
+    if seed_at < len(series):
+        out[seed_at] = series[first:seed_at + 1].mean(axis=0)
+        _ema_steps(series, out, seed_at + 1, 2.0 / (period + 1))
+    return out
+
+def ema_panel(values: np.ndarray, period: int) -> np.ndarray:
+    """EMA per row, seeded with the SMA of the row's first `period` values (talib.EMA)."""
+    return _ema_time_major(np.ascontiguousarray(values.T), period).T
+
+def rsi_panel(close: np.ndarray, period: int) -> np.ndarray:
+    """Wilder's RSI per row (talib.RSI): first value after `period` price changes."""
+    series = np.ascontiguousarray(close.T)
+    out = np.full(series.shape, np.nan)
+    if len(series) <= period:
+        return out.T
+    change = np.diff(series, axis=0)
+    gains = np.clip(change, 0, None) / period
+    losses = np.clip(-change, 0, None) / period
+    avg_gain = np.empty_like(change)
+    avg_loss = np.empty_like(change)
+    avg_gain[period - 1] = gains[:period].sum(axis=0)
+    avg_loss[period - 1] = losses[:period].sum(axis=0)
+    decay = (period - 1) / period
+    for t in range(period, len(change)):
+        np.multiply(avg_gain[t - 1], decay, out=avg_gain[t])
+        avg_gain[t] += gains[t]
+        np.multiply(avg_loss[t - 1], decay, out=avg_loss[t])
+        avg_loss[t] += losses[t]
+    avg_gain, avg_loss = avg_gain[period - 1:], avg_loss[period - 1:]
+    total = avg_gain + avg_loss
+    out[period:] = np.divide(100.0 * avg_gain, total, out=np.zeros_like(total), where=total > 0)
+    return out.T
+
+def macd_panel(close: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    MACD line, signal and histogram per row (talib.MACD): the fast EMA starts together with the
+    slow EMA, seeded with the SMA of the last `fast` closes of the slow seed window.
+    """
+    if fast > slow:
+        fast, slow = slow, fast
+    series = np.ascontiguousarray(close.T)
+    slow_ema = _ema_time_major(series, slow)
+    fast_ema = _ema_time_major(series, fast, first=slow - fast)
+    macd = fast_ema - slow_ema
+    macd_signal = _ema_time_major(macd, signal, first=slow - 1)
+    macd[np.isnan(macd_signal)] = np.nan # talib reports all three from the first signal value
+    return macd.T, macd_signal.T, (macd - macd_signal).T
+
+def bbands_panel(close: np.ndarray, period: int = 20, nbdev: float = 2.0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Bollinger Bands per row (SMA middle, population stdev, like talib.BBANDS with matype=0)."""
+    symbols, candles = close.shape
+    upper = np.full((symbols, candles), np.nan)
+    middle = np.full((symbols, candles), np.nan)
+    lower = np.full((symbols, candles), np.nan)
+    if candles >= period:
+        windows = np.lib.stride_tricks.sliding_window_view(close, period, axis=1)
+        mean = windows.mean(axis=2)
+        deviation = windows.std(axis=2)
+        middle[:, period - 1:] = mean
+        upper[:, period - 1:] = mean + nbdev * deviation
+        lower[:, period - 1:] = mean - nbdev * deviation
+    return upper, middle, lower
+
+
+def compute_indicator_panel(close: np.ndarray, specs: tuple, tail: int = None) -> dict:
+    """
+    Computes (indicator, params) specs for every symbol in one pass over a (symbols x candles) close
+    panel. Returns {column: (symbols x bars) array} named like chart_utils.compute_indicator_tail
+    ('rsi14', 'ema20', 'macd' + 'macdsignal', 'bb_upper'/'bb_middle'/'bb_lower'), keeping only the
+    last `tail` bars if given; values[column][:, -1] is the latest value of every symbol.
+    """
+    bars = slice(-tail, None) if tail else slice(None)
+    values = {}
+    for indicator, params in specs:
+        indicator = indicator.upper()
+        if indicator == 'RSI':
+            values[indicator_column(indicator, params)] = rsi_panel(close, params[0])[:, bars]
+        elif indicator == 'EMA':
+            values[indicator_column(indicator, params)] = ema_panel(close, params[0])[:, bars]
+        elif indicator == 'MACD':
+            macd, macd_signal, _ = macd_panel(close, *params)
+            values['macd'], values['macdsignal'] = macd[:, bars], macd_signal[:, bars]
+        elif indicator == 'BBANDS':
+            upper, middle, lower = bbands_panel(close, *params)
+            values['bb_upper'], values['bb_middle'], values['bb_lower'] = upper[:, bars], middle[:, bars], lower[:, bars]
+    return values
+
+def latest_panel_values(symbol_arrays: dict, specs: tuple, tail: int = 1) -> dict:
+    """
+    Batch path for scan ticks: stacks the fetched closes of all symbols into panels (one per series
+    length, so every row is gap-free and seeded like TA-Lib) and computes every spec once per panel.
+    Returns {symbol: {'close', <indicator columns>}} for the latest candle, or the last `tail` bars
+    as arrays when tail > 1, in the layout of scanner_utils.compute_symbol_values.
+    """
+    symbols_by_length = {}
+    for symbol, arrays in symbol_arrays.items():
+        if arrays is not None:
+            symbols_by_length.setdefault(len(arrays['close']), []).append(symbol)
+
+    latest_values = {}
+    for symbols in symbols_by_length.values():
+        close = np.stack([symbol_arrays[symbol]['close'] for symbol in symbols])
+        panel_values = compute_indicator_panel(close, specs, tail)
+        panel_values['close'] = close[:, -tail:]
+        for row, symbol in enumerate(symbols):
+            if tail > 1:
+                latest_values[symbol] = {column: values[row] for column, values in panel_values.items()}
+            else:
+                latest_values[symbol] = {column: values[row, -1] for column, values in panel_values.items()}
+    return latest_values
@@ -8,11 +8,17 @@ from dotenv import load_dotenv
 try:
     from web.models import User, Portfolio
     from web.schemas import PortfolioCreate, PortfolioUpdate
+    from bot.exchange_utils import get_shared_exchange_client, get_market_data_exchanges, hedged_call
+    from bot.market_utils import get_market_universe, COMMON_USD_QUOTES
+    from bot.rate_limiter import get_rate_limiter, PRIORITY_INTERACTIVE
 except ImportError:
     import sys
     sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
     from web.models import User, Portfolio
     from web.schemas import PortfolioCreate, PortfolioUpdate
+    from bot.exchange_utils import get_shared_exchange_client, get_market_data_exchanges, hedged_call
+    from bot.market_utils import get_market_universe, COMMON_USD_QUOTES
+    from bot.rate_limiter import get_rate_limiter, PRIORITY_INTERACTIVE
 
 # Load environment variables from .env in the project root
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
@@ -25,24 +31,10 @@ DEFAULT_EXCHANGE_NAME = os.getenv("DEFAULT_EXCHANGE_NAME", "binance").lower()
 
 async def get_exchange_client(api_key: str, secret_key: str, exchange_name: str = DEFAULT_EXCHANGE_NAME):
     """
-    Initializes and returns a CCXT exchange object.
-    Handles potential errors during initialization.
+    Returns the shared, long-lived CCXT exchange object for these credentials.
+    The client is pooled in bot.exchange_utils and must not be closed by the caller.
     """
-    try:
-        exchange_class = getattr(ccxt, exchange_name)
-        exchange = exchange_class({
-            'apiKey': api_key,
-            'secret': secret_key,
-            'enableRateLimit': True,  # Recommended by CCXT
-            # 'options': {'defaultType': 'spot'} # Or 'future', 'margin' as needed
-        })
-        return exchange
-    except AttributeError:
-        print(f"خطا: صرافی '{exchange_name}' توسط CCXT پشتیبانی نمی‌شود یا نام آن اشتباه است.")
-        return None
-    except Exception as e:
-        print(f"خطا در هنگام مقداردهی اولیه صرافی {exchange_name}: {e}")
-        return None
+    return await get_shared_exchange_client(exchange_name, api_key, secret_key)
 
 async def fetch_balances_from_exchange(user_telegram_id: int, db: Session):
     """
@@ -65,6 +57,7 @@ async def fetch_balances_from_exchange(user_telegram_id: int, db: Session):
         # Test connectivity (optional, but good for early feedback)
         # await exchange.load_markets() # Loads markets, can be slow
         
+        await get_rate_limiter(DEFAULT_EXCHANGE_NAME).acquire('fetch_balance', PRIORITY_INTERACTIVE)
         balance_data = await exchange.fetch_balance()
         
         # Filter out zero balances and structure the output
@@ -103,9 +96,6 @@ async def fetch_balances_from_exchange(user_telegram_id: int, db: Session):
     except Exception as e:
         print(f"خطای ناشناخته هنگام دریافت موجودی: {e}")
         return {"error": "UNKNOWN_ERROR", "message": f"خطای ناشناخته: {e}"}
-    finally:
-        if exchange:
-            await exchange.close()
 
 
 def update_user_portfolio(db: Session, user_telegram_id: int, balances: dict, exchange_name: str = DEFAULT_EXCHANGE_NAME):
@@ -175,7 +165,7 @@ async def get_asset_price_in_usd(exchange, asset_symbol: str) -> float:
     """
     if not exchange: return 0.0
     
-    common_usd_quotes = ['USDT', 'USDC', 'BUSD', 'TUSD', 'DAI', 'USD']
+    common_usd_quotes = COMMON_USD_QUOTES
     asset_symbol_upper = asset_symbol.upper()
 
     if asset_symbol_upper in common_usd_quotes: # Asset itself is a stablecoin
@@ -184,6 +174,7 @@ async def get_asset_price_in_usd(exchange, asset_symbol: str) -> float:
     for quote in common_usd_quotes:
         try:
             ticker = f"{asset_symbol_upper}/{quote}"
+            await get_rate_limiter(exchange.id).acquire('fetch_ticker', PRIORITY_INTERACTIVE)
             data = await exchange.fetch_ticker(ticker)
             if data and 'last' in data and data['last'] is not None:
                 return float(data['last'])
@@ -202,6 +193,48 @@ async def get_asset_price_in_usd(exchange, asset_symbol: str) -> float:
     print(f"قیمت USD برای {asset_symbol_upper} یافت نشد.")
     return 0.0 # Could not find price against any common USD quote
 
+async def get_asset_prices_in_usd(assets: list[str], exchange_name: str = DEFAULT_EXCHANGE_NAME) -> tuple[dict, str | None]:
+    """
+    Prices many assets in USD with at most one bulk ticker request per venue.
+    Each asset is resolved to its best USD-stable market from the precomputed quote map,
+    and prices come from the shared ticker snapshot or a single fetch_tickers call.
+    A slow or failing venue is hedged to the next one in MARKET_DATA_EXCHANGES whose market
+    snapshot is already loaded; a cold fallback would need a full load_markets first.
+    Returns ({asset: price_usd}, error_message_if_any). Unpriced assets map to 0.0.
+    """
+    venues = get_market_data_exchanges(exchange_name)
+    venues = venues[:1] + [venue for venue in venues[1:] if get_market_universe(venue).markets]
+    prices, error_msg, _ = await hedged_call(
+        venues,
+        lambda venue: _get_asset_prices_from_venue(assets, venue)
+    )
+    if prices is None:
+        prices = {asset.upper(): 0.0 for asset in assets}
+    return prices, error_msg
+
+async def _get_asset_prices_from_venue(assets: list[str], exchange_name: str) -> tuple[dict, str | None]:
+    universe = get_market_universe(exchange_name)
+    error_msg = await universe.ensure_loaded()
+    if error_msg and not universe.markets:
+        return {asset.upper(): 0.0 for asset in assets}, error_msg
+
+    prices = {}
+    symbols_by_asset = {}
+    for asset in assets:
+        asset_upper = asset.upper()
+        if asset_upper in COMMON_USD_QUOTES: # Asset itself is a stablecoin
+            prices[asset_upper] = 1.0
+        elif asset_upper in universe.usd_quote_symbols:
+            symbols_by_asset[asset_upper] = universe.usd_quote_symbols[asset_upper]
+        else:
+            prices[asset_upper] = 0.0
+
+    tickers, error_msg = await universe.get_tickers(sorted(set(symbols_by_asset.values())))
+    for asset_upper, symbol in symbols_by_asset.items():
+        last_price = tickers.get(symbol, {}).get('last')
+        prices[asset_upper] = float(last_price) if last_price is not None else 0.0
+    return prices, error_msg
+
 # Example usage (for testing, can be removed or put under if __name__ == "__main__":)
 async def main_test():
     # This is a placeholder for testing; direct execution would require a DB session
@@ -213,7 +246,6 @@ async def main_test():
     #     print("Balances:", balances)
     #     # In a real scenario, you'd get a db session here
     #     # update_user_portfolio(db_session, 12345, balances)
-    #     await client.close()
 
 # if __name__ == "__main__":
 # import asyncio
@@ -0,0 +1,148 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from dotenv import load_dotenv
+
+# Load environment variables from .env in the project root
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+RATE_LIMIT_REDIS_DB = int(os.getenv("RATE_LIMIT_REDIS_DB", "1"))
+# Shared request-weight budget per exchange, across the bot, scheduler, Celery workers and web app
+EXCHANGE_RATE_LIMIT_WEIGHT_PER_MINUTE = float(os.getenv("EXCHANGE_RATE_LIMIT_WEIGHT_PER_MINUTE", "1200"))
+# Share of the budget that only interactive requests may use, so background scans cannot starve /chart
+RATE_LIMIT_INTERACTIVE_RESERVE = float(os.getenv("RATE_LIMIT_INTERACTIVE_RESERVE", "0.2"))
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0 # User commands such as /chart and /portfolio
+PRIORITY_BACKGROUND = 10 # Scheduled scans, universe refreshes
+
+# Approximate request weights (modelled on Binance's spot API weights)
+ENDPOINT_WEIGHTS = {
+    'fetch_ohlcv': 2,
+    'fetch_ticker': 2,
+    'fetch_tickers': 40,
+    'fetch_balance': 20,
+    'load_markets': 20,
+}
+DEFAULT_ENDPOINT_WEIGHT = 1
+
+# Atomic token bucket in Redis. Returns 0 if the tokens were taken, otherwise milliseconds to wait.
+_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local refill_per_ms = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local reserve = tonumber(ARGV[4])
+local redis_time = redis.call('TIME')
+local now = tonumber(redis_time[1]) * 1000 + math.floor(tonumber(redis_time[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * refill_per_ms)
+local wait_ms = 0
+if tokens - cost >= reserve then
+    tokens = tokens - cost
+else
+    wait_ms = math.ceil((cost + reserve - tokens) / refill_per_ms)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / refill_per_ms) + 1000)
+return wait_ms
+"""
+
+# --- Exchange Rate Limiter ---
+class ExchangeRateLimiter:
+    """
+    Token bucket holding one exchange's request-weight budget.
+    Backed by Redis (shared by every process) when REDIS_HOST is set, otherwise in memory.
+    Callers wait instead of failing: within a process the highest-priority waiter goes first,
+    and across processes background callers leave a reserve that only interactive callers may use.
+    """
+
+    def __init__(self, exchange_name: str, weight_per_minute: float = EXCHANGE_RATE_LIMIT_WEIGHT_PER_MINUTE,
+                 interactive_reserve: float = RATE_LIMIT_INTERACTIVE_RESERVE, redis_host: str = REDIS_HOST):
+        self.exchange_name = exchange_name
+        self.capacity = weight_per_minute
+        self.refill_per_ms = weight_per_minute / 60000
+        self.background_reserve = weight_per_minute * interactive_reserve
+        self._redis_host = redis_host
+        self._redis_script = None
+        # In-memory fallback bucket
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        # Priority queue of waiters in this process
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._head_changed = asyncio.Event()
+        self.waited_seconds = 0.0
+
+    def _get_redis_script(self):
+        if self._redis_script is None and self._redis_host:
+            try:
+                import redis.asyncio as aioredis
+                client = aioredis.Redis(host=self._redis_host, port=REDIS_PORT, db=RATE_LIMIT_REDIS_DB)
+                self._redis_script = client.register_script(_TOKEN_BUCKET_LUA)
+            except ImportError:
+                print("هشدار: کتابخانه redis نصب نیست. محدودیت نرخ فقط در همین پروسه اعمال می‌شود.")
+                self._redis_host = None
+        return self._redis_script
+
+    def _take_local(self, cost: float, reserve: float) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * 1000 * self.refill_per_ms)
+        self._last_refill = now
+        if self._tokens - cost >= reserve:
+            self._tokens -= cost
+            return 0.0
+        return (cost + reserve - self._tokens) / self.refill_per_ms / 1000
+
+    async def _take(self, cost: float, reserve: float) -> float:
+        """Tries to take `cost` tokens; returns 0 on success, otherwise seconds to wait."""
+        script = self._get_redis_script()
+        if script:
+            try:
+                wait_ms = await script(keys=[f"ratelimit:{self.exchange_name}"],
+                                       args=[self.capacity, self.refill_per_ms, cost, reserve])
+                return int(wait_ms) / 1000
+            except Exception as e:
+                print(f"خطا در محدودکننده نرخ Redis، استفاده از محدودکننده محلی: {e}")
+        return self._take_local(cost, reserve)
+
+    async def acquire(self, endpoint: str, priority: int = PRIORITY_BACKGROUND):
+        """
+        Waits until the weight of `endpoint` fits in the shared budget, then consumes it.
+        """
+        reserve = self.background_reserve if priority > PRIORITY_INTERACTIVE else 0.0
+        cost = min(ENDPOINT_WEIGHTS.get(endpoint, DEFAULT_ENDPOINT_WEIGHT), self.capacity - reserve)
+        entry = (priority, next(self._sequence))
+        heapq.heappush(self._waiters, entry)
+        started_at = time.monotonic()
+        try:
+            while True:
+                if self._waiters[0] == entry:
+                    wait_seconds = await self._take(cost, reserve)
+                    if wait_seconds <= 0:
+                        return
+                    await asyncio.sleep(wait_seconds)
+                else:
+                    await self._head_changed.wait()
+        finally:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            # Wake everyone up so the new head can proceed
+            self._head_changed.set()
+            self._head_changed = asyncio.Event()
+            self.waited_seconds += time.monotonic() - started_at
+
+
+_rate_limiters = {}
+
+def get_rate_limiter(exchange_name: str) -> ExchangeRateLimiter:
+    """Returns the process-wide rate limiter for an exchange."""
+    exchange_name = exchange_name.lower()
+    if exchange_name not in _rate_limiters:
+        _rate_limiters[exchange_name] = ExchangeRateLimiter(exchange_name)
+    return _rate_limiters[exchange_name]
@@ -0,0 +1,192 @@
+import os
+import time
+import asyncio
+import numpy as np
+
+try:
+    from web.models import Filter as DBFilter
+    from bot.scanner_utils import (get_symbols_to_scan, get_indicator_plan, get_latest_symbol_values,
+                                   fetch_symbol_arrays, compute_symbol_values, build_value_matrix,
+                                   evaluate_plan_staged, triggered_details_from_mask, deliver_filter_results,
+                                   SCANNER_OHLCV_LIMIT, SCANNER_SYMBOL_CONCURRENCY)
+    from bot.alert_utils import alert_state_store, SCANNER_ALERT_MODE
+    from bot.panel_utils import latest_panel_values
+    from bot.chart_utils import get_indicator_cache_stats
+    from bot.cache_utils import ohlcv_cache, get_singleflight_stats
+except ImportError:
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from web.models import Filter as DBFilter
+    from bot.scanner_utils import (get_symbols_to_scan, get_indicator_plan, get_latest_symbol_values,
+                                   fetch_symbol_arrays, compute_symbol_values, build_value_matrix,
+                                   evaluate_plan_staged, triggered_details_from_mask, deliver_filter_results,
+                                   SCANNER_OHLCV_LIMIT, SCANNER_SYMBOL_CONCURRENCY)
+    from bot.alert_utils import alert_state_store, SCANNER_ALERT_MODE
+    from bot.panel_utils import latest_panel_values
+    from bot.chart_utils import get_indicator_cache_stats
+    from bot.cache_utils import ohlcv_cache, get_singleflight_stats
+
+# Ticks fetching at least this many symbols compute every indicator for all of them in one vectorized
+# pass over a (symbols x candles) panel; below it, per-symbol TA-Lib calls on demand are faster
+SCANNER_PANEL_MIN_SYMBOLS = int(os.getenv("SCANNER_PANEL_MIN_SYMBOLS", "200"))
+
+
+# --- Scan Coordinator ---
+class ScanCoordinator:
+    """
+    Runs every active filter of a timeframe as one batch per tick.
+    The symbols of all due filters are merged and each (symbol, timeframe) is fetched once; every
+    filter is then evaluated against that shared data, and each indicator is computed at most once
+    per symbol, only when a filter still needs it for that symbol (or, for large ticks, for every
+    symbol at once in one indicator panel). Exchange calls and indicator work per tick scale with
+    the number of distinct symbols instead of filters x symbols.
+    """
+
+    def __init__(self, symbol_concurrency: int = SCANNER_SYMBOL_CONCURRENCY):
+        self.symbol_concurrency = symbol_concurrency
+        self.stats = {'ticks': 0, 'filter_runs': 0, 'symbol_evaluations': 0, 'symbols_fetched': 0}
+        self.last_symbol_seconds = {} # symbol -> load seconds of the latest load_symbol_arrays / load_latest_values
+
+    async def _load_symbols(self, symbols: list, load) -> dict:
+        """Runs `load(symbol)` for every symbol with bounded concurrency; returns {symbol: result}."""
+        semaphore = asyncio.Semaphore(self.symbol_concurrency)
+        symbol_seconds = {}
+
+        async def timed_load(symbol: str):
+            async with semaphore:
+                started = time.perf_counter()
+                result = await load(symbol)
+                symbol_seconds[symbol] = time.perf_counter() - started
+                return result
+
+        results = await asyncio.gather(*(timed_load(symbol) for symbol in symbols))
+        self.last_symbol_seconds = symbol_seconds
+        return dict(zip(symbols, results))
+
+    async def load_symbol_arrays(self, timeframe: str, symbols: list, ohlcv_limit: int) -> dict:
+        """Fetches every symbol once; returns {symbol: candle arrays or None}. Indicators are computed on demand."""
+        return await self._load_symbols(symbols, lambda symbol: fetch_symbol_arrays(symbol, timeframe, ohlcv_limit))
+
+    def compute_latest_values(self, timeframe: str, symbol_arrays: dict, symbol_specs: dict, tail: int) -> dict:
+        """
+        Returns {symbol: latest values or None} for the fetched `symbol_arrays`. Large ticks get every
+        merged spec from one indicator panel; smaller ones start with 'close' only and let
+        evaluate_plan_staged compute the columns per symbol when a filter still needs them.
+        """
+        if len(symbol_arrays) >= SCANNER_PANEL_MIN_SYMBOLS:
+            specs = tuple(dict.fromkeys(spec for specs in symbol_specs.values() for spec in specs))
+            panel_values = latest_panel_values(symbol_arrays, specs, tail)
+            return {symbol: panel_values.get(symbol) for symbol in symbol_arrays}
+        return {symbol: compute_symbol_values(symbol, timeframe, arrays, (), tail) if arrays else None
+                for symbol, arrays in symbol_arrays.items()}
+
+    async def load_latest_values(self, timeframe: str, symbol_specs: dict, ohlcv_limit: int, tail: int) -> dict:
+        """Fetches every symbol once and computes all its merged specs; returns {symbol: latest values or None}."""
+        return await self._load_symbols(list(symbol_specs), lambda symbol: get_latest_symbol_values(
+            symbol, timeframe, tuple(symbol_specs[symbol]), ohlcv_limit, tail))
+
+    async def prepare_tick(self, db_session, timeframe: str, filter_ids: list = None) -> dict | None:
+        """
+        Resolves the symbols and plans of the active filters of `timeframe` (only `filter_ids`, if given,
+        e.g. from the scan dispatcher's index) and merges them.
+        Returns {'runs': [(filter_obj, plan, symbols)], 'symbol_specs': {symbol: {spec: None}},
+        'ohlcv_limit', 'tail'}, or None if no filter is due.
+        """
+        query = db_session.query(DBFilter).filter(DBFilter.active == True, DBFilter.timeframe == timeframe)
+        if filter_ids is not None:
+            query = query.filter(DBFilter.id.in_(filter_ids))
+        filters_due = query.all()
+        if not filters_due:
+            return None
+        print(f"درحال اجرای {len(filters_due)} اسکنر تایم‌فریم {timeframe} به صورت دسته‌ای...")
+
+        runs = []
+        symbol_specs = {} # symbol -> {spec: None}, an ordered set of the specs any filter needs
+        ohlcv_limit = SCANNER_OHLCV_LIMIT
+        tail = 1
+        for filter_obj in filters_due:
+            symbols_to_scan, error_msg = await get_symbols_to_scan(filter_obj)
+            if error_msg or not symbols_to_scan:
+                print(f"اسکنر {filter_obj.name} (ID: {filter_obj.id}) اجرا نشد: {error_msg or 'هیچ نمادی برای اسکن یافت نشد.'}")
+                continue
+            plan = get_indicator_plan(filter_obj)
+            ohlcv_limit = max(ohlcv_limit, plan['min_candles'])
+            tail = max(tail, plan['tail'])
+            for symbol in symbols_to_scan:
+                symbol_specs.setdefault(symbol, {}).update(dict.fromkeys(plan['specs']))
+            runs.append((filter_obj, plan, symbols_to_scan))
+        return {'runs': runs, 'symbol_specs': symbol_specs, 'ohlcv_limit': ohlcv_limit, 'tail': tail}
+
+    async def evaluate_and_deliver(self, db_session, runs: list, latest_values: dict, tail: int, bot_client=None,
+                                   symbol_arrays: dict = None) -> dict:
+        """
+        Evaluates every filter of a tick against the shared {symbol: latest values} and notifies
+        its user through `bot_client` (anything with an async send_message(chat_id, text)).
+        With `symbol_arrays` ({symbol: fetched candles}) indicator columns missing from the values are
+        computed on demand, only for symbols a filter has not ruled out yet.
+        In 'edge' alert mode only symbols that newly match are notified and returned.
+        Returns {filter_id: [triggered_symbols]}.
+        """
+        results = {}
+        for filter_obj, plan, symbols_to_scan in runs:
+            # Conditions run cheapest and most selective first, each only over the symbols still matching;
+            # computed columns stay in latest_values for the next filters
+            filter_symbols = [symbol for symbol in symbols_to_scan if symbol in latest_values]
+            mask, reason_values = evaluate_plan_staged(plan, filter_obj.timeframe, filter_symbols, latest_values, symbol_arrays, tail)
+            closes = build_value_matrix([latest_values[symbol] for symbol in filter_symbols], ['close'], tail)[:, 0, -1]
+            if SCANNER_ALERT_MODE == 'edge':
+                # Only symbols that just started matching are sent; rows without data keep their state
+                evaluated = ~np.isnan(closes)
+                mask = await alert_state_store.filter_new_matches(filter_obj.id, filter_symbols, mask, evaluated)
+            triggered_symbols_details = triggered_details_from_mask(filter_obj, plan, filter_symbols, closes, mask, reason_values)
+            triggered_symbols, _, _ = await deliver_filter_results(db_session, filter_obj, triggered_symbols_details, bot_client)
+            results[filter_obj.id] = triggered_symbols
+            self.stats['symbol_evaluations'] += len(filter_symbols)
+
+        self.stats['ticks'] += 1
+        self.stats['filter_runs'] += len(runs)
+        self.stats['symbols_fetched'] += len(latest_values)
+        return results
+
+    async def run_tick(self, db_session, timeframe: str, bot_client=None, filter_ids: list = None) -> dict:
+        """
+        Runs the active filters of `timeframe` (all, or only `filter_ids`) against shared market data
+        and notifies their users. Returns {filter_id: [triggered_symbols]}.
+        """
+        started = time.perf_counter()
+        indicator_cache_before = get_indicator_cache_stats()
+        ohlcv_cache_before, singleflight_before = ohlcv_cache.stats(), get_singleflight_stats()
+        tick = await self.prepare_tick(db_session, timeframe, filter_ids)
+        if tick is None:
+            return {}
+        symbol_arrays = await self.load_symbol_arrays(timeframe, list(tick['symbol_specs']), tick['ohlcv_limit'])
+        latest_values = self.compute_latest_values(timeframe, symbol_arrays, tick['symbol_specs'], tick['tail'])
+        results = await self.evaluate_and_deliver(db_session, tick['runs'], latest_values, tick['tail'], bot_client, symbol_arrays)
+
+        indicator_cache_after = get_indicator_cache_stats()
+        hits = indicator_cache_after['hits'] - indicator_cache_before['hits']
+        misses = indicator_cache_after['misses'] - indicator_cache_before['misses']
+        hit_rate = f"{hits / (hits + misses):.0%}" if hits + misses else "-"
+        print(f"تیک اسکن {timeframe}: {len(tick['runs'])} اسکنر روی {len(symbol_arrays)} نماد در "
+              f"{time.perf_counter() - started:.2f} ثانیه | کش اندیکاتور: {hits} برخورد، {misses} محاسبه "
+              f"(نرخ برخورد {hit_rate}، {indicator_cache_after['size']}/{indicator_cache_after['max_entries']} مدخل)")
+        self._log_fetch_stats(timeframe, ohlcv_cache_before, singleflight_before)
+        return results
+
+    @staticmethod
+    def _log_fetch_stats(timeframe: str, ohlcv_cache_before: dict, singleflight_before: dict):
+        # OHLCV cache hits and request coalescing of this tick, from the differences of the process-wide counters
+        ohlcv_cache_after = ohlcv_cache.stats()
+        hits = ohlcv_cache_after['hits'] - ohlcv_cache_before['hits']
+        misses = ohlcv_cache_after['misses'] - ohlcv_cache_before['misses']
+        groups = []
+        for name, group in get_singleflight_stats().items():
+            before = singleflight_before.get(name, {'calls': 0, 'coalesced': 0})
+            calls, coalesced = group['calls'] - before['calls'], group['coalesced'] - before['coalesced']
+            if calls or coalesced:
+                groups.append(f"{name} {coalesced}/{calls + coalesced} ({coalesced / (calls + coalesced):.0%})")
+        print(f"تیک اسکن {timeframe}: کش OHLCV {hits} برخورد، {misses} عدم برخورد | "
+              f"درخواست‌های ادغام‌شده: {'، '.join(groups) or '-'}")
+
+
+scan_coordinator = ScanCoordinator()
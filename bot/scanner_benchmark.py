@@ -0,0 +1,368 @@
+"""
+Scanner benchmark: runs the scheduler's scan tick (ScanCoordinator.run_tick) against a deterministic
+synthetic exchange over a sweep of filters x symbols x timeframes, and writes the measurements as JSON
+so runs can be compared across commits.
+
+    python -m bot.scanner_benchmark --filters 1,10,50 --symbols 20,100 --timeframes 1h,15m \\
+        --ticks 5 --latency-ms 20 --error-rate 0.01 --output benchmark.json
+
+Every scenario starts cold (empty candle buffers and indicator cache); tick 0 seeds the buffers and
+each later tick advances the synthetic clock by one candle, like consecutive scheduler ticks.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import contextlib
+import subprocess
+import tracemalloc
+import numpy as np
+import ccxt.async_support as ccxt
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+# Load environment variables from .env in the project root
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+# Runs are isolated and comparable: no Redis, no local history store, no request throttling and a single
+# venue. Set before the bot modules read their configuration at import time.
+os.environ["REDIS_HOST"] = ""
+os.environ["OHLCV_HISTORY_ENABLED"] = "false"
+os.environ["EXCHANGE_RATE_LIMIT_WEIGHT_PER_MINUTE"] = os.getenv("BENCHMARK_RATE_LIMIT_WEIGHT_PER_MINUTE", "1000000000")
+os.environ["MARKET_DATA_EXCHANGES"] = os.getenv("DEFAULT_EXCHANGE_NAME", "binance")
+
+try:
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from web.models import Base, User as DBUser, Filter as DBFilter
+    from bot.alert_utils import alert_state_store
+    from bot.cache_utils import timeframe_to_seconds, current_candle_open, next_candle_close
+    from bot.candle_utils import expire_candle_buffers
+    from bot.chart_utils import indicator_cache, EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY
+    from bot.exchange_utils import register_exchange_client, DEFAULT_EXCHANGE_NAME
+    from bot.scan_coordinator import ScanCoordinator
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from web.models import Base, User as DBUser, Filter as DBFilter
+    from bot.alert_utils import alert_state_store
+    from bot.cache_utils import timeframe_to_seconds, current_candle_open, next_candle_close
+    from bot.candle_utils import expire_candle_buffers
+    from bot.chart_utils import indicator_cache, EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY
+    from bot.exchange_utils import register_exchange_client, DEFAULT_EXCHANGE_NAME
+    from bot.scan_coordinator import ScanCoordinator
+
+BENCHMARK_RESULT_VERSION = 1
+BENCHMARK_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+SYNTHETIC_MAX_CANDLES_PER_CALL = 1000
+
+# --- Synthetic Exchange ---
+# Candles are numbered from the one containing the epoch and bucketed like cache_utils
+# (weekly from Monday, monthly by calendar month), so cache expiry and the served candles agree
+def _candle_open_ms(timeframe: str, index: int) -> int:
+    """Open time (ms) of the index-th candle of `timeframe`."""
+    if timeframe.endswith('M'):
+        months = index * int(timeframe[:-1])
+        return int(datetime(1970 + months // 12, months % 12 + 1, 1, tzinfo=timezone.utc).timestamp()) * 1000
+    return current_candle_open(timeframe, 0) * 1000 + index * timeframe_to_seconds(timeframe) * 1000
+
+def _candle_index(timeframe: str, timestamp_ms: int) -> int:
+    """Index of the candle of `timeframe` containing `timestamp_ms`."""
+    candle_open = current_candle_open(timeframe, timestamp_ms / 1000)
+    if timeframe.endswith('M'):
+        moment = datetime.fromtimestamp(candle_open, timezone.utc)
+        return ((moment.year - 1970) * 12 + moment.month - 1) // int(timeframe[:-1])
+    return (candle_open - current_candle_open(timeframe, 0)) // timeframe_to_seconds(timeframe)
+
+def _hash_uniform(seed: int, indices: np.ndarray) -> np.ndarray:
+    """Deterministic uniform [0, 1) values per integer index (splitmix64), independent of call order."""
+    x = (indices.astype(np.uint64) + np.uint64(seed)) * np.uint64(0x9E3779B97F4A7C15)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+class SyntheticExchange:
+    """
+    Minimal stand-in for a ccxt async exchange that serves synthetic OHLCV.
+    Every candle is a pure function of (seed, symbol, timeframe, candle index), so any range can be
+    served without stored history and repeated runs see identical prices. Closes oscillate on two
+    symbol-specific cycles plus noise, which makes RSI, EMA and crossover conditions fire regularly.
+    Calls sleep for `latency_ms` +/- `jitter_ms` and fail with ccxt.NetworkError at `error_rate`;
+    the clock (`now_ms`) only moves when advance() is called.
+    """
+
+    def __init__(self, seed: int = 42, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                 start: datetime = BENCHMARK_START):
+        self.id = 'synthetic'
+        self.has = {'fetchOHLCV': True, 'fetchTickers': False}
+        self.markets = {}
+        self.seed = seed
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.now_ms = int(start.timestamp() * 1000)
+        self._random = random.Random(seed)
+        self.calls = {}
+        self.errors = 0
+
+    def advance(self, milliseconds: int):
+        self.now_ms += int(milliseconds)
+
+    def advance_candle(self, timeframe: str):
+        """Moves the clock to the same offset inside the next candle of `timeframe`."""
+        candle_open_ms = current_candle_open(timeframe, self.now_ms / 1000) * 1000
+        self.now_ms = next_candle_close(timeframe, self.now_ms / 1000) * 1000 + (self.now_ms - candle_open_ms)
+
+    def milliseconds(self) -> int:
+        return self.now_ms
+
+    async def _simulate_call(self, method: str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        delay = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        failed = self._random.random() < self.error_rate
+        await asyncio.sleep(delay)
+        if failed:
+            self.errors += 1
+            raise ccxt.NetworkError(f"synthetic {method} failure")
+
+    def _candles(self, symbol: str, timeframe: str, first_index: int, count: int) -> list:
+        series_seed = zlib.crc32(f"{self.seed}:{symbol}:{timeframe}".encode())
+        symbol_hash = zlib.crc32(symbol.encode())
+        base_price = 1.0 + symbol_hash % 50000
+        slow_period = 50 + symbol_hash % 250
+        fast_period = 10 + symbol_hash % 30
+
+        def log_close(indices: np.ndarray) -> np.ndarray:
+            noise = _hash_uniform(series_seed, indices) - 0.5
+            return (np.log(base_price)
+                    + 0.08 * np.sin(2 * np.pi * indices / slow_period + symbol_hash % 7)
+                    + 0.02 * np.sin(2 * np.pi * indices / fast_period)
+                    + 0.01 * noise)
+
+        indices = np.arange(first_index - 1, first_index + count, dtype=np.int64)
+        prices = np.exp(log_close(indices))
+        opens, closes = prices[:-1], prices[1:]
+        wick = _hash_uniform(series_seed ^ 0x5BD1E995, indices[1:])
+        highs = np.maximum(opens, closes) * (1 + 0.004 * wick)
+        lows = np.minimum(opens, closes) * (1 - 0.004 * (1 - wick))
+        volumes = 1000.0 * (0.5 + _hash_uniform(series_seed ^ 0x27D4EB2F, indices[1:]))
+        timestamps = [_candle_open_ms(timeframe, index) for index in indices[1:].tolist()]
+        return [[int(ts), o, h, l, c, v] for ts, o, h, l, c, v in
+                zip(timestamps, opens.tolist(), highs.tolist(), lows.tolist(), closes.tolist(), volumes.tolist())]
+
+    async def fetch_ohlcv(self, symbol: str, timeframe: str = '1m', since: int = None, limit: int = None, params: dict = None) -> list:
+        """Candles up to and including the forming one at now_ms, like ccxt's fetch_ohlcv."""
+        await self._simulate_call('fetch_ohlcv')
+        last_index = _candle_index(timeframe, self.now_ms)
+        if since is None:
+            count = min(limit or 500, SYNTHETIC_MAX_CANDLES_PER_CALL)
+            first_index = last_index - count + 1
+        else:
+            first_index = _candle_index(timeframe, int(since))
+            if _candle_open_ms(timeframe, first_index) < int(since):
+                first_index += 1 # First candle starting at or after `since`
+            count = min(limit or SYNTHETIC_MAX_CANDLES_PER_CALL, SYNTHETIC_MAX_CANDLES_PER_CALL, last_index - first_index + 1)
+        if count <= 0:
+            return []
+        return self._candles(symbol, timeframe, first_index, count)
+
+    async def load_markets(self, reload: bool = False) -> dict:
+        await self._simulate_call('load_markets')
+        return self.markets
+
+    async def close(self):
+        pass
+
+
+# --- Benchmark Scenarios ---
+# Condition mix of the generated filters: plain comparisons, a reference series and multi-bar operators,
+# with some periods varying per filter so the merged indicator specs grow with the filter count
+def benchmark_filter_params(index: int) -> dict:
+    """Deterministic params of the index-th generated filter (two conditions)."""
+    templates = (
+        {'type': 'RSI', 'period': 14, 'operator': '<', 'value': '35'},
+        {'type': 'EMA', 'period': 20 + 10 * (index % 4), 'operator': '<', 'value': 'PRICE'},
+        {'type': 'RSI', 'period': 7 + index % 3, 'operator': 'crosses_above', 'value': '30'},
+        {'type': 'PRICE', 'period': 0, 'operator': 'crosses_above', 'value': 'EMA50'},
+        {'type': 'MACD', 'period': 0, 'operator': '>', 'value': '0'},
+        {'type': 'PRICE', 'period': 0, 'operator': 'change_above', 'value': '2,10'},
+        {'type': 'RSI', 'period': 14, 'operator': 'above_for', 'value': '60,3'},
+    )
+    return {
+        'condition_1': dict(templates[index % len(templates)]),
+        'condition_2': dict(templates[(index + 3) % len(templates)]),
+    }
+
+def _create_benchmark_session(filter_count: int, symbols: list, timeframe: str):
+    """In-memory SQLite session holding one user and `filter_count` active filters over `symbols`."""
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    db_session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    user = DBUser(telegram_id=1, first_name='benchmark')
+    db_session.add(user)
+    db_session.commit()
+    for index in range(filter_count):
+        db_session.add(DBFilter(user_id=user.id, name=f"benchmark-{index}", params=benchmark_filter_params(index),
+                                symbols=symbols, timeframe=timeframe, active=True))
+    db_session.commit()
+    return db_session
+
+def _percentile(values: list, percentile: float) -> float | None:
+    return float(np.percentile(values, percentile)) if values else None
+
+async def run_scenario(filter_count: int, symbol_count: int, timeframe: str, ticks: int, exchange_options: dict,
+                       measure_memory: bool = True) -> dict:
+    """Runs `ticks` scan ticks of one scenario from a cold start; returns its per-tick measurements and summary."""
+    expire_candle_buffers(drop=True)
+    indicator_cache.clear()
+    exchange = SyntheticExchange(**exchange_options)
+    register_exchange_client(DEFAULT_EXCHANGE_NAME, exchange, EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY)
+    coordinator = ScanCoordinator()
+    symbols = [f"SYN{index:04d}/USDT" for index in range(symbol_count)]
+    db_session = _create_benchmark_session(filter_count, symbols, timeframe)
+    for filter_obj in db_session.query(DBFilter).all():
+        await alert_state_store.reset(filter_obj.id)
+
+    tick_results = []
+    warm_symbol_seconds = []
+    try:
+        for tick in range(ticks):
+            if tick > 0:
+                exchange.advance_candle(timeframe)
+                expire_candle_buffers()
+            calls_before, errors_before = sum(exchange.calls.values()), exchange.errors
+            if measure_memory:
+                tracemalloc.reset_peak()
+                memory_before = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                results = await coordinator.run_tick(db_session, timeframe)
+            wall_seconds = time.perf_counter() - started
+            peak_memory = tracemalloc.get_traced_memory()[1] - memory_before if measure_memory else None
+
+            symbol_seconds = list(coordinator.last_symbol_seconds.values())
+            if tick > 0:
+                warm_symbol_seconds.extend(symbol_seconds)
+            tick_results.append({
+                'tick': tick,
+                'cold': tick == 0,
+                'wall_seconds': wall_seconds,
+                'exchange_calls': sum(exchange.calls.values()) - calls_before,
+                'exchange_errors': exchange.errors - errors_before,
+                'peak_memory_bytes': peak_memory,
+                'symbol_seconds_p50': _percentile(symbol_seconds, 50),
+                'symbol_seconds_p99': _percentile(symbol_seconds, 99),
+                'triggered': sum(len(triggered) for triggered in results.values()),
+            })
+    finally:
+        db_session.close()
+
+    warm_ticks = [result for result in tick_results if not result['cold']]
+    return {
+        'filters': filter_count,
+        'symbols': symbol_count,
+        'timeframe': timeframe,
+        'ticks': tick_results,
+        'summary': {
+            'cold_wall_seconds': tick_results[0]['wall_seconds'] if tick_results else None,
+            'warm_wall_seconds_median': _percentile([result['wall_seconds'] for result in warm_ticks], 50),
+            'warm_exchange_calls_per_tick': (sum(result['exchange_calls'] for result in warm_ticks) / len(warm_ticks)
+                                             if warm_ticks else None),
+            'peak_memory_bytes': max((result['peak_memory_bytes'] for result in tick_results
+                                      if result['peak_memory_bytes'] is not None), default=None),
+            'warm_symbol_seconds_p50': _percentile(warm_symbol_seconds, 50),
+            'warm_symbol_seconds_p99': _percentile(warm_symbol_seconds, 99),
+            # Buffers refresh incrementally, so a warm tick without errors fetches each symbol exactly once
+            'warm_one_call_per_symbol': all(result['exchange_calls'] == symbol_count for result in warm_ticks
+                                            if result['exchange_errors'] == 0),
+        },
+    }
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__), capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run_benchmark(filter_counts: list, symbol_counts: list, timeframes: list, ticks: int, exchange_options: dict,
+                        measure_memory: bool = True) -> dict:
+    """Runs every filters x symbols x timeframes scenario and returns the JSON-serialisable report."""
+    if measure_memory:
+        tracemalloc.start()
+    scenarios = []
+    try:
+        for timeframe in timeframes:
+            for symbol_count in symbol_counts:
+                for filter_count in filter_counts:
+                    scenario = await run_scenario(filter_count, symbol_count, timeframe, ticks, exchange_options, measure_memory)
+                    summary = scenario['summary']
+                    print(f"{timeframe:>4} {symbol_count:>5} symbols {filter_count:>4} filters | "
+                          f"cold {summary['cold_wall_seconds']:.3f}s warm {summary['warm_wall_seconds_median'] or 0:.3f}s | "
+                          f"calls/tick {summary['warm_exchange_calls_per_tick'] or 0:.1f} | "
+                          f"symbol p50/p99 {(summary['warm_symbol_seconds_p50'] or 0) * 1000:.1f}/"
+                          f"{(summary['warm_symbol_seconds_p99'] or 0) * 1000:.1f}ms", file=sys.stderr)
+                    if not summary['warm_one_call_per_symbol']:
+                        print(f"{timeframe:>4} warning: warm ticks did not make exactly one exchange call per symbol",
+                              file=sys.stderr)
+                    scenarios.append(scenario)
+    finally:
+        if measure_memory:
+            tracemalloc.stop()
+    return {
+        'version': BENCHMARK_RESULT_VERSION,
+        'commit': _git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'config': {'ticks': ticks, 'measure_memory': measure_memory, **exchange_options,
+                   'start': exchange_options.get('start', BENCHMARK_START).isoformat()},
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'scenarios': scenarios,
+    }
+
+def _int_list(value: str) -> list:
+    return [int(item) for item in value.split(',') if item.strip()]
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Benchmarks scanner ticks against a synthetic exchange.")
+    parser.add_argument('--filters', type=_int_list, default=[1, 10, 50], help="Comma-separated active filter counts")
+    parser.add_argument('--symbols', type=_int_list, default=[20, 100], help="Comma-separated symbol counts")
+    parser.add_argument('--timeframes', default='1h', help="Comma-separated timeframes")
+    parser.add_argument('--ticks', type=int, default=5, help="Ticks per scenario (the first one is cold)")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Mean synthetic exchange latency")
+    parser.add_argument('--jitter-ms', type=float, default=5.0, help="Uniform +/- latency jitter")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of exchange calls that fail")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-memory', action='store_true', help="Skip tracemalloc (lower overhead, no peak memory)")
+    parser.add_argument('--output', default='scanner_benchmark.json', help="JSON report path ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    exchange_options = {'seed': args.seed, 'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms,
+                        'error_rate': args.error_rate}
+    timeframes = [timeframe.strip() for timeframe in args.timeframes.split(',') if timeframe.strip()]
+    report = asyncio.run(run_benchmark(args.filters, args.symbols, timeframes, max(1, args.ticks), exchange_options,
+                                       measure_memory=not args.no_memory))
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"Benchmark report written to {args.output}", file=sys.stderr)
+    # Non-zero exit when a scenario's warm ticks re-fetched more than the newest candles
+    return 0 if all(scenario['summary']['warm_one_call_per_symbol'] for scenario in report['scenarios']) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,98 +1,480 @@
 import os
+import re
+import time
+import asyncio
 import ccxt.async_support as ccxt
-import pandas as pd
+import numpy as np
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 # Assuming web.models and chart_utils are accessible
 try:
     from web.models import Filter as DBFilter, User as DBUser # Renamed to avoid conflict
-    from bot.chart_utils import fetch_historical_data, add_indicators, get_ccxt_exchange_client
+    from bot.chart_utils import (fetch_buffered_arrays, cached_indicator_tail, indicator_column, indicator_min_candles,
+                                 INDICATOR_DEFAULT_PARAMS)
+    from bot.market_utils import get_market_universe, SCANNER_DEFAULT_UNIVERSE_SIZE
+    from bot.indicator_engine import indicator_engine
+    from bot.candle_utils import OHLCV_COLUMNS
 except ImportError:
     import sys
     sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
     from web.models import Filter as DBFilter, User as DBUser
-    from bot.chart_utils import fetch_historical_data, add_indicators, get_ccxt_exchange_client
+    from bot.chart_utils import (fetch_buffered_arrays, cached_indicator_tail, indicator_column, indicator_min_candles,
+                                 INDICATOR_DEFAULT_PARAMS)
+    from bot.market_utils import get_market_universe, SCANNER_DEFAULT_UNIVERSE_SIZE
+    from bot.indicator_engine import indicator_engine
+    from bot.candle_utils import OHLCV_COLUMNS
 
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 DEFAULT_EXCHANGE_NAME = os.getenv("DEFAULT_EXCHANGE_NAME", "binance").lower()
-EXCHANGE_API_KEY = os.getenv("EXCHANGE_API_KEY") # For fetching markets if needed
-EXCHANGE_SECRET_KEY = os.getenv("EXCHANGE_SECRET_KEY")
+SCANNER_OHLCV_LIMIT = 150 # Candles kept per symbol; enough history for the indicators
+# Symbols of one filter fetched and evaluated at the same time
+SCANNER_SYMBOL_CONCURRENCY = int(os.getenv("SCANNER_SYMBOL_CONCURRENCY", "8"))
 
 # --- Symbol Fetching ---
 async def get_symbols_to_scan(filter_obj: DBFilter, exchange_name: str = DEFAULT_EXCHANGE_NAME) -> tuple[list[str] | None, str | None]:
     """
     Determines the list of symbols to scan.
     If filter_obj.symbols is set, use that.
-    Otherwise, fetch top N (e.g., 20) USDT markets by volume from the exchange.
+    Otherwise, use the top N (SCANNER_DEFAULT_UNIVERSE_SIZE) USDT markets by 24h volume,
+    served from the in-memory market universe instead of reloading markets on every run.
     Returns (list_of_symbols, error_message_if_any)
     """
     if filter_obj.symbols and isinstance(filter_obj.symbols, list) and len(filter_obj.symbols) > 0:
         return filter_obj.symbols, None
 
-    # Fetch top N symbols (e.g., top 20 by volume with USDT as quote)
-    exchange = await get_ccxt_exchange_client(exchange_name, EXCHANGE_API_KEY, EXCHANGE_SECRET_KEY)
-    if not exchange:
-        return None, f"خطا در اتصال به صرافی {exchange_name} برای دریافت لیست نمادها."
-    
-    try:
-        markets = await exchange.load_markets()
-        usdt_pairs = []
-        for symbol, market_data in markets.items():
-            if market_data.get('quote', '').upper() == 'USDT' and market_data.get('active', True):
-                # CCXT often provides 'quoteVolume' or 'info' field for 24h volume
-                volume = market_data.get('quoteVolume', 0)
-                if not volume and market_data.get('info') and isinstance(market_data['info'], dict):
-                    # Example for Binance-like structure, may need adjustment for others
-                    volume = float(market_data['info'].get('quoteVolume', 0)) 
-                usdt_pairs.append({'symbol': symbol, 'volume': volume})
-        
-        # Sort by volume in descending order and take top 20
-        sorted_pairs = sorted(usdt_pairs, key=lambda x: x['volume'], reverse=True)
-        top_symbols = [pair['symbol'] for pair in sorted_pairs[:20]] # Get top 20 symbols
-
-        if not top_symbols:
-            return None, "نمادی برای اسکن یافت نشد (لیست پیشفرض خالی است)."
-        
-        print(f"اسکن بر روی {len(top_symbols)} نماد برتر انجام می‌شود: {top_symbols}")
-        return top_symbols, None
+    universe = get_market_universe(exchange_name)
+    top_symbols, error_msg = await universe.get_top_symbols('USDT', SCANNER_DEFAULT_UNIVERSE_SIZE)
+    if error_msg:
+        return None, error_msg
+    if not top_symbols:
+        return None, "نمادی برای اسکن یافت نشد (لیست پیشفرض خالی است)."
 
-    except Exception as e:
-        return None, f"خطا در دریافت لیست نمادهای پیشفرض از صرافی: {e}"
-    finally:
-        if exchange:
-            await exchange.close()
+    print(f"اسکن بر روی {len(top_symbols)} نماد برتر انجام می‌شود: {top_symbols}")
+    return top_symbols, None
 
 
 # --- Condition Evaluation ---
-def evaluate_condition(value, operator, condition_value_str) -> bool:
+# Comparison operators of filter conditions as NumPy ufuncs, applied to a whole column of symbols at once.
+# NaN (indicator still warming up or not computed) compares False, so such symbols never match.
+CONDITION_OPERATORS = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '=': np.equal,
+    '==': np.equal,
+}
+
+# Multi-bar operators, evaluated over the last bars of the buffered series. Condition values:
+#   crosses_above / crosses_below: a level or another series, e.g. '30', 'EMA50', 'PRICE'
+#   above_for / below_for: '<level or series>,<bars>', e.g. '70,3' = above 70 for 3 consecutive bars
+#   change_above / change_below: '<percent>,<bars>', e.g. '5,10' = rose more than 5% over 10 bars
+WINDOW_OPERATORS = ('crosses_above', 'crosses_below', 'above_for', 'below_for', 'change_above', 'change_below')
+
+_SERIES_REFERENCE_PATTERN = re.compile(r'^\s*(RSI|EMA|MACD|PRICE|CLOSE)\s*\(?\s*(\d*)\s*\)?\s*$', re.IGNORECASE)
+
+def parse_series_reference(value_str: str) -> tuple | None:
+    """
+    Parses a series used as a condition's right-hand side, e.g. 'EMA50', 'ema(50)', 'RSI' or 'PRICE'.
+    Returns (column, spec) where spec is the (indicator, params) to compute, or None for the close price;
+    returns None if value_str is not a series.
+    """
+    match = _SERIES_REFERENCE_PATTERN.match(str(value_str))
+    if not match:
+        return None
+    indicator = match.group(1).upper()
+    if indicator in ('PRICE', 'CLOSE'):
+        return 'close', None
+    default_params = INDICATOR_DEFAULT_PARAMS[indicator]
+    period = int(match.group(2) or 0)
+    spec = (indicator, (period,) + default_params[1:] if period > 0 and indicator != 'MACD' else default_params)
+    return indicator_column(*spec), spec
+
+def parse_condition_value(operator, condition_value_str) -> tuple[dict | None, str | None]:
     """
-    Evaluates a single condition.
-    Example: value=25, operator='<', condition_value_str='30' -> True
+    Parses a condition's value once, when the filter is compiled (or entered in the bot).
+    Returns ({'threshold', 'reference', 'reference_spec', 'bars'}, None), where the right-hand side is
+    either a numeric threshold or a reference series column, or (None, error_message).
     """
+    if operator not in CONDITION_OPERATORS and operator not in WINDOW_OPERATORS:
+        return None, f"عملگر نامعتبر: {operator}"
+    value_str, bars = str(condition_value_str).strip(), 1
+    if operator in ('above_for', 'below_for', 'change_above', 'change_below'):
+        value_str, _, bars_str = value_str.partition(',')
+        try:
+            bars = int(bars_str)
+            if bars < 1:
+                raise ValueError
+        except ValueError:
+            return None, f"تعداد کندل نامعتبر در مقدار شرط: {condition_value_str} (مثال: 70,3)"
+
+    parsed = {'threshold': None, 'reference': None, 'reference_spec': None, 'bars': bars}
     try:
-        condition_value = float(condition_value_str)
-        if operator == '<':
-            return value < condition_value
-        elif operator == '<=':
-            return value <= condition_value
-        elif operator == '>':
-            return value > condition_value
-        elif operator == '>=':
-            return value >= condition_value
-        elif operator == '=' or operator == '==':
-            # Using a small epsilon for float comparison might be better in some cases
-            return value == condition_value 
-        # Potentially add 'crosses', 'crosses_above', 'crosses_below' for two series later
-        else:
-            print(f"عملگر نامعتبر: {operator}")
-            return False
+        parsed['threshold'] = float(value_str)
+        return parsed, None
     except ValueError:
-        print(f"مقدار شرط نامعتبر: {condition_value_str}")
-        return False
+        pass
+    reference = parse_series_reference(value_str) if not operator.startswith('change_') else None
+    if reference is None:
+        return None, f"مقدار شرط نامعتبر: {condition_value_str}"
+    parsed['reference'], parsed['reference_spec'] = reference
+    return parsed, None
+
+def condition_lookback(condition: dict) -> int:
+    """Number of latest bars a condition reads."""
+    operator = condition['operator']
+    if operator in ('crosses_above', 'crosses_below'):
+        return 2
+    if operator in ('above_for', 'below_for'):
+        return condition['bars']
+    if operator in ('change_above', 'change_below'):
+        return condition['bars'] + 1
+    return 1
+
+def build_value_matrix(latest_rows: list, columns: list, tail: int = 1) -> np.ndarray:
+    """
+    Stacks per-symbol values ({column: scalar or array of the last bars} dicts, None for symbols
+    without data) into a float64 (symbols x columns x tail) tensor, right-aligned on the latest bar.
+    Missing values become NaN.
+    """
+    matrix = np.full((len(latest_rows), len(columns), tail), np.nan)
+    for row, latest_data in enumerate(latest_rows):
+        if latest_data is None:
+            continue
+        for col, column in enumerate(columns):
+            value = latest_data.get(column)
+            if value is None:
+                continue
+            values = np.atleast_1d(np.asarray(value, dtype=np.float64))[-tail:]
+            matrix[row, col, tail - len(values):] = values
+    return matrix
+
+def _condition_mask(condition: dict, left: np.ndarray, right: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluates one condition over (symbols x bars) windows of its series (`left`) and right-hand
+    side (`right`, a broadcast level or a series). Returns (mask, value shown in the reason).
+    """
+    operator = condition['operator']
+    if operator in CONDITION_OPERATORS:
+        return CONDITION_OPERATORS[operator](left[:, -1], right[:, -1]), left[:, -1]
+    if operator == 'crosses_above':
+        return (left[:, -2] <= right[:, -2]) & (left[:, -1] > right[:, -1]), left[:, -1]
+    if operator == 'crosses_below':
+        return (left[:, -2] >= right[:, -2]) & (left[:, -1] < right[:, -1]), left[:, -1]
+    bars = condition['bars']
+    if operator == 'above_for':
+        return np.all(left[:, -bars:] > right[:, -bars:], axis=1), left[:, -1]
+    if operator == 'below_for':
+        return np.all(left[:, -bars:] < right[:, -bars:], axis=1), left[:, -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent_change = (left[:, -1] / left[:, -1 - bars] - 1.0) * 100.0
+    if operator == 'change_above':
+        return percent_change > right[:, -1], percent_change
+    return percent_change < right[:, -1], percent_change
+
+def evaluate_plan(plan: dict, matrix: np.ndarray, column_index: dict) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluates a compiled plan over a (symbols x columns x bars) value tensor with a few array
+    operations per condition; multi-bar conditions work on right-aligned windows of the last bars.
+    Returns (mask, reason_values): a boolean mask of the symbols meeting every condition and the
+    (symbols x conditions) values the conditions were checked against, for the notification text.
+    """
+    symbols_count, _, available_bars = matrix.shape
+    mask = np.ones(symbols_count, dtype=bool)
+    reason_values = np.full((symbols_count, len(plan['conditions'])), np.nan)
+    for position, condition in enumerate(plan['conditions']):
+        col = column_index.get(condition['column'])
+        reference_col = column_index.get(condition['reference'])
+        if col is None or condition['parse_error'] or condition_lookback(condition) > available_bars or \
+                (condition['reference'] is not None and reference_col is None):
+            mask[:] = False
+            continue
+        left = matrix[:, col, :]
+        if reference_col is not None:
+            right = matrix[:, reference_col, :]
+        else:
+            right = np.full_like(left, condition['threshold'])
+        condition_mask, reason_values[:, position] = _condition_mask(condition, left, right)
+        mask &= condition_mask
+    return mask, reason_values
+
+def triggered_details_from_mask(filter_obj: DBFilter, plan: dict, symbols: list, closes: np.ndarray,
+                                mask: np.ndarray, reason_values: np.ndarray) -> list[dict]:
+    """Builds [{'symbol', 'reasons', 'latest_close'}, ...] for the symbols selected by `mask`."""
+    triggered_symbols_details = []
+    for row in np.flatnonzero(mask):
+        reasons = []
+        for position, condition in enumerate(plan['conditions']):
+            period = condition['period']
+            shown_value = f"{reason_values[row, position]:.2f}" + ('%' if condition['operator'].startswith('change_') else '')
+            reasons.append(f"✅ {condition['indicator']}({period if period else ''})={shown_value} "
+                           f"{condition['operator']} {condition['value']}")
+        print(f"    >>> نماد {symbols[row]} با شرایط اسکنر {filter_obj.name} مطابقت دارد!")
+        triggered_symbols_details.append({
+            "symbol": symbols[row],
+            "reasons": reasons,
+            "latest_close": closes[row]
+        })
+    return triggered_symbols_details
+
+def plan_columns(plan: dict) -> list[str]:
+    """Value columns a plan's conditions read (including reference series), without duplicates."""
+    columns = []
+    for condition in plan['conditions']:
+        columns.extend(column for column in (condition['column'], condition['reference']) if column)
+    return list(dict.fromkeys(columns))
+
+# --- Condition Statistics ---
+CONDITION_STATS_DECAY = 0.98 # Weight older observations keep per update, so the statistics follow the market
+CONDITION_COST_SMOOTHING = 0.2 # EWMA factor of the per-symbol cost
+CONDITION_PRIOR_PASS_RATE = 0.5 # Assumed for conditions not evaluated yet
+CONDITION_PRIOR_SECONDS = 2e-6 # Assumed per-symbol cost of a comparison on values already computed...
+CONDITION_SPEC_PRIOR_SECONDS = 5e-5 # ...plus this per indicator spec it needs
+
+class ConditionStats:
+    """
+    Learned pass rate and per-symbol cost of scanner conditions, keyed by
+    (timeframe, column, reference, operator, value) so filters sharing a condition share its statistics.
+    Conditions are ordered by expected cost per symbol ruled out, cost / (1 - pass rate): cheap conditions
+    that reject most symbols run first, however the user happened to order them. Kept in memory per process.
+    """
+
+    def __init__(self, decay: float = CONDITION_STATS_DECAY):
+        self.decay = decay
+        self._stats = {} # key -> {'evaluated', 'passed', 'seconds_per_symbol'}
+
+    @staticmethod
+    def _key(timeframe: str, condition: dict) -> tuple:
+        return (timeframe, condition['column'], condition['reference'], condition['operator'], condition['value'])
+
+    def record(self, timeframe: str, condition: dict, evaluated: int, passed: int, seconds: float):
+        """Adds one evaluation stage: `passed` of `evaluated` symbols met the condition in `seconds`."""
+        if evaluated == 0:
+            return
+        entry = self._stats.setdefault(self._key(timeframe, condition), {'evaluated': 0.0, 'passed': 0.0, 'seconds_per_symbol': None})
+        entry['evaluated'] = entry['evaluated'] * self.decay + evaluated
+        entry['passed'] = entry['passed'] * self.decay + passed
+        seconds_per_symbol = seconds / evaluated
+        if entry['seconds_per_symbol'] is None:
+            entry['seconds_per_symbol'] = seconds_per_symbol
+        else:
+            entry['seconds_per_symbol'] += CONDITION_COST_SMOOTHING * (seconds_per_symbol - entry['seconds_per_symbol'])
+
+    def pass_rate(self, timeframe: str, condition: dict) -> float:
+        entry = self._stats.get(self._key(timeframe, condition))
+        if entry is None:
+            return CONDITION_PRIOR_PASS_RATE
+        return (entry['passed'] + CONDITION_PRIOR_PASS_RATE) / (entry['evaluated'] + 1) # The prior counts as one symbol
+
+    def cost(self, timeframe: str, condition: dict) -> float:
+        entry = self._stats.get(self._key(timeframe, condition))
+        if entry is None or entry['seconds_per_symbol'] is None:
+            return CONDITION_PRIOR_SECONDS + CONDITION_SPEC_PRIOR_SECONDS * len(condition['specs'])
+        return entry['seconds_per_symbol']
+
+    def order(self, plan: dict, timeframe: str) -> list[int]:
+        """Positions of the plan's conditions in evaluation order."""
+        def rank(position: int) -> float:
+            condition = plan['conditions'][position]
+            return self.cost(timeframe, condition) / max(1.0 - self.pass_rate(timeframe, condition), 1e-3)
+        return sorted(range(len(plan['conditions'])), key=rank)
+
+    def snapshot(self) -> list[dict]:
+        """Current statistics as [{'timeframe', 'column', 'reference', 'operator', 'value', 'pass_rate', 'seconds_per_symbol'}]."""
+        return [
+            {'timeframe': timeframe, 'column': column, 'reference': reference, 'operator': operator, 'value': value,
+             'pass_rate': (entry['passed'] + CONDITION_PRIOR_PASS_RATE) / (entry['evaluated'] + 1),
+             'seconds_per_symbol': entry['seconds_per_symbol']}
+            for (timeframe, column, reference, operator, value), entry in self._stats.items()
+        ]
+
+
+condition_stats = ConditionStats()
+
+def evaluate_plan_staged(plan: dict, timeframe: str, symbols: list, symbol_values: dict, symbol_arrays: dict = None,
+                         tail: int = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluates a plan one condition at a time in the order learned by condition_stats, each stage only
+    over the symbols still matching. `symbol_values` is {symbol: {column: value or last bars} or None}
+    and may be shared by the filters of a tick. With `symbol_arrays` ({symbol: fetched candles}) the
+    indicator columns a condition needs are computed into it on first use, so symbols already ruled out
+    never compute the remaining indicators. Returns (mask, reason_values) like evaluate_plan; reason
+    values are only filled for the stages a symbol reached.
+    """
+    tail = tail or plan['tail']
+    mask = np.array([symbol_values.get(symbol) is not None for symbol in symbols], dtype=bool)
+    reason_values = np.full((len(symbols), len(plan['conditions'])), np.nan)
+    if any(condition['column'] is None or condition['parse_error'] or condition_lookback(condition) > tail
+           for condition in plan['conditions']):
+        mask[:] = False # A condition that can never be met
+        return mask, reason_values
+
+    for position in condition_stats.order(plan, timeframe):
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0:
+            break
+        condition = plan['conditions'][position]
+        started = time.perf_counter()
+        if symbol_arrays is not None:
+            for row in rows:
+                values = symbol_values[symbols[row]]
+                missing_specs = tuple(spec for spec in condition['specs'] if indicator_column(*spec) not in values)
+                if missing_specs:
+                    compute_symbol_values(symbols[row], timeframe, symbol_arrays[symbols[row]], missing_specs, tail, values)
+        columns = [condition['column']] + ([condition['reference']] if condition['reference'] else [])
+        matrix = build_value_matrix([symbol_values[symbols[row]] for row in rows], columns, tail)
+        left = matrix[:, 0, :]
+        right = matrix[:, 1, :] if condition['reference'] else np.full_like(left, condition['threshold'])
+        condition_mask, reason_values[rows, position] = _condition_mask(condition, left, right)
+        mask[rows] = condition_mask
+        condition_stats.record(timeframe, condition, len(rows), int(condition_mask.sum()), time.perf_counter() - started)
+    return mask, reason_values
+
+# --- Indicator Plan ---
+_indicator_plans = {} # filter_id -> (updated_at, plan)
+
+def compile_indicator_plan(params: dict) -> dict:
+    """
+    Compiles filter params into an indicator plan:
+    {'specs': deduplicated ((indicator, params), ...) actually needed,
+     'conditions': ({'name', 'indicator', 'period', 'column', 'operator', 'value',
+                     'threshold', 'reference', 'bars', 'specs', 'parse_error'}, ...),
+     'tail': latest bars the conditions read (1 unless there are multi-bar conditions),
+     'min_candles': candles needed before every column has a value for all those bars}
+    A condition without a period uses INDICATOR_DEFAULT_PARAMS, so RSI(7) computes rsi7, not rsi14.
+    PRICE conditions read the close price.
+    """
+    specs = []
+    conditions = []
+    for cond_name, condition in params.items():
+        # params = { "condition_1": {'type': 'RSI', 'period': 14, 'operator': '<', 'value': 30}, ... }
+        if not isinstance(condition, dict) or 'type' not in condition:
+            continue
+        indicator = condition['type'].upper()
+        default_params = INDICATOR_DEFAULT_PARAMS.get(indicator)
+        period = int(condition.get('period') or 0)
+        column = None
+        condition_specs = []
+        if indicator == 'PRICE':
+            column = 'close'
+        elif default_params:
+            indicator_params = (period,) + default_params[1:] if period > 0 and indicator != 'MACD' else default_params
+            spec = (indicator, indicator_params)
+            if spec not in specs:
+                specs.append(spec)
+            condition_specs.append(spec)
+            column = indicator_column(*spec)
+        else:
+            print(f"اندیکاتور {indicator} توسط اسکنر پشتیبانی نمی‌شود؛ شرط {cond_name} هرگز برقرار نخواهد شد.")
+
+        operator = condition.get('operator')
+        parsed, parse_error = parse_condition_value(operator, condition.get('value'))
+        if parse_error:
+            print(f"{parse_error}؛ شرط {cond_name} هرگز برقرار نخواهد شد.")
+            parsed = {'threshold': None, 'reference': None, 'reference_spec': None, 'bars': 1}
+        if parsed['reference_spec'] and parsed['reference_spec'] not in specs:
+            specs.append(parsed['reference_spec'])
+        if parsed['reference_spec'] and parsed['reference_spec'] not in condition_specs:
+            condition_specs.append(parsed['reference_spec'])
+        conditions.append({
+            'name': cond_name,
+            'indicator': indicator,
+            'period': period,
+            'column': column, # None for indicators the scanner cannot compute
+            'operator': operator,
+            'value': str(condition.get('value')),
+            'threshold': parsed['threshold'],
+            'reference': parsed['reference'], # Column of the series compared against, if not a number
+            'bars': parsed['bars'],
+            'specs': tuple(condition_specs), # Indicator specs computed before this condition can be checked
+            'parse_error': parse_error,
+        })
+    tail = max((condition_lookback(condition) for condition in conditions), default=1)
+    min_candles = max((indicator_min_candles(*spec) for spec in specs), default=0) + tail - 1
+    return {'specs': tuple(specs), 'conditions': tuple(conditions), 'tail': tail, 'min_candles': min_candles}
+
+def get_indicator_plan(filter_obj: DBFilter) -> dict:
+    """Returns the filter's compiled indicator plan, recompiling it only when the filter was updated."""
+    cached = _indicator_plans.get(filter_obj.id)
+    if cached and cached[0] == filter_obj.updated_at:
+        return cached[1]
+    plan = compile_indicator_plan(filter_obj.params or {})
+    _indicator_plans[filter_obj.id] = (filter_obj.updated_at, plan)
+    return plan
+
+def _latest_engine_values(arrays: dict, symbol: str, timeframe: str, specs: tuple) -> dict | None:
+    """
+    Returns the incremental indicator engine's values for the last buffered candle,
+    or None if the series is not streamed, lags behind, or the requested columns are still warming up.
+    """
+    exchange_name = arrays['exchange']
+    if not indicator_engine.is_tracked(exchange_name, symbol, timeframe):
+        return None
+    history = None
+    for indicator, params in specs:
+        if history is None:
+            history = np.column_stack([arrays[column] for column in OHLCV_COLUMNS]).tolist()
+        indicator_engine.track(exchange_name, symbol, timeframe, indicator, params, history=history)
+    latest_values = indicator_engine.latest(exchange_name, symbol, timeframe)
+    if latest_values is None or latest_values['timestamp'] != int(arrays['timestamp'][-1]):
+        return None
+    if any(latest_values.get(indicator_column(*spec)) is None for spec in specs):
+        return None
+    return latest_values
 
 # --- Main Scanner Logic ---
+async def fetch_symbol_arrays(symbol: str, timeframe: str, ohlcv_limit: int) -> dict | None:
+    """
+    Fetches one symbol's buffered candles; returns {'exchange', <OHLCV column>: array} or None if no data.
+    The columns are copied out of the rolling buffer because indicators may be computed from them
+    later in the tick (see evaluate_plan_staged), after another fetch may have appended to it.
+    """
+    ohlcv_arrays, fetch_err = await fetch_buffered_arrays(symbol, timeframe=timeframe, limit=ohlcv_limit) # Rolling buffer, only new candles are fetched
+    if fetch_err:
+        print(f"    خطا در دریافت اطلاعات OHLCV برای {symbol}: {fetch_err}")
+        return None
+    if ohlcv_arrays is None or len(ohlcv_arrays['close']) == 0:
+        print(f"    اطلاعات OHLCV برای {symbol} خالی است.")
+        return None
+    arrays = {column: np.array(ohlcv_arrays[column]) for column in OHLCV_COLUMNS}
+    arrays['exchange'] = ohlcv_arrays['exchange']
+    return arrays
+
+def compute_symbol_values(symbol: str, timeframe: str, arrays: dict, specs: tuple, tail: int = 1, values: dict = None) -> dict:
+    """
+    Adds 'close' and the `specs` columns of one symbol's latest candle to `values` (a new dict if None)
+    and returns it: engine values for streamed series, otherwise the cached array path. With tail > 1
+    (multi-bar conditions) every value is an array of the last `tail` bars.
+    """
+    values = {} if values is None else values
+    if tail > 1:
+        # The incremental engine only keeps the latest values; windows come from the cached array path
+        values.update(cached_indicator_tail(arrays['exchange'], symbol, timeframe, arrays, specs, tail=tail))
+        values['close'] = arrays['close'][-tail:]
+        return values
+
+    # Streamed series keep incremental indicator state; use it when it is at the latest candle
+    latest_data = _latest_engine_values(arrays, symbol, timeframe, specs)
+    if latest_data is None:
+        tail_values = cached_indicator_tail(arrays['exchange'], symbol, timeframe, arrays, specs)
+        latest_data = {column: column_values[-1] for column, column_values in tail_values.items()}
+        latest_data['close'] = arrays['close'][-1]
+    values.update(latest_data)
+    return values
+
+async def get_latest_symbol_values(symbol: str, timeframe: str, specs: tuple, ohlcv_limit: int, tail: int = 1) -> dict | None:
+    """
+    Fetches one symbol's buffered candles and returns {'close', <indicator columns>} for the
+    latest candle, computing all of `specs` up front (used where values are shipped elsewhere,
+    e.g. by Celery scan shards). Returns None if no data could be fetched.
+    """
+    arrays = await fetch_symbol_arrays(symbol, timeframe, ohlcv_limit)
+    if arrays is None:
+        return None
+    return compute_symbol_values(symbol, timeframe, arrays, specs, tail)
+
 async def run_single_filter(db_session, filter_obj: DBFilter, bot_client=None, user_telegram_id_override=None) -> tuple[list[str], str | None, str | None]:
     """
     Runs a single filter, evaluates conditions, and returns triggered symbols and a message.
@@ -108,94 +490,35 @@ async def run_single_filter(db_session, filter_obj: DBFilter, bot_client=None, u
     if not symbols_to_scan:
         return [], None, "هیچ نمادی برای اسکن مشخص نشده یا یافت نشد."
 
-    triggered_symbols_details = []
-    
-    # Extract all unique indicator types and periods needed for this filter
-    # Example param: {'indicator': 'RSI', 'period': 14, 'condition': '<', 'value': 30, 'output_key': 'rsi'}
-    # Example param from UI: {'type': 'RSI', 'period': '14', 'condition': '<', 'value': '30'}
-    
-    indicators_needed_for_chart_utils = set()
-    for cond_name, cond_details in filter_obj.params.items():
-        # Assuming params structure is like: "RSI_14_<": 30 or a more structured dict
-        # Let's assume a structured dict from our new UI:
-        # params = { "condition_1": {'type': 'RSI', 'period': 14, 'operator': '<', 'value': 30}, ... }
-        if isinstance(cond_details, dict) and 'type' in cond_details:
-             indicators_needed_for_chart_utils.add(cond_details['type'].upper())
+    plan = get_indicator_plan(filter_obj) # Only the (indicator, period) columns the conditions need
+    ohlcv_limit = max(SCANNER_OHLCV_LIMIT, plan['min_candles'])
 
+    # Symbols are fetched concurrently; the semaphore bounds in-flight requests
+    # and the exchange rate limiter still paces them. gather keeps the symbol order.
+    semaphore = asyncio.Semaphore(SCANNER_SYMBOL_CONCURRENCY)
 
-    for symbol in symbols_to_scan:
-        print(f"  درحال بررسی نماد: {symbol} برای اسکنر {filter_obj.name}...")
-        ohlcv_df, fetch_err = await fetch_historical_data(symbol, timeframe=filter_obj.timeframe, limit=150) # Fetch enough data for indicators
-        if fetch_err:
-            print(f"    خطا در دریافت اطلاعات OHLCV برای {symbol}: {fetch_err}")
-            continue
-        if ohlcv_df is None or ohlcv_df.empty:
-            print(f"    اطلاعات OHLCV برای {symbol} خالی است.")
-            continue
+    async def fetch_with_limit(symbol: str):
+        async with semaphore:
+            print(f"  درحال بررسی نماد: {symbol} برای اسکنر {filter_obj.name}...")
+            return await fetch_symbol_arrays(symbol, filter_obj.timeframe, ohlcv_limit)
 
-        # Calculate indicators based on what's defined in filter_obj.params
-        # The add_indicators function expects a list like ['RSI', 'EMA']
-        df_with_indicators = add_indicators(ohlcv_df, list(indicators_needed_for_chart_utils))
-        if df_with_indicators.empty:
-            print(f"    داده‌ای پس از افزودن اندیکاتورها برای {symbol} باقی نماند.")
-            continue
-        
-        latest_data = df_with_indicators.iloc[-1] # Get the most recent row with indicators
-        
-        all_conditions_met = True
-        symbol_trigger_reasons = []
-
-        for cond_name, condition in filter_obj.params.items():
-            # condition = {'type': 'RSI', 'period': 14, 'operator': '<', 'value': 30}
-            indicator_type = condition.get('type', '').upper()
-            period = int(condition.get('period', 0)) # Ensure period is int
-            operator = condition.get('operator')
-            target_value_str = str(condition.get('value')) # Ensure value is str for evaluate_condition
-
-            current_indicator_value = None
-            indicator_key_in_df = ""
-
-            if indicator_type == 'RSI':
-                indicator_key_in_df = 'rsi' # As defined in add_indicators
-            elif indicator_type == 'EMA': # Assuming we care about a specific EMA, e.g., ema20
-                # For simplicity, let's assume filter params will specify which EMA, e.g. 'EMA_20'
-                # Or our add_indicators always adds 'ema20' if 'EMA' is requested.
-                indicator_key_in_df = f'ema{period}' if period > 0 else 'ema20' # Default to ema20 if period not specified for EMA
-                if indicator_key_in_df not in latest_data.index and 'ema20' in latest_data.index: # Fallback
-                    indicator_key_in_df = 'ema20'
-
-            # Add more indicator key mappings here (MACD, BBANDS etc.) if they are supported by filter params
-            # e.g. if indicator_type == 'MACD': indicator_key_in_df = 'macd' (or 'macdsignal', 'macdhist')
-
-            if indicator_key_in_df and indicator_key_in_df in latest_data:
-                current_indicator_value = latest_data[indicator_key_in_df]
-            else:
-                print(f"    اندیکاتور {indicator_type} (کلید: {indicator_key_in_df}) برای {symbol} محاسبه نشده یا یافت نشد.")
-                all_conditions_met = False
-                break 
-
-            if current_indicator_value is None: # Should be caught by above, but as a safeguard
-                all_conditions_met = False
-                break
-
-            condition_met = evaluate_condition(current_indicator_value, operator, target_value_str)
-            
-            reason = f"{indicator_type}({period if period else ''})={current_indicator_value:.2f} {operator} {target_value_str}"
-            if condition_met:
-                symbol_trigger_reasons.append(f"✅ {reason}")
-            else:
-                symbol_trigger_reasons.append(f"❌ {reason}")
-                all_conditions_met = False
-                break # One condition failed, no need to check others for this symbol
-        
-        if all_conditions_met:
-            print(f"    >>> نماد {symbol} با شرایط اسکنر {filter_obj.name} مطابقت دارد!")
-            triggered_symbols_details.append({
-                "symbol": symbol,
-                "reasons": symbol_trigger_reasons,
-                "latest_close": latest_data['close']
-            })
+    symbol_arrays = dict(zip(symbols_to_scan, await asyncio.gather(*(fetch_with_limit(symbol) for symbol in symbols_to_scan))))
+    symbol_values = {symbol: compute_symbol_values(symbol, filter_obj.timeframe, arrays, (), plan['tail']) if arrays else None
+                     for symbol, arrays in symbol_arrays.items()}
 
+    # Conditions then run cheapest and most selective first, computing indicators only for symbols still matching
+    mask, reason_values = evaluate_plan_staged(plan, filter_obj.timeframe, symbols_to_scan, symbol_values, symbol_arrays, plan['tail'])
+    closes = build_value_matrix([symbol_values[symbol] for symbol in symbols_to_scan], ['close'], plan['tail'])[:, 0, -1]
+    triggered_symbols_details = triggered_details_from_mask(filter_obj, plan, symbols_to_scan, closes, mask, reason_values)
+
+    return await deliver_filter_results(db_session, filter_obj, triggered_symbols_details, bot_client, user_telegram_id_override)
+
+async def deliver_filter_results(db_session, filter_obj: DBFilter, triggered_symbols_details: list, bot_client=None,
+                                 user_telegram_id_override=None) -> tuple[list[str], str | None, str | None]:
+    """
+    Formats the triggered symbols of a filter run, updates last_triggered_at and notifies the user.
+    Returns (triggered_symbols, formatted_message, error_message) like run_single_filter.
+    """
     if not triggered_symbols_details:
         print(f"هیچ نمادی با شرایط اسکنر {filter_obj.name} مطابقت نداشت.")
         return [], None, None # No error, but no symbols triggered
@@ -236,7 +559,6 @@ async def run_single_filter(db_session, filter_obj: DBFilter, bot_client=None, u
         else:
             print(f"کاربر برای ارسال پیام نتایج اسکنر {filter_obj.name} یافت نشد (user_id: {filter_obj.user_id}).")
 
-
     return [item['symbol'] for item in triggered_symbols_details], formatted_message, None
 
 
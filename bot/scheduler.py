@@ -1,22 +1,34 @@
 import os
+import time
+import asyncio
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 # Assuming web.models and scanner_utils are accessible
 try:
     from web.models import Filter as DBFilter, User as DBUser
-    from bot.scanner_utils import run_single_filter 
+    from bot.cache_utils import timeframe_to_seconds, next_candle_close
+    from bot.scan_coordinator import scan_coordinator
     from web.database import SessionLocal, engine as db_engine # For job store and session
 except ImportError:
     import sys
     sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
     from web.models import Filter as DBFilter, User as DBUser
-    from bot.scanner_utils import run_single_filter
+    from bot.cache_utils import timeframe_to_seconds, next_candle_close
+    from bot.scan_coordinator import scan_coordinator
     from web.database import SessionLocal, engine as db_engine
 
 
+# 'poll' runs one scan tick per timeframe at each candle close, scanning all its filters together; 'stream' runs filters on closed candles pushed by bot.stream_utils
+SCANNER_FEED_MODE = os.getenv("SCANNER_FEED_MODE", "poll").lower()
+# 'local' runs poll-mode scan ticks on the bot's event loop; 'celery' hands each tick to the Celery workers
+SCANNER_EXECUTION_MODE = os.getenv("SCANNER_EXECUTION_MODE", "local").lower()
+# Seconds after a candle closes before its poll-mode scan tick runs, so the exchange has finalised the candle
+SCANNER_TICK_SETTLE_SECONDS = float(os.getenv("SCANNER_TICK_SETTLE_SECONDS", "5"))
+# How often the in-memory filter index is re-read from the DB (picks up filters changed outside the bot)
+SCANNER_INDEX_SYNC_SECONDS = float(os.getenv("SCANNER_INDEX_SYNC_SECONDS", "300"))
+
 # APScheduler Configuration
 DATABASE_URL = os.getenv("DB_CONNECTION_STRING_SCHEDULER", os.getenv("DB_CONNECTION_STRING"))
 
@@ -35,112 +47,209 @@ job_defaults = {
 # Initialize scheduler
 scheduler = AsyncIOScheduler(jobstores=jobstores, job_defaults=job_defaults, timezone="UTC")
 
+# Pyrogram client used by the scan ticks to notify users
+_bot_client_ref = None
+
+
+async def run_scan_tick(timeframe: str, filter_ids: list = None):
+    """Runs the given active filters of `timeframe` (default: all of them) as one batch (see bot.scan_coordinator)."""
+    if SCANNER_EXECUTION_MODE == 'celery':
+        from bot.tasks import scan_tick_task # Imported lazily; only needed when scans run on the workers
+        # Publishing to the broker is blocking I/O; keep it off the bot's event loop
+        await asyncio.to_thread(scan_tick_task.delay, timeframe, filter_ids)
+        print(f"تیک اسکن تایم‌فریم {timeframe} به Celery ارسال شد.")
+        return
 
-def get_cron_trigger_from_timeframe(timeframe: str) -> CronTrigger:
+    db_session = SessionLocal()
+    try:
+        await scan_coordinator.run_tick(db_session, timeframe, _bot_client_ref, filter_ids=filter_ids)
+    finally:
+        db_session.close()
+
+# --- Scan Tick Dispatcher ---
+class ScanTickDispatcher:
     """
-    Converts a timeframe string (e.g., '1m', '5m', '15m', '1h', '4h', '1d') to APScheduler CronTrigger.
-    More granular control can be added here.
+    Drives poll-mode scanning with one tick loop per timeframe, waking `settle_seconds` after each
+    candle of that timeframe closes (candles are epoch-aligned, like the exchange's).
+    The filters due on a tick come from an in-memory {timeframe: filter ids} index, kept current by
+    schedule_filter_job / remove_filter_job and re-read from the DB every `sync_seconds`, and are
+    handed to the scan engine as one batch. Nothing is stored per filter in the job store, so the
+    scheduling cost per tick does not grow with the number of filters.
+    A tick that is still running when the next candle closes makes that timeframe skip one tick.
     """
-    value = int(timeframe[:-1])
-    unit = timeframe[-1].lower()
-
-    if unit == 'm': # minute
-        if value < 1 or value > 59 : raise ValueError("دقیقه باید بین 1 تا 59 باشد")
-        return CronTrigger(minute=f"*/{value}")
-    elif unit == 'h': # hour
-        if value < 1 or value > 23 : raise ValueError("ساعت باید بین 1 تا 23 باشد")
-        return CronTrigger(hour=f"*/{value}", minute='1') # Run at minute 1 of the hour
-    elif unit == 'd': # day
-        if value < 1 or value > 30 : raise ValueError("روز باید بین 1 تا 30 باشد") # Approx
-        return CronTrigger(day=f"*/{value}", hour='0', minute='5') # Run at 00:05 UTC
-    else:
-        raise ValueError(f"تایم فریم نامعتبر: {timeframe}. از m, h, d استفاده کنید.")
+
+    def __init__(self, settle_seconds: float = SCANNER_TICK_SETTLE_SECONDS, sync_seconds: float = SCANNER_INDEX_SYNC_SECONDS):
+        self.settle_seconds = settle_seconds
+        self.sync_seconds = sync_seconds
+        self.running = False
+        self._index = {} # timeframe -> {filter_id: None}, an ordered set
+        self._tick_loops = {} # timeframe -> asyncio.Task waiting for candle closes
+        self._ticks_in_progress = {} # timeframe -> asyncio.Task of the running tick
+        self._sync_task = None
+        self.stats = {'ticks': 0, 'skipped_ticks': 0}
+
+    def add_filter(self, filter_id: int, timeframe: str):
+        """Indexes an active filter under its timeframe (moving it if the timeframe changed). Raises ValueError for invalid timeframes."""
+        timeframe_to_seconds(timeframe)
+        self.remove_filter(filter_id)
+        self._index.setdefault(timeframe, {})[filter_id] = None
+        self._ensure_tick_loop(timeframe)
+
+    def remove_filter(self, filter_id: int):
+        for timeframe in list(self._index):
+            self._index[timeframe].pop(filter_id, None)
+            if not self._index[timeframe]:
+                del self._index[timeframe]
+                tick_loop = self._tick_loops.pop(timeframe, None)
+                if tick_loop:
+                    tick_loop.cancel()
+
+    def filters_due(self, timeframe: str) -> list[int]:
+        return list(self._index.get(timeframe, {}))
+
+    def timeframes(self) -> list[str]:
+        return list(self._index)
+
+    def load(self, filters: list):
+        """Replaces the index with (filter_id, timeframe) pairs of the active filters; running tick loops are kept."""
+        index = {}
+        for filter_id, timeframe in filters:
+            try:
+                timeframe_to_seconds(timeframe)
+            except ValueError as e:
+                print(f"خطا در زمان‌بندی اسکنر {filter_id}: {e}")
+                continue
+            index.setdefault(timeframe, {})[filter_id] = None
+        for timeframe in set(self._tick_loops) - set(index):
+            self._tick_loops.pop(timeframe).cancel()
+        self._index = index
+        for timeframe in index:
+            self._ensure_tick_loop(timeframe)
+
+    def sync_from_db(self):
+        db = SessionLocal()
+        try:
+            self.load(db.query(DBFilter.id, DBFilter.timeframe).filter(DBFilter.active == True).all())
+        except Exception as e:
+            print(f"خطا در بارگذاری فهرست اسکنرهای فعال: {e}")
+        finally:
+            db.close()
+
+    def _ensure_tick_loop(self, timeframe: str):
+        tick_loop = self._tick_loops.get(timeframe)
+        if self.running and (tick_loop is None or tick_loop.done()):
+            self._tick_loops[timeframe] = asyncio.create_task(self._tick_loop(timeframe))
+
+    async def _tick_loop(self, timeframe: str):
+        while True:
+            # Next candle close that is still ahead once the settle delay is added
+            tick_at = next_candle_close(timeframe, time.time() - self.settle_seconds) + self.settle_seconds
+            await asyncio.sleep(max(0.0, tick_at - time.time()))
+            self._dispatch(timeframe)
+
+    def _dispatch(self, timeframe: str):
+        filter_ids = self.filters_due(timeframe)
+        if not filter_ids:
+            return
+        tick_in_progress = self._ticks_in_progress.get(timeframe)
+        if tick_in_progress and not tick_in_progress.done():
+            self.stats['skipped_ticks'] += 1
+            print(f"تیک قبلی اسکن تایم‌فریم {timeframe} هنوز در حال اجراست؛ این تیک رد شد.")
+            return
+        self.stats['ticks'] += 1
+        self._ticks_in_progress[timeframe] = asyncio.create_task(self._run_tick(timeframe, filter_ids))
+
+    async def _run_tick(self, timeframe: str, filter_ids: list):
+        try:
+            await run_scan_tick(timeframe, filter_ids)
+        except Exception as e:
+            print(f"خطا در اجرای تیک اسکن تایم‌فریم {timeframe}: {e}")
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_seconds)
+            self.sync_from_db()
+
+    def start(self):
+        """Starts the tick loops of the indexed timeframes on the running event loop."""
+        if self.running:
+            return
+        self.running = True
+        for timeframe in list(self._index):
+            self._ensure_tick_loop(timeframe)
+        self._sync_task = asyncio.create_task(self._sync_loop())
+
+    def stop(self):
+        self.running = False
+        tasks = list(self._tick_loops.values()) + list(self._ticks_in_progress.values())
+        if self._sync_task:
+            tasks.append(self._sync_task)
+        for task in tasks:
+            task.cancel()
+        self._tick_loops.clear()
+        self._ticks_in_progress.clear()
+        self._sync_task = None
+
+
+scan_dispatcher = ScanTickDispatcher()
 
 async def schedule_filter_job(filter_obj: DBFilter, bot_client_ref):
     """
-    Schedules a filter job to run periodically.
+    Adds a filter to scheduled scanning: it runs with the other filters of its timeframe on the
+    scan dispatcher's next candle-close tick.
     bot_client_ref is a reference to the initialized Pyrogram Client for sending messages.
     """
-    if not scheduler.running:
-        print("هشدار: زمان‌بند در حال اجرا نیست. کارها زمان‌بندی نخواهند شد.")
-        # return # Or start it: scheduler.start() - but usually started once in main.py
+    global _bot_client_ref
+    _bot_client_ref = bot_client_ref
 
-    job_id = f"filter_{filter_obj.id}"
-    
-    # Check if job already exists
-    if scheduler.get_job(job_id):
-        print(f"جاب با شناسه {job_id} از قبل وجود دارد. ابتدا حذف و دوباره اضافه می‌شود.")
-        remove_filter_job(filter_obj.id) # Remove existing to update trigger/params
+    if SCANNER_FEED_MODE == 'stream':
+        # The stream scanner picks up active filters on its next subscription sync
+        print(f"اسکنر '{filter_obj.name}' در حالت استریم با بسته شدن کندل‌های {filter_obj.timeframe} اجرا خواهد شد.")
+        return
 
-    try:
-        trigger = get_cron_trigger_from_timeframe(filter_obj.timeframe)
-        
-        # Create a new DB session for the job execution
-        # This is important as the job runs in a different context/thread
-        def job_function_wrapper():
-            db_session = SessionLocal()
-            try:
-                # Note: run_single_filter is async, but APScheduler by default runs sync functions in threadpool
-                # For full async, ensure the executor supports it or wrap appropriately.
-                # For now, we assume run_single_filter can be called this way,
-                # and its internal async calls are handled by ccxt.async_support.
-                # A better approach for fully async jobs might involve asyncio.run_coroutine_threadsafe
-                # or ensuring the scheduler's event loop is the same as Pyrogram's.
-                # However, for simplicity, we'll proceed, as APScheduler's AsyncIOScheduler
-                # should handle this reasonably well by running the sync wrapper in its event loop.
-                
-                # We need to run the async function run_single_filter
-                # APScheduler with AsyncIOScheduler can directly schedule coroutines.
-                # So, the wrapper might not be needed if we pass the coroutine directly.
-                # Let's try scheduling the coroutine.
-                pass # Placeholder, actual scheduling below
-
-            finally:
-                db_session.close()
-
-        # Schedule the async function directly
-        scheduler.add_job(
-            run_single_filter,
-            trigger=trigger,
-            args=[SessionLocal(), filter_obj, bot_client_ref, None], # Pass a new session, filter, bot_client, no override_id
-            id=job_id,
-            name=f"Scan: {filter_obj.name}",
-            replace_existing=True, # Replace if job with same ID exists
-            misfire_grace_time=60*5 # 5 minutes grace time for misfires
-        )
-        print(f"اسکنر '{filter_obj.name}' (ID: {job_id}) برای اجرای دوره‌ای با تایم‌فریم {filter_obj.timeframe} زمان‌بندی شد.")
-        print(f"جاب بعدی در: {scheduler.get_job(job_id).next_run_time}")
+    if not scan_dispatcher.running:
+        print("هشدار: توزیع‌کننده تیک‌های اسکن در حال اجرا نیست. اسکنر پس از شروع آن اجرا خواهد شد.")
 
+    try:
+        scan_dispatcher.add_filter(filter_obj.id, filter_obj.timeframe)
+        tick_at = datetime.fromtimestamp(next_candle_close(filter_obj.timeframe) + scan_dispatcher.settle_seconds, timezone.utc)
+        print(f"اسکنر '{filter_obj.name}' همراه با سایر اسکنرهای تایم‌فریم {filter_obj.timeframe} "
+              f"در تیک بعدی ({tick_at:%Y-%m-%d %H:%M:%S} UTC) اجرا خواهد شد.")
     except ValueError as e:
         print(f"خطا در زمان‌بندی اسکنر {filter_obj.name}: {e}")
-    except Exception as e:
-        print(f"خطای ناشناخته در زمان‌بندی اسکنر {filter_obj.name}: {e}")
 
 
 def remove_filter_job(filter_id: int):
-    """Removes a filter job from the scheduler."""
+    """Removes a filter from scheduled scanning, including a per-filter job left over from older versions."""
+    scan_dispatcher.remove_filter(filter_id)
     job_id = f"filter_{filter_id}"
     if scheduler.get_job(job_id):
         scheduler.remove_job(job_id)
         print(f"جاب اسکنر با شناسه {job_id} از زمان‌بند حذف شد.")
-    else:
-        print(f"جاب اسکنر با شناسه {job_id} در زمان‌بند یافت نشد.")
 
 async def load_active_filters_on_startup(bot_client_ref):
     """
-    Loads all active filters from the database and schedules them on bot startup.
-    bot_client_ref is passed to schedule_filter_job.
+    Indexes all active filters from the database and starts the scan dispatcher on bot startup.
+    In stream mode the streaming scanner is started instead.
     """
-    db = SessionLocal()
-    try:
-        active_filters = db.query(DBFilter).filter(DBFilter.active == True).all()
-        print(f"درحال بارگذاری و زمان‌بندی {len(active_filters)} اسکنر فعال...")
-        for filter_obj in active_filters:
-            await schedule_filter_job(filter_obj, bot_client_ref)
-    except Exception as e:
-        print(f"خطا در بارگذاری اسکنرهای فعال هنگام شروع: {e}")
-    finally:
-        db.close()
+    global _bot_client_ref
+    _bot_client_ref = bot_client_ref
+
+    if SCANNER_FEED_MODE == 'stream':
+        from bot.stream_utils import start_stream_scanner # Imported lazily; only needed in stream mode
+        start_stream_scanner(bot_client_ref)
+        return
+
+    # Per-filter and per-timeframe jobs of older versions would scan their filters a second time
+    for job in scheduler.get_jobs():
+        if job.id.startswith('filter_') or job.id.startswith('scan_tick_'):
+            scheduler.remove_job(job.id)
+
+    scan_dispatcher.sync_from_db()
+    timeframes = scan_dispatcher.timeframes()
+    print(f"{sum(len(scan_dispatcher.filters_due(timeframe)) for timeframe in timeframes)} اسکنر فعال "
+          f"در {len(timeframes)} تایم‌فریم بارگذاری شد.")
+    scan_dispatcher.start()
 
 def start_scheduler():
     if not scheduler.running:
@@ -150,6 +259,7 @@ def start_scheduler():
         print("زمان‌بند APScheduler از قبل در حال اجرا است.")
 
 def shutdown_scheduler():
+    scan_dispatcher.stop()
     if scheduler.running:
         scheduler.shutdown()
         print("زمان‌بند APScheduler متوقف شد.")
@@ -0,0 +1,386 @@
+import os
+import csv
+import json
+import asyncio
+from abc import ABC, abstractmethod
+from dotenv import load_dotenv
+
+try:
+    from web.models import Filter as DBFilter
+    from web.database import SessionLocal
+    from bot.candle_utils import get_candle_buffer
+    from bot.cache_utils import current_candle_open
+    from bot.chart_utils import fetch_buffered_arrays
+    from bot.indicator_engine import indicator_engine
+    from bot.rate_limiter import PRIORITY_BACKGROUND
+    from bot.scanner_utils import get_symbols_to_scan, SCANNER_OHLCV_LIMIT
+    from bot.scan_coordinator import scan_coordinator
+except ImportError:
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from web.models import Filter as DBFilter
+    from web.database import SessionLocal
+    from bot.candle_utils import get_candle_buffer
+    from bot.cache_utils import current_candle_open
+    from bot.chart_utils import fetch_buffered_arrays
+    from bot.indicator_engine import indicator_engine
+    from bot.rate_limiter import PRIORITY_BACKGROUND
+    from bot.scanner_utils import get_symbols_to_scan, SCANNER_OHLCV_LIMIT
+    from bot.scan_coordinator import scan_coordinator
+
+# Load environment variables from .env in the project root
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+DEFAULT_EXCHANGE_NAME = os.getenv("DEFAULT_EXCHANGE_NAME", "binance").lower()
+# Seconds to wait for the remaining symbols of a timeframe after the first closed candle arrives
+SCANNER_STREAM_SETTLE_SECONDS = float(os.getenv("SCANNER_STREAM_SETTLE_SECONDS", "5"))
+# How often the stream scanner re-reads active filters to add/remove subscriptions
+SCANNER_STREAM_SYNC_SECONDS = float(os.getenv("SCANNER_STREAM_SYNC_SECONDS", "60"))
+
+# Events pushed by every feed:
+# {'type': 'candle_closed', 'exchange': ..., 'symbol': ..., 'timeframe': ..., 'candle': [ts, o, h, l, c, v]}
+# {'type': 'end_of_stream'} (replay only)
+
+# --- Feeds ---
+class CandleFeed(ABC):
+    """
+    Base class for market-data feeds. Feeds push closed candles to `queue` as event dicts
+    and keep the latest ticker per symbol in `tickers`.
+    Live feeds only deliver new candles, so the scanner seeds their buffers with history first.
+    """
+
+    seeds_history = True
+
+    def __init__(self, exchange_name: str = DEFAULT_EXCHANGE_NAME):
+        self.exchange_name = exchange_name
+        self.queue = asyncio.Queue()
+        self.tickers = {}
+        self.subscriptions = set() # {(symbol, timeframe), ...}
+
+    async def subscribe(self, symbol: str, timeframe: str):
+        self.subscriptions.add((symbol, timeframe))
+
+    async def unsubscribe(self, symbol: str, timeframe: str):
+        self.subscriptions.discard((symbol, timeframe))
+
+    def _push_closed_candle(self, symbol: str, timeframe: str, candle: list):
+        self.queue.put_nowait({
+            'type': 'candle_closed',
+            'exchange': self.exchange_name,
+            'symbol': symbol,
+            'timeframe': timeframe,
+            'candle': list(candle[:6]),
+        })
+
+    @abstractmethod
+    async def start(self):
+        """Starts delivering closed candles of the current subscriptions."""
+
+    @abstractmethod
+    async def stop(self):
+        """Stops delivery and releases the feed's connections and tasks."""
+
+
+class ExchangeStreamFeed(CandleFeed):
+    """
+    Live feed over CCXT Pro websockets. Keeps one watch_ohlcv loop per (symbol, timeframe)
+    and one watch_tickers loop for all subscribed symbols.
+    A candle is reported as closed once a candle with a newer timestamp shows up.
+    """
+
+    def __init__(self, exchange_name: str = DEFAULT_EXCHANGE_NAME):
+        super().__init__(exchange_name)
+        self._exchange = None
+        self._candle_tasks = {}
+        self._ticker_task = None
+
+    async def start(self):
+        import ccxt.pro as ccxtpro
+        self._exchange = getattr(ccxtpro, self.exchange_name)({'enableRateLimit': True})
+        for symbol, timeframe in list(self.subscriptions):
+            self._start_candle_task(symbol, timeframe)
+        self._restart_ticker_task()
+
+    def _start_candle_task(self, symbol: str, timeframe: str):
+        key = (symbol, timeframe)
+        if self._exchange and key not in self._candle_tasks:
+            self._candle_tasks[key] = asyncio.create_task(self._watch_candles(symbol, timeframe))
+
+    def _restart_ticker_task(self):
+        if self._ticker_task:
+            self._ticker_task.cancel()
+            self._ticker_task = None
+        if self._exchange and self.subscriptions and self._exchange.has.get('watchTickers'):
+            symbols = sorted({symbol for symbol, _ in self.subscriptions})
+            self._ticker_task = asyncio.create_task(self._watch_tickers(symbols))
+
+    async def subscribe(self, symbol: str, timeframe: str):
+        if (symbol, timeframe) in self.subscriptions:
+            return
+        await super().subscribe(symbol, timeframe)
+        self._start_candle_task(symbol, timeframe)
+        self._restart_ticker_task()
+
+    async def unsubscribe(self, symbol: str, timeframe: str):
+        await super().unsubscribe(symbol, timeframe)
+        task = self._candle_tasks.pop((symbol, timeframe), None)
+        if task:
+            task.cancel()
+        self._restart_ticker_task()
+
+    async def _watch_candles(self, symbol: str, timeframe: str):
+        last_timestamp = None
+        while True:
+            try:
+                candles = await self._exchange.watch_ohlcv(symbol, timeframe)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"خطا در دریافت استریم کندل {symbol} ({timeframe}): {e}")
+                await asyncio.sleep(5)
+                continue
+            if not candles:
+                continue
+            newest_timestamp = candles[-1][0]
+            if last_timestamp is not None and newest_timestamp > last_timestamp:
+                for candle in candles:
+                    if last_timestamp <= candle[0] < newest_timestamp:
+                        self._push_closed_candle(symbol, timeframe, candle)
+            last_timestamp = newest_timestamp
+
+    async def _watch_tickers(self, symbols: list):
+        while True:
+            try:
+                tickers = await self._exchange.watch_tickers(symbols)
+                self.tickers.update(tickers)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"خطا در دریافت استریم تیکرها: {e}")
+                await asyncio.sleep(5)
+
+    async def stop(self):
+        tasks = list(self._candle_tasks.values())
+        if self._ticker_task:
+            tasks.append(self._ticker_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._candle_tasks.clear()
+        self._ticker_task = None
+        if self._exchange:
+            await self._exchange.close()
+            self._exchange = None
+
+
+class ReplayFeed(CandleFeed):
+    """
+    Offline stand-in for ExchangeStreamFeed. Replays closed candles from a file through the
+    same event interface so the streaming pipeline can be tested and benchmarked without a network.
+    Supported files: CSV with a header, or JSON lines, both with the fields
+    symbol, timeframe, timestamp, open, high, low, close, volume.
+    speed=0 replays as fast as possible; speed=60 replays one minute of data per second.
+    The file carries its own history, so buffers are not seeded from the exchange.
+    """
+
+    seeds_history = False
+
+    def __init__(self, path: str, exchange_name: str = DEFAULT_EXCHANGE_NAME, speed: float = 0):
+        super().__init__(exchange_name)
+        self.path = path
+        self.speed = speed
+        self._task = None
+
+    def _read_rows(self) -> list:
+        with open(self.path, newline='', encoding='utf-8') as f:
+            if self.path.endswith('.jsonl'):
+                rows = [json.loads(line) for line in f if line.strip()]
+            else:
+                rows = list(csv.DictReader(f))
+        parsed_rows = []
+        for row in rows:
+            candle = [int(row['timestamp'])] + [float(row[col]) for col in ('open', 'high', 'low', 'close', 'volume')]
+            parsed_rows.append((row['symbol'], row['timeframe'], candle))
+        parsed_rows.sort(key=lambda item: item[2][0])
+        return parsed_rows
+
+    async def _replay(self):
+        previous_timestamp = None
+        for symbol, timeframe, candle in self._read_rows():
+            if self.subscriptions and (symbol, timeframe) not in self.subscriptions:
+                continue
+            if self.speed and previous_timestamp is not None and candle[0] > previous_timestamp:
+                await asyncio.sleep((candle[0] - previous_timestamp) / 1000 / self.speed)
+            previous_timestamp = candle[0]
+            self.tickers[symbol] = {'symbol': symbol, 'timestamp': candle[0], 'last': candle[4]}
+            self._push_closed_candle(symbol, timeframe, candle)
+            await asyncio.sleep(0) # Let the consumer keep up
+        self.queue.put_nowait({'type': 'end_of_stream'})
+
+    async def start(self):
+        self._task = asyncio.create_task(self._replay())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+
+# --- Event-Driven Scanner ---
+class StreamScanner:
+    """
+    Consumes closed-candle events from a feed, appends them to the shared candle buffers
+    and runs the active filters of a timeframe once every subscribed symbol has reported
+    the candle (or after SCANNER_STREAM_SETTLE_SECONDS). Filters then read the buffers
+    through fetch_buffered_arrays without polling the exchange.
+    """
+
+    def __init__(self, feed: CandleFeed, bot_client=None, settle_seconds: float = SCANNER_STREAM_SETTLE_SECONDS,
+                 sync_seconds: float = SCANNER_STREAM_SYNC_SECONDS):
+        self.feed = feed
+        self.bot_client = bot_client
+        self.settle_seconds = settle_seconds
+        self.sync_seconds = sync_seconds
+        self._pending = {} # timeframe -> {candle_timestamp: set(symbols)}
+        self.stats = {'candles': 0, 'scan_batches': 0, 'filter_runs': 0}
+
+    async def sync_subscriptions(self):
+        """Subscribes to every (symbol, timeframe) needed by the active filters and drops the rest."""
+        db = SessionLocal()
+        try:
+            needed = set()
+            for filter_obj in db.query(DBFilter).filter(DBFilter.active == True).all():
+                symbols, error_msg = await get_symbols_to_scan(filter_obj, self.feed.exchange_name)
+                if error_msg:
+                    print(f"خطا در تعیین نمادهای اسکنر {filter_obj.id} برای استریم: {error_msg}")
+                    continue
+                needed.update((symbol, filter_obj.timeframe) for symbol in symbols)
+        finally:
+            db.close()
+
+        new_subscriptions = needed - self.feed.subscriptions
+        if self.feed.seeds_history:
+            await asyncio.gather(*(self._seed(symbol, timeframe) for symbol, timeframe in new_subscriptions))
+        for symbol, timeframe in new_subscriptions:
+            await self.feed.subscribe(symbol, timeframe)
+        for symbol, timeframe in self.feed.subscriptions - needed:
+            await self.feed.unsubscribe(symbol, timeframe)
+            indicator_engine.drop(self.feed.exchange_name, symbol, timeframe)
+        print(f"استریم بازار: {len(self.feed.subscriptions)} اشتراک فعال.")
+
+    async def _seed(self, symbol: str, timeframe: str):
+        """
+        Fills the buffer of a new subscription with SCANNER_OHLCV_LIMIT candles (from the local
+        history store where possible) and warms its indicators up on the closed ones.
+        """
+        exchange_name = self.feed.exchange_name
+        arrays, error_msg = await fetch_buffered_arrays(symbol, timeframe, SCANNER_OHLCV_LIMIT, exchange_name,
+                                                        PRIORITY_BACKGROUND, exchange_names=[exchange_name])
+        if arrays is None:
+            print(f"خطا در دریافت تاریخچه {symbol} ({timeframe}) برای استریم: {error_msg}")
+            return
+        if indicator_engine.is_tracked(exchange_name, symbol, timeframe):
+            return
+        # The newest buffered candle may still be forming; only closed candles go to the engine
+        current_candle_timestamp = current_candle_open(timeframe) * 1000
+        buffer = get_candle_buffer(exchange_name, symbol, timeframe, SCANNER_OHLCV_LIMIT)
+        indicator_engine.warm_up(exchange_name, symbol, timeframe,
+                                 [row for row in buffer.rows() if row[0] < current_candle_timestamp])
+
+    def _expected_symbols(self, timeframe: str) -> set:
+        return {symbol for symbol, subscribed_timeframe in self.feed.subscriptions if subscribed_timeframe == timeframe}
+
+    async def _run_filters(self, timeframe: str):
+        db = SessionLocal()
+        try:
+            # All filters of the timeframe share one read of the buffers and indicators
+            results = await scan_coordinator.run_tick(db, timeframe, self.bot_client)
+            self.stats['filter_runs'] += len(results)
+        finally:
+            db.close()
+        self.stats['scan_batches'] += 1
+
+    def _buffers_filled(self, timeframe: str) -> bool:
+        return all(get_candle_buffer(self.feed.exchange_name, symbol, timeframe, SCANNER_OHLCV_LIMIT).size >= SCANNER_OHLCV_LIMIT
+                   for symbol in self._expected_symbols(timeframe))
+
+    async def _flush(self, timeframe: str, candle_timestamp: int):
+        self._pending.get(timeframe, {}).pop(candle_timestamp, None)
+        if not self.feed.seeds_history and not self._buffers_filled(timeframe):
+            return # Replayed history is still filling the buffers; reading them now would seed from the exchange
+        await self._run_filters(timeframe)
+
+    async def _flush_all(self):
+        for timeframe, by_timestamp in list(self._pending.items()):
+            for candle_timestamp in sorted(by_timestamp):
+                await self._flush(timeframe, candle_timestamp)
+
+    async def _handle_candle(self, event: dict):
+        exchange_name, symbol, timeframe, candle = event['exchange'], event['symbol'], event['timeframe'], event['candle']
+        buffer = get_candle_buffer(exchange_name, symbol, timeframe, SCANNER_OHLCV_LIMIT)
+        buffer.extend([candle])
+        # O(1) indicator update; a new series is warmed up once from its buffer
+        if indicator_engine.is_tracked(exchange_name, symbol, timeframe):
+            indicator_engine.update(exchange_name, symbol, timeframe, candle)
+        else:
+            indicator_engine.warm_up(exchange_name, symbol, timeframe, [row for row in buffer.rows() if row[0] <= candle[0]])
+        self.stats['candles'] += 1
+
+        by_timestamp = self._pending.setdefault(timeframe, {})
+        # A newer candle means the older batches will not complete any more
+        for older_timestamp in sorted(ts for ts in by_timestamp if ts < candle[0]):
+            await self._flush(timeframe, older_timestamp)
+        reported = by_timestamp.setdefault(candle[0], set())
+        reported.add(symbol)
+        if reported >= self._expected_symbols(timeframe):
+            await self._flush(timeframe, candle[0])
+
+    async def run(self, sync: bool = True):
+        """
+        Runs until the feed reports end_of_stream (replay) or the task is cancelled (live).
+        """
+        if sync:
+            await self.sync_subscriptions()
+        await self.feed.start()
+        loop = asyncio.get_running_loop()
+        next_sync_at = loop.time() + self.sync_seconds
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(self.feed.queue.get(), timeout=self.settle_seconds)
+                except asyncio.TimeoutError:
+                    await self._flush_all() # Settle delay passed; scan with whatever arrived
+                    event = None
+
+                if event and event['type'] == 'candle_closed':
+                    await self._handle_candle(event)
+                elif event and event['type'] == 'end_of_stream':
+                    await self._flush_all()
+                    break
+
+                if sync and loop.time() >= next_sync_at:
+                    await self.sync_subscriptions()
+                    next_sync_at = loop.time() + self.sync_seconds
+        finally:
+            await self.feed.stop()
+        return self.stats
+
+
+_stream_scanner_task = None
+
+def start_stream_scanner(bot_client, exchange_name: str = DEFAULT_EXCHANGE_NAME):
+    """Starts the live streaming scanner in the background of the running event loop."""
+    global _stream_scanner_task
+    if _stream_scanner_task is None or _stream_scanner_task.done():
+        scanner = StreamScanner(ExchangeStreamFeed(exchange_name), bot_client)
+        _stream_scanner_task = asyncio.create_task(scanner.run())
+        print("اسکنر استریم بازار شروع به کار کرد.")
+
+async def stop_stream_scanner():
+    global _stream_scanner_task
+    if _stream_scanner_task and not _stream_scanner_task.done():
+        _stream_scanner_task.cancel()
+        await asyncio.gather(_stream_scanner_task, return_exceptions=True)
+        print("اسکنر استریم بازار متوقف شد.")
+    _stream_scanner_task = None
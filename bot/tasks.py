@@ -1,6 +1,12 @@
 import os
+import re
+import html
+import asyncio
+import aiohttp
 import feedparser
-from celery import Celery
+import numpy as np
+from celery import Celery, chord
+from celery.signals import worker_process_init
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime, timezone # Ensure timezone is imported
@@ -10,17 +16,21 @@ from dotenv import load_dotenv
 # or the PYTHONPATH is set up accordingly for Celery to find them.
 # Adjust these imports if your project structure is different.
 try:
-    from web.models import News, Base as WebBase
+    from web.models import News, Filter as DBFilter, Base as WebBase
     from web.schemas import NewsCreate
 except ImportError:
     # This is a fallback for local execution if PYTHONPATH isn't set
     # You might need to adjust this based on your exact execution environment for Celery
     import sys
     sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-    from web.models import News, Base as WebBase
+    from web.models import News, Filter as DBFilter, Base as WebBase
     from web.schemas import NewsCreate
 
 from bot.news_utils import add_news_item_if_not_exists, get_news_sources_from_env
+from bot.scanner_utils import get_indicator_plan
+from bot.scan_coordinator import scan_coordinator
+from bot.backtest_utils import run_filter_backtest
+from bot.alert_utils import alert_state_store
 
 # Load environment variables from .env file
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env')) # Ensure .env is loaded from project root
@@ -28,6 +38,9 @@ load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env')) # Ensure .env
 # Celery Configuration
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/0")
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Distinct symbols per scan_shard_task when scan ticks run on the workers (SCANNER_EXECUTION_MODE=celery)
+SCANNER_CELERY_SHARD_SIZE = int(os.getenv("SCANNER_CELERY_SHARD_SIZE", "25"))
 
 celery_app = Celery(
     "tasks",
@@ -49,6 +62,11 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 WebBase.metadata.create_all(bind=engine)
 
 
+@worker_process_init.connect
+def warn_about_process_local_state(**kwargs):
+    # Scan shards run in different worker processes; edge-triggered alerts need the shared Redis state
+    alert_state_store.warn_if_process_local("کارگر Celery")
+
 @celery_app.task(name='bot.tasks.fetch_news_task')
 def fetch_news_task():
     db = SessionLocal()
@@ -103,6 +121,118 @@ def fetch_news_task():
     print(summary_message)
     return summary_message
 
+# --- Scanner Tasks ---
+# With SCANNER_EXECUTION_MODE=celery the bot's scheduler only enqueues scan_tick_task. The tick resolves
+# the due filters, fans their distinct symbols out as scan_shard_task shards (fetch + indicators), and
+# finish_scan_tick_task evaluates every filter on the merged shard results and notifies the users.
+# Exchange requests stay within the shared Redis rate-limit budget however many workers run.
+
+_worker_loop = None
+
+def _run_async(coroutine):
+    """
+    Runs a coroutine on this worker process's persistent event loop, so the shared exchange
+    clients and candle buffers stay bound to one loop across tasks.
+    """
+    global _worker_loop
+    if _worker_loop is None or _worker_loop.is_closed():
+        _worker_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_worker_loop)
+    return _worker_loop.run_until_complete(coroutine)
+
+
+class TelegramBotAPINotifier:
+    """
+    Sends scan results from a worker through the Telegram Bot HTTP API, since the Pyrogram client
+    lives in the bot process. Provides the send_message(chat_id, text) coroutine that
+    scanner_utils.deliver_filter_results expects.
+    """
+
+    def __init__(self, bot_token: str = TELEGRAM_BOT_TOKEN):
+        self.bot_token = bot_token
+
+    async def send_message(self, chat_id, text: str):
+        if not self.bot_token:
+            raise RuntimeError("TELEGRAM_BOT_TOKEN برای ارسال پیام از Celery تنظیم نشده است.")
+        # Messages use Pyrogram's **bold** markdown; send them as HTML so '<' and '_' stay literal
+        html_text = re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', html.escape(text, quote=False))
+        url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            async with session.post(url, json={'chat_id': chat_id, 'text': html_text, 'parse_mode': 'HTML'}) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"Telegram API {response.status}: {await response.text()}")
+
+
+@celery_app.task(name='bot.tasks.scan_tick_task')
+def scan_tick_task(timeframe: str, filter_ids: list = None):
+    db = SessionLocal()
+    try:
+        tick = _run_async(scan_coordinator.prepare_tick(db, timeframe, filter_ids))
+    finally:
+        db.close()
+    if tick is None:
+        return f"No active scanners for {timeframe}."
+
+    # Specs travel as JSON lists; shards are slices of the distinct symbols of all due filters
+    symbol_specs = [(symbol, [[indicator, list(params)] for indicator, params in specs])
+                    for symbol, specs in tick['symbol_specs'].items()]
+    shards = [dict(symbol_specs[start:start + SCANNER_CELERY_SHARD_SIZE])
+              for start in range(0, len(symbol_specs), SCANNER_CELERY_SHARD_SIZE)]
+    filter_symbols = {str(filter_obj.id): symbols for filter_obj, _, symbols in tick['runs']}
+    if not shards:
+        return f"No symbols to scan for {timeframe}."
+
+    chord(scan_shard_task.s(timeframe, shard, tick['ohlcv_limit'], tick['tail']) for shard in shards)(
+        finish_scan_tick_task.s(timeframe, filter_symbols, tick['tail'])
+    )
+    summary_message = f"Dispatched {len(shards)} scan shards for {len(filter_symbols)} scanners ({timeframe})."
+    print(summary_message)
+    return summary_message
+
+@celery_app.task(name='bot.tasks.scan_shard_task')
+def scan_shard_task(timeframe: str, symbol_specs: dict, ohlcv_limit: int, tail: int) -> dict:
+    """Fetches and computes one shard of symbols; returns {symbol: {column: [last bars]} or None}."""
+    symbol_specs = {symbol: {(indicator, tuple(params)): None for indicator, params in specs}
+                    for symbol, specs in symbol_specs.items()}
+    latest_values = _run_async(scan_coordinator.load_latest_values(timeframe, symbol_specs, ohlcv_limit, tail))
+    return {
+        symbol: {column: np.atleast_1d(value).astype(float).tolist() for column, value in values.items()} if values else None
+        for symbol, values in latest_values.items()
+    }
+
+@celery_app.task(name='bot.tasks.finish_scan_tick_task')
+def finish_scan_tick_task(shard_results: list, timeframe: str, filter_symbols: dict, tail: int) -> dict:
+    """Merges the shard results, evaluates each filter of the tick on them and sends the notifications."""
+    latest_values = {}
+    for shard_result in shard_results:
+        latest_values.update(shard_result)
+
+    db = SessionLocal()
+    try:
+        filters_to_run = db.query(DBFilter).filter(DBFilter.id.in_([int(filter_id) for filter_id in filter_symbols]),
+                                                   DBFilter.active == True).all()
+        runs = [(filter_obj, get_indicator_plan(filter_obj), filter_symbols[str(filter_obj.id)]) for filter_obj in filters_to_run]
+        results = _run_async(scan_coordinator.evaluate_and_deliver(db, runs, latest_values, tail, TelegramBotAPINotifier()))
+    finally:
+        db.close()
+    print(f"Scan tick {timeframe} finished: {sum(1 for symbols in results.values() if symbols)} scanners triggered.")
+    return {str(filter_id): symbols for filter_id, symbols in results.items()}
+
+@celery_app.task(name='bot.tasks.backtest_filter_task')
+def backtest_filter_task(filter_id: int, start_iso: str, end_iso: str) -> dict:
+    """Backtests a stored filter between two ISO-8601 dates (used by the web API); returns the result or {'error'}."""
+    db = SessionLocal()
+    try:
+        filter_obj = db.query(DBFilter).filter(DBFilter.id == filter_id).first()
+        if not filter_obj:
+            return {'error': f"Filter {filter_id} not found."}
+        start = datetime.fromisoformat(start_iso).replace(tzinfo=timezone.utc)
+        end = datetime.fromisoformat(end_iso).replace(tzinfo=timezone.utc)
+        result, error_msg = _run_async(run_filter_backtest(filter_obj, start, end))
+    finally:
+        db.close()
+    return {'error': error_msg} if error_msg else result
+
 celery_app.conf.beat_schedule = {
     'fetch-news-every-30-minutes': {
         'task': 'bot.tasks.fetch_news_task',
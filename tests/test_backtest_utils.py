@@ -0,0 +1,37 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("DB_CONNECTION_STRING", "sqlite://")
+
+from bot import backtest_utils
+from bot.backtest_utils import evaluate_plan_over_history
+from bot.chart_utils import compute_indicator_tail
+from bot.scanner_benchmark import benchmark_filter_params
+from bot.scanner_utils import compile_indicator_plan, evaluate_plan, plan_columns
+
+LOOKBACK = 150
+
+
+def _scan_tick_match(plan: dict, window: np.ndarray) -> bool:
+    # What a scan tick decides for the latest bar of the candles it fetched
+    values = compute_indicator_tail(window, plan['specs'], plan['tail'])
+    values['close'] = window[-plan['tail']:]
+    columns = list(dict.fromkeys(['close'] + plan_columns(plan)))
+    matrix = np.stack([np.atleast_1d(values.get(column, np.full(plan['tail'], np.nan))) for column in columns])
+    mask, _ = evaluate_plan(plan, matrix[None], {column: col for col, column in enumerate(columns)})
+    return bool(mask[0])
+
+
+def test_replay_matches_scan_ticks_on_trailing_windows(monkeypatch):
+    monkeypatch.setattr(backtest_utils, 'BACKTEST_WINDOW_CHUNK', 64) # Cross chunk boundaries
+    rng = np.random.default_rng(3)
+    close = 100 * np.exp(np.cumsum(rng.normal(scale=0.01, size=400)))
+    for index in range(7):
+        plan = compile_indicator_plan(benchmark_filter_params(index))
+        matched = evaluate_plan_over_history(plan, close, LOOKBACK)
+        expected = [False] * (LOOKBACK - 1) + [_scan_tick_match(plan, close[bar - LOOKBACK + 1:bar + 1])
+                                               for bar in range(LOOKBACK - 1, len(close))]
+        assert matched.tolist() == expected, benchmark_filter_params(index)
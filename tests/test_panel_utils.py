@@ -0,0 +1,41 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from bot.chart_utils import compute_indicator_tail
+from bot.panel_utils import compute_indicator_panel, latest_panel_values
+
+SPECS = (('RSI', (14,)), ('RSI', (7,)), ('EMA', (20,)), ('EMA', (50,)), ('MACD', (12, 26, 9)))
+
+
+def _closes(symbols: int, candles: int) -> list:
+    rng = np.random.default_rng(7)
+    return [100 * np.exp(np.cumsum(rng.normal(scale=0.01, size=candles))) for _ in range(symbols)]
+
+
+def test_panel_matches_talib_per_symbol():
+    closes = _closes(40, 150)
+    panel_values = compute_indicator_panel(np.stack(closes), SPECS)
+    for row, close in enumerate(closes):
+        for column, expected in compute_indicator_tail(close, SPECS, tail=len(close)).items():
+            actual = panel_values[column][row]
+            assert np.array_equal(np.isnan(actual), np.isnan(expected)), column
+            np.testing.assert_allclose(actual[~np.isnan(actual)], expected[~np.isnan(expected)], rtol=1e-9)
+
+
+def test_latest_panel_values_groups_series_by_length():
+    closes = _closes(6, 150)
+    symbol_arrays = {f"S{index}/USDT": {'close': close[index * 10:]} for index, close in enumerate(closes)}
+    symbol_arrays['EMPTY/USDT'] = None
+    latest = latest_panel_values(symbol_arrays, SPECS, tail=3)
+    assert 'EMPTY/USDT' not in latest
+    for symbol, arrays in symbol_arrays.items():
+        if arrays is None:
+            continue
+        expected = compute_indicator_tail(arrays['close'], SPECS, tail=3)
+        np.testing.assert_allclose(latest[symbol]['close'], arrays['close'][-3:])
+        for column, values in expected.items():
+            np.testing.assert_allclose(latest[symbol][column], values, rtol=1e-9, equal_nan=True)
@@ -0,0 +1,31 @@
+import os
+import sys
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("DB_CONNECTION_STRING", "sqlite://")
+
+from bot.cache_utils import current_candle_open
+from bot.scanner_benchmark import SyntheticExchange, run_scenario
+
+
+@pytest.mark.parametrize('timeframe', ['15m', '1h', '1d', '1w', '1M'])
+def test_synthetic_candles_follow_cache_alignment(timeframe):
+    exchange = SyntheticExchange(start=datetime(2024, 3, 14, 10, 30, tzinfo=timezone.utc))
+    candles = asyncio.run(exchange.fetch_ohlcv('SYN0000/USDT', timeframe, limit=30))
+    assert len(candles) == 30
+    assert candles[-1][0] == current_candle_open(timeframe, exchange.now_ms / 1000) * 1000
+    for previous, candle in zip(candles, candles[1:]):
+        assert current_candle_open(timeframe, candle[0] / 1000 - 1) * 1000 == previous[0] # No gaps or overlaps
+
+
+@pytest.mark.parametrize('timeframe', ['1h', '1w', '1M'])
+def test_warm_ticks_fetch_each_symbol_once(timeframe):
+    exchange_options = {'seed': 42, 'latency_ms': 0.0, 'jitter_ms': 0.0, 'error_rate': 0.0}
+    scenario = asyncio.run(run_scenario(2, 10, timeframe, 4, exchange_options, measure_memory=False))
+    warm_ticks = [tick for tick in scenario['ticks'] if not tick['cold']]
+    assert [tick['exchange_calls'] for tick in warm_ticks] == [10] * len(warm_ticks)
+    assert scenario['summary']['warm_one_call_per_symbol']
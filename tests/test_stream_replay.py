@@ -0,0 +1,71 @@
+import os
+import sys
+import asyncio
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("DB_CONNECTION_STRING", "sqlite://")
+
+from web.models import Base, User as DBUser, Filter as DBFilter
+from bot import stream_utils
+from bot.stream_utils import StreamScanner, ReplayFeed
+from bot.candle_utils import expire_candle_buffers
+from bot.exchange_utils import register_exchange_client
+from bot.scanner_benchmark import SyntheticExchange, benchmark_filter_params
+from bot.scanner_utils import SCANNER_OHLCV_LIMIT
+
+SYMBOLS = ['AAA/USDT', 'BBB/USDT']
+CANDLES = 200
+HOUR_MS = 60 * 60 * 1000
+
+
+def _write_replay_file(path: str):
+    last_closed = (int(time.time() * 1000) // HOUR_MS - 1) * HOUR_MS
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("symbol,timeframe,timestamp,open,high,low,close,volume\n")
+        for index in range(CANDLES):
+            timestamp = last_closed - (CANDLES - 1 - index) * HOUR_MS
+            for offset, symbol in enumerate(SYMBOLS):
+                close = 100 + offset + (index % 17) - (index % 5) * 1.5
+                f.write(f"{symbol},1h,{timestamp},{close},{close + 1},{close - 1},{close},1000\n")
+
+
+def test_replay_drives_full_ticks(tmp_path, monkeypatch):
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(stream_utils, 'SessionLocal', session_factory)
+    db_session = session_factory()
+    user = DBUser(telegram_id=1, first_name='replay')
+    db_session.add(user)
+    db_session.commit()
+    db_session.add(DBFilter(user_id=user.id, name='replay', params=benchmark_filter_params(0),
+                            symbols=SYMBOLS, timeframe='1h', active=True))
+    db_session.commit()
+    db_session.close()
+
+    # Buffers are filled by the replay only; any exchange call would show up here
+    exchange = SyntheticExchange()
+    register_exchange_client(stream_utils.DEFAULT_EXCHANGE_NAME, exchange)
+    expire_candle_buffers(drop=True)
+
+    replay_path = str(tmp_path / 'candles.csv')
+    _write_replay_file(replay_path)
+
+    async def replay():
+        feed = ReplayFeed(replay_path)
+        for symbol in SYMBOLS:
+            await feed.subscribe(symbol, '1h')
+        return await StreamScanner(feed, settle_seconds=1).run(sync=False)
+
+    stats = asyncio.run(replay())
+
+    assert stats['candles'] == CANDLES * len(SYMBOLS)
+    # One batch per candle close once both symbols reported it and the buffers hold a full lookback
+    assert stats['scan_batches'] == CANDLES - SCANNER_OHLCV_LIMIT + 1
+    assert stats['filter_runs'] >= 1
+    assert exchange.calls.get('fetch_ohlcv', 0) == 0
@@ -1,10 +1,14 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request # Added Request
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Header # Added Request
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any # Added Dict, Any
 from contextlib import asynccontextmanager
 import logging # For logging webhook calls
 
 import os # For path joining and env vars
+import time
+import uuid
+from datetime import date
+from celery import Celery
 from passlib.context import CryptContext
 from fastapi_admin.app import app as admin_app # FastAPI-Admin app instance
 from fastapi_admin.providers.login import UsernamePasswordProvider
@@ -167,6 +171,89 @@ def update_user(telegram_id: int, user: schemas.UserUpdate, db: Session = Depend
     db.refresh(db_user)
     return db_user
 
+# --- Scanner Backtests ---
+# Backtests run on the Celery workers (bot.tasks.backtest_filter_task), which have the market-data stack;
+# the API only enqueues them by name and reports their state.
+celery_client = Celery(
+    "tasks",
+    broker=os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"),
+    backend=os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/0")
+)
+
+# Each user may submit this many backtests per window; counted in Redis when REDIS_HOST is set
+# (shared by every API worker), otherwise per process
+BACKTEST_SUBMISSIONS_PER_WINDOW = int(os.getenv("BACKTEST_SUBMISSIONS_PER_WINDOW", "5"))
+BACKTEST_SUBMISSION_WINDOW_SECONDS = int(os.getenv("BACKTEST_SUBMISSION_WINDOW_SECONDS", "3600"))
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+_redis_client = None
+_backtest_submissions: Dict[int, List[float]] = {} # In-memory fallback: user id -> submission times in the window
+
+def _get_redis():
+    global _redis_client
+    if _redis_client is None and REDIS_HOST:
+        import redis
+        _redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+    return _redis_client
+
+def _backtest_retry_after(user_id: int) -> int:
+    """Counts a submission against the user's backtest budget; returns the seconds to wait, 0 if it is allowed."""
+    redis_client = _get_redis()
+    if redis_client is not None:
+        key = f"backtest_submissions:{user_id}"
+        redis_client.set(key, 0, ex=BACKTEST_SUBMISSION_WINDOW_SECONDS, nx=True) # Opens the window on the first submission
+        if redis_client.incr(key) > BACKTEST_SUBMISSIONS_PER_WINDOW:
+            return max(int(redis_client.ttl(key)), 1)
+        return 0
+    now = time.time()
+    recent = [submitted for submitted in _backtest_submissions.get(user_id, []) if submitted > now - BACKTEST_SUBMISSION_WINDOW_SECONDS]
+    _backtest_submissions[user_id] = recent
+    if len(recent) >= BACKTEST_SUBMISSIONS_PER_WINDOW:
+        return int(recent[0] + BACKTEST_SUBMISSION_WINDOW_SECONDS - now) + 1
+    recent.append(now)
+    return 0
+
+def get_api_user(x_api_key: str = Header(...), db: Session = Depends(get_db)) -> models.User:
+    """Resolves the calling user from the X-API-Key header (users.api_key)."""
+    db_user = db.query(models.User).filter(models.User.api_key == x_api_key).first()
+    if db_user is None:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    return db_user
+
+def _backtest_task_prefix(user_id: int) -> str:
+    # Task ids carry their owner, so results can be checked without storing anything per task
+    return f"backtest-{user_id}-"
+
+@app.post("/filters/{filter_id}/backtest", status_code=status.HTTP_202_ACCEPTED)
+def start_filter_backtest(filter_id: int, start: date, end: date, db: Session = Depends(get_db),
+                          api_user: models.User = Depends(get_api_user)):
+    db_filter = db.query(models.Filter).filter(models.Filter.id == filter_id, models.Filter.user_id == api_user.id).first()
+    if db_filter is None:
+        raise HTTPException(status_code=404, detail="Filter not found")
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    retry_after = _backtest_retry_after(api_user.id)
+    if retry_after:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many backtests, try again later",
+                            headers={"Retry-After": str(retry_after)})
+    task = celery_client.send_task('bot.tasks.backtest_filter_task', args=[filter_id, start.isoformat(), end.isoformat()],
+                                   task_id=f"{_backtest_task_prefix(api_user.id)}{uuid.uuid4()}")
+    return {"task_id": task.id, "status": "PENDING"}
+
+@app.get("/backtests/{task_id}")
+def read_filter_backtest(task_id: str, api_user: models.User = Depends(get_api_user)):
+    if not task_id.startswith(_backtest_task_prefix(api_user.id)):
+        raise HTTPException(status_code=404, detail="Backtest not found")
+    task = celery_client.AsyncResult(task_id)
+    if not task.ready():
+        return {"task_id": task_id, "status": task.state}
+    if task.failed():
+        return {"task_id": task_id, "status": task.state, "error": str(task.result)}
+    result = task.result or {}
+    if result.get("error"):
+        return {"task_id": task_id, "status": "FAILED", "error": result["error"]}
+    return {"task_id": task_id, "status": task.state, "result": result}
+
 # Placeholder for a root endpoint
 @app.get("/")
 async def root():